@@ -1,45 +1,105 @@
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Depends, Form
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Depends, Form, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBearer
 from starlette.middleware.sessions import SessionMiddleware
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
 from .models.models import DataStructure, Shop, Category, Zone
 from pydantic import BaseModel
 import json
 from typing import List, Optional, Dict
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
-from .utils.working_hours import parse_legacy_working_hours, is_shop_open, format_working_hours, parse_time
+from .utils.working_hours import parse_legacy_working_hours, format_working_hours, parse_time
 import secrets
-from .utils.security import authenticate_user, create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from .utils.repository import DataRepository
+from .utils.persistence import JournalStore, PersistenceWorker, paused_gc
+from .utils.sqlite_store import SQLiteStore
+from .utils.sync import DataSynchronizer, FileChangeBus
+from .utils.snapshot import SnapshotCache
+from .utils.branding import BrandingCache, default_branding, empty_branding
+from .utils.analytics import shops_by_zone, top_categories, working_hours_coverage
+from .utils.charts import PLOTLY_JS_PATH, FigureCache, chart_html, dashboard_html, plotly_js
+from .utils.images import ImagePipeline, PendingRenditions
+from .utils.image_gc import DeleteQueue, ImageCollector
+from .utils.batch import BatchError, BatchOperation, BatchPlanner
+from .utils.bulk import MEDIA_TYPES, ShopImport, csv_rows, detect_format, export_csv, export_ndjson, iter_lines, ndjson_rows
+from .utils.references import BANNER_FIELDS, field_image_urls, rendition_urls, shop_image_urls
+from .utils.security import LoginBusy, PasswordVerifier, create_access_token, get_current_user, verify_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from .utils.ratelimit import LoginLimiter, RateLimiter
+from .utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, Gauge, Histogram, MetricsMiddleware
+from .utils.watchdog import LoopWatchdog, LoopWatchdogMiddleware
+from .utils.workers import ProcessPool
 from datetime import time, timedelta, datetime
-import jwt
-from jose import JWTError
 import time
 import psutil
 import platform
+import asyncio
+import gc
+import math
+from functools import partial
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Import storage after loading environment variables
-from .utils.storage import CloudStorage
-
-# Get security variables
-ALGORITHM = "HS256"
-SECRET_KEY = os.getenv("SECRET_KEY")
-ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
+from .utils.storage import CloudStorage, LocalStorage, LazyStorage, ImmutableStaticFiles, cloud_base_url
 
 # Get environment
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 IS_PRODUCTION = ENVIRONMENT == "production"
 
-app = FastAPI(title="Mayoristas Paraguay Backend")
-storage = CloudStorage()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await persistence.start()
+    if DATA_SYNC_INTERVAL > 0:
+        await synchronizer.start()
+    await delete_queue.start()
+    if IMAGE_GC_INTERVAL > 0:
+        await image_collector.start()
+    if LOOP_WATCHDOG_THRESHOLD > 0:
+        await loop_watchdog.start()
+    yield
+    await loop_watchdog.stop()
+    await image_collector.stop()
+    await delete_queue.stop()
+    await synchronizer.stop()
+    # Make sure queued journal records reach the disk before the process exits
+    await persistence.stop()
+    chart_pool.shutdown()
+    image_pool.shutdown()
+    password_verifier.close()
+    storage.close()
+
+app = FastAPI(title="Mayoristas Paraguay Backend", lifespan=lifespan)
+
+# Image storage: gcs (Google Cloud Storage), local (files under STORAGE_LOCAL_DIR, served at /uploads)
+# or memory (kept in memory, for load tests)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", "uploads")
+storage_options = dict(
+    concurrency=int(os.getenv("STORAGE_CONCURRENCY", "4")),
+    timeout=int(os.getenv("STORAGE_TIMEOUT_MS", "30000")) / 1000,
+    retries=int(os.getenv("STORAGE_RETRIES", "3")),
+    backoff=int(os.getenv("STORAGE_RETRY_BACKOFF_MS", "500")) / 1000
+)
+if STORAGE_BACKEND == "gcs":
+    storage_factory = partial(CloudStorage, **storage_options)
+    storage_base_url = cloud_base_url(os.environ["GCP_BUCKET_NAME"]) if os.getenv("GCP_BUCKET_NAME") else None
+elif STORAGE_BACKEND in ("local", "memory"):
+    storage_base_url = "/uploads"
+    storage_factory = partial(
+        LocalStorage,
+        root=STORAGE_LOCAL_DIR if STORAGE_BACKEND == "local" else None,
+        base_url=storage_base_url,
+        latency=int(os.getenv("STORAGE_LATENCY_MS", "0")) / 1000,
+        **storage_options
+    )
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, expected 'gcs', 'local' or 'memory'")
+# Created on the first upload or delete. Whether a URL is ours is known without creating it
+storage = LazyStorage(storage_factory, base_url=storage_base_url)
 
 # Add session middleware for CSRF protection
 app.add_middleware(
@@ -48,19 +108,58 @@ app.add_middleware(
     session_cookie="session",
     max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,  # in seconds
 )
+# Opt-in: report callbacks that block the event loop longer than LOOP_WATCHDOG_MS (0 disables it)
+LOOP_WATCHDOG_THRESHOLD = int(os.getenv("LOOP_WATCHDOG_MS", "0")) / 1000
+loop_watchdog = LoopWatchdog(threshold=LOOP_WATCHDOG_THRESHOLD)
+if LOOP_WATCHDOG_THRESHOLD > 0:
+    app.add_middleware(LoopWatchdogMiddleware, watchdog=loop_watchdog)
+# Request counts and latencies per route for /metrics (outermost, so it times the whole stack)
+app.add_middleware(MetricsMiddleware)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
+if STORAGE_BACKEND == "local":
+    os.makedirs(STORAGE_LOCAL_DIR, exist_ok=True)
+    app.mount("/uploads", ImmutableStaticFiles(directory=STORAGE_LOCAL_DIR), name="uploads")
 
 # Initialize templates
 templates = Jinja2Templates(directory="app/templates")
 
 DATA_FILE = "data.json"
+DATA_BACKEND = os.getenv("DATA_BACKEND", "json")
+
+if DATA_BACKEND == "sqlite":
+    # data.json is only read once, to seed an empty database
+    data_store_path = os.getenv("SQLITE_PATH", "data.db")
+    data_store = SQLiteStore(data_store_path, migrate_from=DATA_FILE)
+elif DATA_BACKEND == "json":
+    data_store_path = DATA_FILE
+    data_store = JournalStore(DATA_FILE, compact_after=int(os.getenv("JOURNAL_COMPACT_AFTER", "1000")))
+else:
+    raise ValueError(f"Unknown DATA_BACKEND {DATA_BACKEND!r}, expected 'json' or 'sqlite'")
+# Durability of admin writes: sync, group (group commit window, the default) or async
+# (acknowledged before the fsync, a crash can lose the last PERSISTENCE_WINDOW_MS of writes)
+persistence = PersistenceWorker(
+    data_store,
+    mode=os.getenv("PERSISTENCE_MODE", "group"),
+    window=int(os.getenv("PERSISTENCE_WINDOW_MS", "50")) / 1000
+)
 
 # Modelos para las solicitudes
 class ImageUrl(BaseModel):
     url: str = ""
 
+# Paginated result of the public shop query
+class ShopPage(BaseModel):
+    items: List[Shop]
+    next_cursor: Optional[int] = None
+    total: int
+
+class ShopSearchResults(BaseModel):
+    items: List[Shop]
+    scores: List[float]
+    total: int
+
 # Health check model
 class HealthCheck(BaseModel):
     status: str
@@ -72,48 +171,197 @@ class HealthCheck(BaseModel):
     memory_usage: Dict[str, float]
     details: Dict[str, str]
 
+LOAD_SECONDS = Histogram("data_load_duration_seconds", "Time to load the whole catalogue from the data store")
+LOAD_BYTES = Gauge("data_load_bytes", "Size of the data store read by the last load")
+SAVE_SECONDS = Histogram(
+    "data_save_duration_seconds", "Time a write request waits in save_data (depends on PERSISTENCE_MODE)"
+)
+SAVE_RECORDS = Histogram(
+    "data_save_records", "Journal records handed over per save_data call", buckets=(1, 2, 5, 10, 100, 1000, 10000)
+)
+PROCESS_MEMORY = Gauge(
+    "process_resident_memory_bytes", "Resident memory of this worker process",
+    function=lambda: psutil.Process().memory_info().rss
+)
+
 def load_data() -> DataStructure:
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        return DataStructure(**data)
+    """Load the current state from the configured storage backend"""
+    with LOAD_SECONDS.time():
+        data = data_store.load()
+    LOAD_BYTES.set(data_store.size())
+    return data
+
+async def save_data():
+    """Hand the mutations recorded by the repository to the persistence worker"""
+    with SAVE_SECONDS.time():
+        changes = repository.drain_changes()
+        SAVE_RECORDS.observe(len(changes))
+        synchronizer.track(changes)
+        await persistence.submit(changes)
 
-def save_data(data: DataStructure):
-    def time_handler(obj):
-        if hasattr(obj, 'model_dump'):
-            return obj.model_dump()
-        if isinstance(obj, time):
-            return obj.strftime("%H:%M")
-        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+# Load initial data
+with paused_gc():
+    repository = DataRepository(load_data())
+data_structure = repository.data
+# The catalogue lives as long as the process: keep it out of future GC scans
+gc.freeze()
+
+# Pick up writes made by other worker processes (uvicorn --workers, several containers)
+DATA_SYNC_INTERVAL = int(os.getenv("DATA_SYNC_INTERVAL_MS", "1000")) / 1000
+synchronizer = DataSynchronizer(
+    data_store,
+    repository,
+    FileChangeBus(f"{data_store_path}.bus"),
+    interval=DATA_SYNC_INTERVAL
+)
+persistence.on_commit = synchronizer.committed
 
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data.model_dump(), f, indent=2, ensure_ascii=False, default=time_handler)
+# Serialized /api/data payload, rebuilt only when the data changes
+data_snapshot = SnapshotCache(repository)
+DATA_CACHE_CONTROL = f"public, max-age={int(os.getenv('DATA_CACHE_MAX_AGE', '0'))}, must-revalidate"
 
-# Load initial data
-data_structure = load_data()
+# Default branding values from environment variables, resolved once at startup
+BRANDING_DEFAULTS = default_branding(
+    logo=os.getenv("DEFAULT_BRANDING_LOGO"),
+    copyright=os.getenv("DEFAULT_BRANDING_COPYRIGHT"),
+    contact_number=os.getenv("DEFAULT_BRANDING_CONTACT"),
+)
+branding_cache = BrandingCache(repository, BRANDING_DEFAULTS)
+
+# Chart figures are built in worker processes (Plotly is CPU heavy) and cached per data revision.
+# The pools start on first use and are replaced if a worker dies
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "1"))
+chart_pool = ProcessPool(ANALYTICS_WORKERS, name="chart")
+figure_cache = FigureCache(repository, chart_pool.run)
+
+# Uploaded images are re-encoded into renditions in worker processes (Pillow is CPU heavy)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "1"))
+image_pool = ProcessPool(IMAGE_WORKERS, name="image")
+image_pipeline = ImagePipeline(storage, image_pool.run)
+
+# Storage folders the uploads go to, swept for unreferenced images
+IMAGE_FOLDERS = ("shops", "primary-banners", "secondary-banners", "recommended", "other-business", "branding")
+
+def image_in_use(url: str) -> bool:
+    return url in repository.image_refs
+
+# Unused images are deleted in the background, in batches, from a queue that survives restarts
+delete_queue = DeleteQueue(
+    f"{data_store_path}.deletes",
+    storage,
+    image_in_use,
+    interval=int(os.getenv("IMAGE_DELETE_INTERVAL_MS", "5000")) / 1000,
+    batch_size=int(os.getenv("IMAGE_DELETE_BATCH_SIZE", "100"))
+)
+# Periodic mark-and-sweep of images that nothing references (0 disables it)
+IMAGE_GC_INTERVAL = int(os.getenv("IMAGE_GC_INTERVAL_MS", "86400000")) / 1000
+# Objects younger than this are never swept: they may be uploads about to be saved
+IMAGE_GC_MIN_AGE = int(os.getenv("IMAGE_GC_MIN_AGE_MS", "3600000")) / 1000
+image_collector = ImageCollector(
+    storage,
+    delete_queue,
+    image_in_use,
+    IMAGE_FOLDERS,
+    interval=IMAGE_GC_INTERVAL,
+    min_age=IMAGE_GC_MIN_AGE
+)
+# Renditions of uploads not saved on a shop or banner yet. They expire when the
+# collector may sweep the unreferenced objects, so an expired upload gets none
+pending_renditions = PendingRenditions(ttl=IMAGE_GC_MIN_AGE)
+
+async def upload_image(file: UploadFile, folder: str) -> Dict:
+    """Optimize and upload an image. Its renditions are held until a shop or banner saving it takes them"""
+    url, renditions = await image_pipeline.upload(file, folder)
+    # Identical content maps to the same objects: they may have been queued for deletion
+    delete_queue.discard([url, *rendition_urls(renditions)])
+    if renditions:
+        pending_renditions.put(url, renditions)
+    return {"url": url, "renditions": renditions}
+
+def take_renditions(shop: Shop, previous: Optional[Shop] = None) -> None:
+    """Move the renditions of a newly uploaded image onto the shop, or keep those of an unchanged image"""
+    renditions = pending_renditions.take(shop.img)
+    if renditions is not None:
+        shop.img_renditions = renditions
+    elif previous is not None and shop.img == previous.img and shop.img_renditions is None:
+        shop.img_renditions = previous.img_renditions
+
+def take_banner_renditions() -> List[str]:
+    """Keep renditions only for the images the banner, image and branding fields use.
+
+    New images take their pending renditions. Returns the rendition URLs of
+    the images no longer used, to release once the change is saved.
+    """
+    current = data_structure.banner_renditions
+    used = [url for field in BANNER_FIELDS for url in field_image_urls(field, getattr(data_structure, field))]
+    renditions = {}
+    for url in used:
+        taken = current.get(url) or pending_renditions.take(url)
+        if taken:
+            renditions[url] = taken
+    if renditions != current:
+        repository.set_field("banner_renditions", renditions)
+    return [url for image, dropped in current.items() if image not in renditions for url in rendition_urls(dropped)]
+
+def forget_image(url: str) -> List[str]:
+    """Drop the pending renditions of an image, return the URLs to release"""
+    return [url, *rendition_urls(pending_renditions.take(url))]
+
+def release_images(urls: List[str]) -> None:
+    """Queue the stored images among urls that no record references anymore for deletion.
+
+    Identical uploads share one object, so an image is only deleted once no
+    shop, banner, image or branding entry uses it. Call after saving the change
+    that dropped the references.
+    """
+    delete_queue.enqueue(url for url in dict.fromkeys(urls) if not image_in_use(url) and storage.owns(url))
+
+def replace_image_field(field: str, value) -> List[str]:
+    """Replace a banner or image field, return the image URLs it released"""
+    removed = set(field_image_urls(field, getattr(data_structure, field))) - set(field_image_urls(field, value))
+    repository.set_field(field, value)
+    return [*removed, *take_banner_renditions()]
+
+async def set_image_field(field: str, value) -> None:
+    """Replace a banner or image field and delete the images it no longer uses"""
+    released = replace_image_field(field, value)
+    await save_data()
+    release_images(released)
+
+# Passwords are checked with bcrypt on a small thread pool, never on the event loop
+password_verifier = PasswordVerifier(workers=int(os.getenv("PASSWORD_WORKERS", "2")))
+# Login attempts per client IP and per username, per minute (also the allowed burst)
+LOGIN_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_ATTEMPTS_PER_IP", "10"))
+LOGIN_ATTEMPTS_PER_USERNAME = int(os.getenv("LOGIN_ATTEMPTS_PER_USERNAME", "30"))
+login_limiter = LoginLimiter(
+    per_ip=RateLimiter(rate=LOGIN_ATTEMPTS_PER_IP / 60, burst=LOGIN_ATTEMPTS_PER_IP),
+    per_username=RateLimiter(rate=LOGIN_ATTEMPTS_PER_USERNAME / 60, burst=LOGIN_ATTEMPTS_PER_USERNAME)
+)
+# Reverse proxies in front of the app that append to X-Forwarded-For (1 on Render, 0 when clients connect directly)
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+def client_ip(request: Request) -> str:
+    """The client address as seen by the outermost trusted proxy.
+
+    Entries left of the ones our proxies appended are sent by the client and
+    can be anything, so only the entry added by the outermost trusted proxy
+    is used. Without proxies, or when the header is missing, it is the peer address.
+    """
+    if TRUSTED_PROXY_HOPS > 0:
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
 
 # Authentication routes
 @app.get("/", response_class=HTMLResponse)
 async def login_page(request: Request):
-    print("DEBUG: Checking authentication at root path")  # Debug print
     # Check if user is already authenticated
-    try:
-        auth_cookie = request.cookies.get("Authorization")
-        if auth_cookie and auth_cookie.startswith("Bearer "):
-            token = auth_cookie.replace("Bearer ", "")
-            print(f"DEBUG: Found token: {token[:20]}...")  # Debug print
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            username = payload.get("sub")
-            print(f"DEBUG: Decoded username: {username}")  # Debug print
-            if username == ADMIN_USERNAME:
-                print("DEBUG: User is authenticated, redirecting to /admin")  # Debug print
-                return RedirectResponse(url="/admin", status_code=302)
-    except JWTError as e:
-        print(f"DEBUG: JWT Error: {str(e)}")  # Debug print
-    except Exception as e:
-        print(f"DEBUG: Unexpected error: {str(e)}")  # Debug print
+    auth_cookie = request.cookies.get("Authorization")
+    if auth_cookie and auth_cookie.startswith("Bearer ") and verify_token(auth_cookie[len("Bearer "):]):
+        return RedirectResponse(url="/admin", status_code=302)
 
     # If not authenticated, show login page
-    print("DEBUG: User not authenticated, showing login page")  # Debug print
     csrf_token = secrets.token_hex(32)
     request.session["csrf_token"] = csrf_token
     return templates.TemplateResponse("login.html", {
@@ -128,6 +376,16 @@ async def login(
     password: str = Form(...),
     csrf_token: str = Form(...)
 ):
+    # Throttle before any hashing happens
+    ip = client_ip(request)
+    wait = login_limiter.attempt(ip, username)
+    if wait > 0:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": "Too many login attempts, please try again later",
+            "csrf_token": csrf_token
+        }, status_code=429, headers={"Retry-After": str(math.ceil(wait))})
+
     # Verify CSRF token
     stored_csrf = request.session.get("csrf_token")
     if not stored_csrf or stored_csrf != csrf_token:
@@ -136,7 +394,17 @@ async def login(
             "error": "Invalid CSRF token"
         }, status_code=400)
 
-    if authenticate_user(username, password):
+    try:
+        authenticated = await password_verifier.authenticate(username, password)
+    except LoginBusy:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": "Too many login attempts, please try again later",
+            "csrf_token": csrf_token
+        }, status_code=503, headers={"Retry-After": "1"})
+
+    if authenticated:
+        login_limiter.succeeded(ip, username)
         access_token = create_access_token(
             data={"sub": username},
             expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -161,8 +429,6 @@ async def login(
         
         # Set the auth cookie with appropriate settings
         response.set_cookie(**cookie_settings)
-        
-        print("DEBUG: Setting cookie with token:", access_token[:20], "...")  # Debug print
         return response
     
     return templates.TemplateResponse("login.html", {
@@ -195,7 +461,6 @@ async def admin_dashboard(
     request: Request,
     current_user: str = Depends(get_current_user)
 ):
-    print("DEBUG: Reached admin_dashboard with user:", current_user)  # Debug print
     # Calculate statistics
     total_shops = len(data_structure.shops)
     total_categories = len(data_structure.categories)
@@ -270,26 +535,136 @@ async def admin_banners(
 async def get_shops(current_user: str = Depends(get_current_user)):
     return data_structure.shops
 
+@app.get("/api/shops/query", response_model=ShopPage)
+async def query_shops(
+    category: Optional[int] = None,
+    zone: Optional[int] = None,
+    city: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = None
+):
+    """Public, filtered and cursor-paginated shop listing served from the repository indexes"""
+    items, next_cursor, total = repository.query_shops(
+        category_id=category,
+        zone_id=zone,
+        city=city,
+        after=cursor,
+        limit=limit
+    )
+    return ShopPage(items=items, next_cursor=next_cursor, total=total)
+
+@app.get("/api/shops/search", response_model=ShopSearchResults)
+async def search_shops(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    prefix: bool = True
+):
+    """Public full-text shop search by name, owner, city, description and category names.
+
+    Accents and case are ignored and plural/gender endings folded ("electronica" finds "Electrónicos").
+    Every word has to match; with `prefix` the last one also matches as the start of a word, for typeahead.
+    Results are ranked by relevance (BM25), `total` counts all matches.
+    """
+    items, scores, total = repository.search_shops(q, limit=limit, prefix=prefix)
+    return ShopSearchResults(items=items, scores=scores, total=total)
+
+# Declared before /api/shops/{shop_id} so "open" isn't parsed as a shop id
+@app.get("/api/shops/open", response_model=List[Shop])
+async def get_open_shops(
+    at: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    entire: bool = False
+):
+    """Shops open now, at `at`, or during [at, until). Times without a timezone are Paraguay local time.
+
+    With `entire=true` a shop has to be open for the whole window.
+    """
+    return repository.open_shops(at=at, window_end=until, entire=entire)
+
+@app.post("/api/shops/import")
+async def import_shops(
+    request: Request,
+    format: Optional[str] = None,
+    upsert: bool = False,
+    dry_run: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Create shops from an NDJSON or CSV body (see README), saved with a single write.
+
+    Rows are validated as they stream in. Invalid rows are reported by line
+    number and skipped, the valid ones are imported. With `upsert=true` rows
+    with an existing ID replace that shop; `dry_run=true` only validates.
+    """
+    try:
+        import_format = detect_format(request.headers.get("content-type"), format)
+        lines = iter_lines(request.stream())
+        rows = csv_rows(lines) if import_format == "csv" else ndjson_rows(lines)
+        shop_import = ShopImport(repository, upsert=upsert)
+        await shop_import.read(rows)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="The body must be UTF-8 encoded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    created = updated = 0
+    replaced: List[Shop] = []
+    if not dry_run:
+        # Checked while streaming: check again against the data as it is now, then apply without awaiting
+        shop_import.recheck()
+        for shop in shop_import.shops:
+            existing = repository.get_shop(shop.id)
+            take_renditions(shop, previous=existing)
+            if existing is None:
+                repository.add_shop(shop)
+                created += 1
+            else:
+                replaced.append(repository.replace_shop(shop.id, shop))
+                updated += 1
+        if shop_import.shops:
+            await save_data()
+            release_images([url for shop in replaced for url in shop_image_urls(shop)])
+    return {
+        "rows": shop_import.rows,
+        "valid": len(shop_import.shops),
+        "created": created,
+        "updated": updated,
+        "failed": shop_import.error_count,
+        "errors": shop_import.errors,
+        "dry_run": dry_run
+    }
+
+@app.get("/api/shops/export")
+async def export_shops(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), current_user: str = Depends(get_current_user)):
+    """Stream every shop as NDJSON or CSV (the formats accepted by /api/shops/import)"""
+    # The shops as of now; the rows are encoded chunk by chunk while streaming
+    shops = list(data_structure.shops)
+    encode = export_csv if format == "csv" else export_ndjson
+    return StreamingResponse(
+        encode(shops),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="shops.{format}"'}
+    )
+
 @app.get("/api/shops/{shop_id}", response_model=Shop)
 async def get_shop(shop_id: int, current_user: str = Depends(get_current_user)):
-    for shop in data_structure.shops:
-        if shop.id == shop_id:
-            return shop
-    raise HTTPException(status_code=404, detail="Shop not found")
+    shop = repository.get_shop(shop_id)
+    if shop is None:
+        raise HTTPException(status_code=404, detail="Shop not found")
+    return shop
 
 @app.post("/api/shops", response_model=Shop)
 async def create_shop(shop: Shop, current_user: str = Depends(get_current_user)):
     # Check if ID already exists
-    if any(s.id == shop.id for s in data_structure.shops):
+    if shop.id in repository.shops:
         raise HTTPException(status_code=400, detail="Shop ID already exists")
     
     # Validate categories exist
-    for cat_id in shop.categories:
-        if not any(c.id == cat_id for c in data_structure.categories):
-            raise HTTPException(status_code=400, detail=f"Category ID {cat_id} does not exist")
+    missing = repository.missing_categories(shop.categories)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Category ID {missing[0]} does not exist")
     
     # Validate zone exists
-    if not any(z.id == shop.zone_id for z in data_structure.zones):
+    if not repository.zone_exists(shop.zone_id):
         raise HTTPException(status_code=400, detail="Zone ID does not exist")
     
     # Convert working hours time strings to time objects
@@ -303,80 +678,132 @@ async def create_shop(shop: Shop, current_user: str = Depends(get_current_user))
                 except ValueError as e:
                     raise HTTPException(status_code=400, detail=f"Invalid time format for {day}: {str(e)}")
     
-    data_structure.shops.append(shop)
-    save_data(data_structure)
+    take_renditions(shop)
+    repository.add_shop(shop)
+    await save_data()
     return shop
 
 @app.put("/api/shops/{shop_id}", response_model=Shop)
 async def update_shop(shop_id: int, updated_shop: Shop):
-    for i, shop in enumerate(data_structure.shops):
-        if shop.id == shop_id:
-            # Validate categories exist
-            for cat_id in updated_shop.categories:
-                if not any(c.id == cat_id for c in data_structure.categories):
-                    raise HTTPException(status_code=400, detail=f"Category ID {cat_id} does not exist")
-            
-            # Validate zone exists
-            if not any(z.id == updated_shop.zone_id for z in data_structure.zones):
-                raise HTTPException(status_code=400, detail="Zone ID does not exist")
-            
-            # Convert working hours time strings to time objects
-            if updated_shop.working_hours:
-                for day in ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']:
-                    day_schedule = getattr(updated_shop.working_hours, day)
-                    if day_schedule and isinstance(day_schedule.open_time, str):
-                        try:
-                            day_schedule.open_time = parse_time(day_schedule.open_time)
-                            day_schedule.close_time = parse_time(day_schedule.close_time)
-                        except ValueError as e:
-                            raise HTTPException(status_code=400, detail=f"Invalid time format for {day}: {str(e)}")
-            
-            # If image has changed, delete the old one
-            if shop.img and shop.img != updated_shop.img:
+    shop = repository.get_shop(shop_id)
+    if shop is None:
+        raise HTTPException(status_code=404, detail="Shop not found")
+
+    # Changing the ID must not collide with another shop
+    if updated_shop.id != shop_id and updated_shop.id in repository.shops:
+        raise HTTPException(status_code=400, detail="Shop ID already exists")
+
+    # Validate categories exist
+    missing = repository.missing_categories(updated_shop.categories)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Category ID {missing[0]} does not exist")
+    
+    # Validate zone exists
+    if not repository.zone_exists(updated_shop.zone_id):
+        raise HTTPException(status_code=400, detail="Zone ID does not exist")
+    
+    # Convert working hours time strings to time objects
+    if updated_shop.working_hours:
+        for day in ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']:
+            day_schedule = getattr(updated_shop.working_hours, day)
+            if day_schedule and isinstance(day_schedule.open_time, str):
                 try:
-                    await storage.delete_file(shop.img)
-                except Exception as e:
-                    print(f"Error deleting old image: {e}")
-            
-            data_structure.shops[i] = updated_shop
-            save_data(data_structure)
-            return updated_shop
-    raise HTTPException(status_code=404, detail="Shop not found")
+                    day_schedule.open_time = parse_time(day_schedule.open_time)
+                    day_schedule.close_time = parse_time(day_schedule.close_time)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid time format for {day}: {str(e)}")
+    
+    take_renditions(updated_shop, previous=shop)
+    repository.replace_shop(shop_id, updated_shop)
+    await save_data()
+    # If image has changed, delete the old one (unless something else still uses it)
+    release_images(shop_image_urls(shop))
+    return updated_shop
 
 @app.patch("/api/shops/{shop_id}", response_model=Shop)
 async def patch_shop(shop_id: int, updated_fields: dict):
-    for i, shop in enumerate(data_structure.shops):
-        if shop.id == shop_id:
-            # Create a copy of the current shop data
-            shop_data = shop.model_dump()
-            
-            # Update only the provided fields
-            for field, value in updated_fields.items():
-                if field in shop_data:
-                    # If updating image, delete the old one
-                    if field == 'img' and shop.img and shop.img != value:
-                        try:
-                            await storage.delete_file(shop.img)
-                        except Exception as e:
-                            print(f"Error deleting old image: {e}")
-                    shop_data[field] = value
-            
-            # Create updated shop instance
-            updated_shop = Shop(**shop_data)
-            data_structure.shops[i] = updated_shop
-            save_data(data_structure)
-            return updated_shop
-            
-    raise HTTPException(status_code=404, detail="Shop not found")
+    shop = repository.get_shop(shop_id)
+    if shop is None:
+        raise HTTPException(status_code=404, detail="Shop not found")
+
+    # Create a copy of the current shop data
+    shop_data = shop.model_dump()
+    
+    # Update only the provided fields
+    for field, value in updated_fields.items():
+        if field in shop_data:
+            # A new image comes with its own renditions
+            if field == 'img' and shop.img != value and 'img_renditions' not in updated_fields:
+                shop_data['img_renditions'] = None
+            shop_data[field] = value
+    
+    # Create updated shop instance
+    updated_shop = Shop(**shop_data)
+    if updated_shop.id != shop_id and updated_shop.id in repository.shops:
+        raise HTTPException(status_code=400, detail="Shop ID already exists")
+    take_renditions(updated_shop, previous=shop)
+    repository.replace_shop(shop_id, updated_shop)
+    await save_data()
+    # If the image changed, delete the old one (unless something else still uses it)
+    release_images(shop_image_urls(shop))
+    return updated_shop
 
 @app.delete("/api/shops/{shop_id}")
 async def delete_shop(shop_id: int):
-    for i, shop in enumerate(data_structure.shops):
-        if shop.id == shop_id:
-            data_structure.shops.pop(i)
-            save_data(data_structure)
-            return {"message": "Shop deleted successfully"}
-    raise HTTPException(status_code=404, detail="Shop not found")
+    if shop_id not in repository.shops:
+        raise HTTPException(status_code=404, detail="Shop not found")
+    shop = repository.get_shop(shop_id)
+    repository.remove_shop(shop_id)
+    await save_data()
+    release_images(shop_image_urls(shop))
+    return {"message": "Shop deleted successfully"}
+
+@app.post("/api/batch")
+async def apply_batch(operations: List[BatchOperation], current_user: str = Depends(get_current_user)):
+    """Apply an ordered list of operations on shops, categories, zones and banners, all or nothing.
+
+    Every operation is validated first, against the state left by the ones
+    before it. If one is invalid nothing changes and the response names it
+    (`detail.index`). Otherwise all of them are applied and saved with a
+    single write.
+    """
+    try:
+        steps = BatchPlanner(repository).plan(operations)
+    except BatchError as e:
+        raise HTTPException(status_code=e.status_code, detail={"index": e.index, "error": e.detail})
+
+    # Nothing awaits until every step is applied, so no request sees half a batch
+    entities = {
+        "shops": (repository.get_shop, repository.add_shop, repository.replace_shop, repository.remove_shop),
+        "categories": (repository.get_category, repository.add_category, repository.replace_category, repository.remove_category),
+        "zones": (repository.get_zone, repository.add_zone, repository.replace_zone, repository.remove_zone),
+    }
+    released: List[str] = []
+    results = []
+    for step in steps:
+        if step.entity not in entities:
+            released.extend(replace_image_field(step.entity, step.item))
+            results.append({"entity": step.entity, "op": step.op})
+            continue
+        get, add, replace, remove = entities[step.entity]
+        previous = get(step.id) if step.op != "create" else None
+        if step.item is None:
+            remove(step.id)
+        else:
+            if step.entity == "shops":
+                take_renditions(step.item, previous=previous)
+            if previous is None:
+                add(step.item)
+            else:
+                replace(step.id, step.item)
+        if step.entity == "shops" and previous is not None:
+            released.extend(shop_image_urls(previous))
+        results.append({"entity": step.entity, "op": step.op, "id": step.id if step.item is None else step.item.id})
+
+    if steps:
+        await save_data()
+    release_images(released)
+    return {"applied": len(steps), "results": results}
 
 # CRUD Operations for Categories
 @app.get("/api/categories", response_model=List[Category])
@@ -385,44 +812,43 @@ async def get_categories(current_user: str = Depends(get_current_user)):
 
 @app.get("/api/categories/{category_id}", response_model=Category)
 async def get_category(category_id: int, current_user: str = Depends(get_current_user)):
-    for category in data_structure.categories:
-        if category.id == category_id:
-            return category
-    raise HTTPException(status_code=404, detail="Category not found")
+    category = repository.get_category(category_id)
+    if category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return category
 
 @app.post("/api/categories", response_model=Category)
 async def create_category(category: Category, current_user: str = Depends(get_current_user)):
-    if any(c.id == category.id for c in data_structure.categories):
+    if category.id in repository.categories:
         raise HTTPException(status_code=400, detail="Category ID already exists")
-    data_structure.categories.append(category)
-    save_data(data_structure)
+    repository.add_category(category)
+    await save_data()
     return category
 
 @app.put("/api/categories/{category_id}", response_model=Category)
 async def update_category(category_id: int, updated_category: Category):
-    for i, category in enumerate(data_structure.categories):
-        if category.id == category_id:
-            data_structure.categories[i] = updated_category
-            save_data(data_structure)
-            return updated_category
-    raise HTTPException(status_code=404, detail="Category not found")
+    if category_id not in repository.categories:
+        raise HTTPException(status_code=404, detail="Category not found")
+    if updated_category.id != category_id and updated_category.id in repository.categories:
+        raise HTTPException(status_code=400, detail="Category ID already exists")
+    repository.replace_category(category_id, updated_category)
+    await save_data()
+    return updated_category
 
 @app.delete("/api/categories/{category_id}")
 async def delete_category(category_id: int):
     # Check if category is being used by any shop
-    for shop in data_structure.shops:
-        if category_id in shop.categories:
-            raise HTTPException(
-                status_code=400,
-                detail="Cannot delete category as it is being used by one or more shops"
-            )
+    if repository.category_in_use(category_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Cannot delete category as it is being used by one or more shops"
+        )
     
-    for i, category in enumerate(data_structure.categories):
-        if category.id == category_id:
-            data_structure.categories.pop(i)
-            save_data(data_structure)
-            return {"message": "Category deleted successfully"}
-    raise HTTPException(status_code=404, detail="Category not found")
+    if category_id not in repository.categories:
+        raise HTTPException(status_code=404, detail="Category not found")
+    repository.remove_category(category_id)
+    await save_data()
+    return {"message": "Category deleted successfully"}
 
 # CRUD Operations for Zones
 @app.get("/api/zones", response_model=List[Zone])
@@ -431,58 +857,55 @@ async def get_zones(current_user: str = Depends(get_current_user)):
 
 @app.get("/api/zones/{zone_id}", response_model=Zone)
 async def get_zone(zone_id: int, current_user: str = Depends(get_current_user)):
-    for zone in data_structure.zones:
-        if zone.id == zone_id:
-            return zone
-    raise HTTPException(status_code=404, detail="Zone not found")
+    zone = repository.get_zone(zone_id)
+    if zone is None:
+        raise HTTPException(status_code=404, detail="Zone not found")
+    return zone
 
 @app.post("/api/zones", response_model=Zone)
 async def create_zone(zone: Zone, current_user: str = Depends(get_current_user)):
-    if any(z.id == zone.id for z in data_structure.zones):
+    if zone.id in repository.zones:
         raise HTTPException(status_code=400, detail="Zone ID already exists")
-    data_structure.zones.append(zone)
-    save_data(data_structure)
+    repository.add_zone(zone)
+    await save_data()
     return zone
 
 @app.put("/api/zones/{zone_id}", response_model=Zone)
 async def update_zone(zone_id: int, updated_zone: Zone):
-    for i, zone in enumerate(data_structure.zones):
-        if zone.id == zone_id:
-            data_structure.zones[i] = updated_zone
-            save_data(data_structure)
-            return updated_zone
-    raise HTTPException(status_code=404, detail="Zone not found")
+    if zone_id not in repository.zones:
+        raise HTTPException(status_code=404, detail="Zone not found")
+    if updated_zone.id != zone_id and updated_zone.id in repository.zones:
+        raise HTTPException(status_code=400, detail="Zone ID already exists")
+    repository.replace_zone(zone_id, updated_zone)
+    await save_data()
+    return updated_zone
 
 @app.delete("/api/zones/{zone_id}")
 async def delete_zone(zone_id: int):
     # Check if zone is being used by any shop
-    for shop in data_structure.shops:
-        if shop.zone_id == zone_id:
-            raise HTTPException(
-                status_code=400,
-                detail="Cannot delete zone as it is being used by one or more shops"
-            )
+    if repository.zone_in_use(zone_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Cannot delete zone as it is being used by one or more shops"
+        )
     
-    for i, zone in enumerate(data_structure.zones):
-        if zone.id == zone_id:
-            data_structure.zones.pop(i)
-            save_data(data_structure)
-            return {"message": "Zone deleted successfully"}
-    raise HTTPException(status_code=404, detail="Zone not found")
+    if zone_id not in repository.zones:
+        raise HTTPException(status_code=404, detail="Zone not found")
+    repository.remove_zone(zone_id)
+    await save_data()
+    return {"message": "Zone deleted successfully"}
 
 # Banner Management
 @app.put("/api/banners/primary")
 async def update_primary_banner(urls: List[str]):
     # Replace existing URLs with new ones
-    data_structure.primary_banner = urls
-    save_data(data_structure)
+    await set_image_field("primary_banner", urls)
     return {"message": "Primary banner updated successfully"}
 
 @app.put("/api/banners/secondary")
 async def update_secondary_banner(urls: List[str]):
     # Replace existing URLs with new ones
-    data_structure.secondary_banner = urls
-    save_data(data_structure)
+    await set_image_field("secondary_banner", urls)
     return {"message": "Secondary banner updated successfully"}
 
 @app.put("/api/images/recommended")
@@ -491,275 +914,142 @@ async def update_recommended_image(image: ImageUrl):
     print("Datos recibidos:", image)
     print("URL recibida:", image.url)
     # Store the new URL
-    data_structure.recommended_image = image.url
-    save_data(data_structure)
+    await set_image_field("recommended_image", image.url)
     return {"message": "Recommended image updated successfully"}
 
 @app.put("/api/images/other-businesses")
 async def update_other_businesses_image(image: ImageUrl):
     # Store the new URL
-    data_structure.other_businesses = image.url
-    save_data(data_structure)
+    await set_image_field("other_businesses", image.url)
     return {"message": "Other businesses image updated successfully"}
 
 @app.get("/analytics", response_class=HTMLResponse)
 async def analytics_dashboard(request: Request, current_user: str = Depends(get_current_user)):
     """Analytics dashboard moved to /analytics and protected with authentication"""
-    return """
-    <html>
-        <head>
-            <title>Mayoristas Paraguay Analytics</title>
-            <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-        </head>
-        <body class="bg-gray-100">
-            <div class="container mx-auto px-4 py-8">
-                <h1 class="text-4xl font-bold mb-8">Mayoristas Paraguay Analytics</h1>
-                <div class="grid grid-cols-1 md:grid-cols-2 gap-8">
-                    <iframe src="/shops-by-zone" class="w-full h-96 bg-white rounded-lg shadow-lg"></iframe>
-                    <iframe src="/categories-distribution" class="w-full h-96 bg-white rounded-lg shadow-lg"></iframe>
-                    <iframe src="/shops-by-category" class="w-full h-96 bg-white rounded-lg shadow-lg"></iframe>
-                    <iframe src="/working-hours-distribution" class="w-full h-96 bg-white rounded-lg shadow-lg"></iframe>
-                </div>
-            </div>
-        </body>
-    </html>
-    """
+    return HTMLResponse(dashboard_html(await figure_cache.figures()))
+
+@app.get(PLOTLY_JS_PATH)
+async def get_plotly_js(request: Request):
+    """plotly.js for the charts, served once per browser: the versioned URL never changes content"""
+    asset = plotly_js()
+    encoding = data_snapshot.negotiate(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": asset.etag(encoding),
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept-Encoding",
+    }
+    if asset.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = await data_snapshot.encoded(asset, encoding)
+    return Response(content=body, media_type="application/javascript", headers=headers)
+
+# Analytics data, read from the counters the repository keeps up to date
+@app.get("/api/analytics/shops-by-zone")
+async def get_analytics_shops_by_zone(current_user: str = Depends(get_current_user)):
+    """Number of shops in each zone"""
+    return shops_by_zone(repository.aggregates, repository.zones)
+
+@app.get("/api/analytics/categories")
+async def get_analytics_categories(
+    limit: int = Query(15, ge=1, le=200),
+    current_user: str = Depends(get_current_user)
+):
+    """Categories with the most shops"""
+    return top_categories(repository.aggregates, repository.categories, limit)
+
+@app.get("/api/analytics/working-hours")
+async def get_analytics_working_hours(current_user: str = Depends(get_current_user)):
+    """Shops with and without working hours, and shops open on each weekday"""
+    return working_hours_coverage(repository.aggregates)
 
 @app.get("/shops-by-zone")
 async def get_shops_by_zone(request: Request):
-    # Count shops per zone
-    zone_counts = {}
-    for shop in data_structure.shops:
-        zone_counts[shop.zone_id] = zone_counts.get(shop.zone_id, 0) + 1
-    
-    # Create zone name mapping
-    zone_names = {zone.id: zone.name for zone in data_structure.zones}
-    
-    # Create DataFrame
-    df = pd.DataFrame([
-        {"zone": zone_names[zone_id], "count": count}
-        for zone_id, count in zone_counts.items()
-    ])
-    
-    # Create figure with dark mode support
-    fig = px.bar(df, x="zone", y="count", title="Shops by Zone")
-    
-    # Update layout for dark mode
-    fig.update_layout(
-        template="plotly_dark",
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font=dict(color="#9CA3AF")  # text-gray-400 in Tailwind
-    )
-    
-    # Update axes for dark mode
-    fig.update_xaxes(gridcolor="#374151")  # gray-700 in Tailwind
-    fig.update_yaxes(gridcolor="#374151")  # gray-700 in Tailwind
-    
-    return HTMLResponse(fig.to_html(full_html=False, include_plotlyjs=True))
+    return HTMLResponse(chart_html(await figure_cache.figure("shops-by-zone")))
 
 @app.get("/categories-distribution")
 async def get_categories_distribution(request: Request):
-    # Count category occurrences
-    category_counts = {}
-    for shop in data_structure.shops:
-        for cat_id in shop.categories:
-            category_counts[cat_id] = category_counts.get(cat_id, 0) + 1
-    
-    # Create category name mapping
-    category_names = {cat.id: cat.name for cat in data_structure.categories}
-    
-    # Get top 10 categories
-    top_categories = sorted(category_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-    
-    df = pd.DataFrame([
-        {"category": category_names[cat_id], "count": count}
-        for cat_id, count in top_categories
-    ])
-    
-    # Create figure with dark mode support
-    fig = px.pie(df, values="count", names="category", title="Top 10 Categories Distribution")
-    
-    # Update layout for dark mode
-    fig.update_layout(
-        template="plotly_dark",
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font=dict(color="#9CA3AF")  # text-gray-400 in Tailwind
-    )
-    
-    return HTMLResponse(fig.to_html(full_html=False, include_plotlyjs=True))
+    return HTMLResponse(chart_html(await figure_cache.figure("categories-distribution")))
 
 @app.get("/shops-by-category")
 async def get_shops_by_category(request: Request):
-    # Count shops per category
-    category_shop_counts = {}
-    for shop in data_structure.shops:
-        for cat_id in shop.categories:
-            category_shop_counts[cat_id] = category_shop_counts.get(cat_id, 0) + 1
-    
-    # Create category name mapping
-    category_names = {cat.id: cat.name for cat in data_structure.categories}
-    
-    # Get top 15 categories
-    top_categories = sorted(category_shop_counts.items(), key=lambda x: x[1], reverse=True)[:15]
-    
-    df = pd.DataFrame([
-        {"category": category_names[cat_id], "count": count}
-        for cat_id, count in top_categories
-    ])
-    
-    # Create figure with dark mode support
-    fig = px.bar(df, x="category", y="count", title="Top 15 Categories by Number of Shops")
-    
-    # Update layout for dark mode
-    fig.update_layout(
-        template="plotly_dark",
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font=dict(color="#9CA3AF"),  # text-gray-400 in Tailwind
-        xaxis_tickangle=-45
-    )
-    
-    # Update axes for dark mode
-    fig.update_xaxes(gridcolor="#374151")  # gray-700 in Tailwind
-    fig.update_yaxes(gridcolor="#374151")  # gray-700 in Tailwind
-    
-    return HTMLResponse(fig.to_html(full_html=False, include_plotlyjs=True))
+    return HTMLResponse(chart_html(await figure_cache.figure("shops-by-category")))
 
 @app.get("/working-hours-distribution")
 async def get_working_hours_distribution(request: Request):
-    # Count shops with and without working hours
-    with_hours = len([shop for shop in data_structure.shops if shop.working_hours])
-    without_hours = len(data_structure.shops) - with_hours
-    
-    # Create figure with dark mode support
-    fig = go.Figure(data=[go.Pie(
-        labels=['With Working Hours', 'Without Working Hours'],
-        values=[with_hours, without_hours],
-        title="Working Hours Distribution"
-    )])
-    
-    # Update layout for dark mode
-    fig.update_layout(
-        template="plotly_dark",
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font=dict(color="#9CA3AF")  # text-gray-400 in Tailwind
-    )
-    
-    return HTMLResponse(fig.to_html(full_html=False, include_plotlyjs=True))
+    return HTMLResponse(chart_html(await figure_cache.figure("working-hours-distribution")))
 
 @app.get("/api/data")
-async def get_data_json():
-    return FileResponse(DATA_FILE, media_type="application/json")
+async def get_data_json(request: Request):
+    # data.json on disk can lag behind the journal, so serve the in-memory state
+    snapshot = await data_snapshot.snapshot()
+    encoding = data_snapshot.negotiate(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": snapshot.etag(encoding),
+        "Cache-Control": DATA_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if snapshot.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = await data_snapshot.encoded(snapshot, encoding)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Image Upload Endpoints
 @app.post("/api/upload/shop-image")
 async def upload_shop_image(file: UploadFile = File(...)):
-    """Upload a shop image and return its URL"""
-    url = await storage.upload_file(file, folder="shops")
-    return {"url": url}
+    """Upload a shop image and return its URL and the URLs of its renditions"""
+    return await upload_image(file, folder="shops")
 
 @app.post("/api/upload/primary-banner")
 async def upload_primary_banner(file: UploadFile = File(...)):
-    """Upload a primary banner image and return its URL"""
-    url = await storage.upload_file(file, folder="primary-banners")
-    return {"url": url}
+    """Upload a primary banner image and return its URL and the URLs of its renditions"""
+    return await upload_image(file, folder="primary-banners")
 
 @app.post("/api/upload/secondary-banner")
 async def upload_secondary_banner(file: UploadFile = File(...)):
-    """Upload a secondary banner image and return its URL"""
-    url = await storage.upload_file(file, folder="secondary-banners")
-    return {"url": url}
+    """Upload a secondary banner image and return its URL and the URLs of its renditions"""
+    return await upload_image(file, folder="secondary-banners")
 
 @app.post("/api/upload/recommended")
 async def upload_recommended_image(file: UploadFile = File(...)):
-    """Upload a recommended image and return its URL"""
-    url = await storage.upload_file(file, folder="recommended")
-    return {"url": url}
+    """Upload a recommended image and return its URL and the URLs of its renditions"""
+    return await upload_image(file, folder="recommended")
 
 @app.post("/api/upload/other-business")
 async def upload_other_business_image(file: UploadFile = File(...)):
-    """Upload an other business image and return its URL"""
-    url = await storage.upload_file(file, folder="other-business")
-    return {"url": url}
+    """Upload an other business image and return its URL and the URLs of its renditions"""
+    return await upload_image(file, folder="other-business")
 
 # Storage Management
 @app.delete("/api/storage/delete")
 async def delete_storage_file(url: str):
     """Delete a file from storage"""
     try:
-        await storage.delete_file(url)
-        return {"message": "File deleted successfully"}
+        released = forget_image(url)
+        await save_data()
+        release_images(released)
+        if image_in_use(url):
+            # Still used by a record: deleted once that record stops using it
+            return {"message": "File is still in use, it will be deleted when no longer referenced"}
+        return {"message": "File queued for deletion"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Add new endpoint for getting open shops
-@app.get("/api/shops/open")
-async def get_open_shops():
-    """Get all currently open shops"""
-    return [shop for shop in data_structure.shops if is_shop_open(shop)]
+@app.post("/api/storage/gc")
+async def collect_unused_images(dry_run: bool = True, current_user: str = Depends(get_current_user)):
+    """Find stored images that nothing references; unless dry_run, queue them for deletion"""
+    report = await image_collector.collect(dry_run=dry_run)
+    report["queued"] = await asyncio.to_thread(delete_queue.pending)
+    return report
 
 # Branding Management Helper
 async def get_active_branding():
     """Helper function to get active branding configuration"""
-    data_structure = load_data()
-    
-    # Get default branding values from environment variables
-    default_logo = os.getenv("DEFAULT_BRANDING_LOGO")
-    default_copyright = os.getenv("DEFAULT_BRANDING_COPYRIGHT")
-    default_contact = os.getenv("DEFAULT_BRANDING_CONTACT")
-    
-    # Use current year if default_copyright is not provided
-    if not default_copyright:
-        from datetime import datetime
-        current_year = datetime.now().year
-        default_copyright = f"© {current_year} Unifica Paraguay. Todos los derechos reservados."
-    
-    branding = data_structure.branding or {
-        "logo": default_logo,
-        "client_logo": "",  # Store client logo separately
-        "copyright": default_copyright,
-        "client_copyright": "",  # Store client copyright separately
-        "contact_number": default_contact,
-        "client_contact_number": "",  # Store client contact separately
-        "active": False,
-        "client_name": "",
-        "subscription_end_date": ""
-    }
-    
-    # Ensure client_logo field exists
-    if "client_logo" not in branding:
-        branding["client_logo"] = ""
-        
-    # Ensure client_copyright field exists
-    if "client_copyright" not in branding:
-        branding["client_copyright"] = ""
-        
-    # Ensure client_contact_number field exists
-    if "client_contact_number" not in branding:
-        branding["client_contact_number"] = ""
-    
-    # Always ensure the logo, copyright and contact are correct based on active status
-    if not branding.get("active", False):
-        branding["logo"] = default_logo
-        branding["copyright"] = default_copyright
-        branding["contact_number"] = default_contact
-    else:
-        # Use client_logo if it exists
-        if branding.get("client_logo"):
-            branding["logo"] = branding["client_logo"]
-        
-        # Use client_copyright if it exists
-        if branding.get("client_copyright"):
-            branding["copyright"] = branding["client_copyright"]
-            
-        # Use client_contact_number if it exists
-        if branding.get("client_contact_number"):
-            branding["contact_number"] = branding["client_contact_number"]
-        
-    return branding
+    return branding_cache.get()
 
 # Branding Management Page
 @app.get("/admin/branding", response_class=HTMLResponse)
@@ -791,31 +1081,11 @@ async def update_branding(
     current_user: str = Depends(get_current_user)
 ):
     """Update branding information"""
-    data_structure = load_data()
-    
-    # Get default branding values
-    default_logo = os.getenv("DEFAULT_BRANDING_LOGO")
-    default_copyright = os.getenv("DEFAULT_BRANDING_COPYRIGHT")
-    default_contact = os.getenv("DEFAULT_BRANDING_CONTACT")
-    
-    # Use current year if default_copyright is not provided
-    if not default_copyright:
-        from datetime import datetime
-        current_year = datetime.now().year
-        default_copyright = f"© {current_year} Unifica Paraguay. Todos los derechos reservados."
+    default_copyright = BRANDING_DEFAULTS["copyright"]
+    default_contact = BRANDING_DEFAULTS["contact_number"]
     
     # Get existing branding or create new
-    branding = data_structure.branding or {
-        "logo": default_logo,
-        "client_logo": "",
-        "copyright": default_copyright,
-        "client_copyright": "",
-        "contact_number": default_contact,
-        "client_contact_number": "",
-        "active": False,
-        "client_name": "",
-        "subscription_end_date": ""
-    }
+    branding = dict(data_structure.branding) if data_structure.branding else empty_branding(BRANDING_DEFAULTS)
     
     # Ensure client_logo field exists
     if "client_logo" not in branding:
@@ -863,8 +1133,9 @@ async def update_branding(
             branding["contact_number"] = default_contact
     
     # Save updated branding
-    data_structure.branding = branding
-    save_data(data_structure)
+    repository.set_field("branding", branding)
+    branding_cache.invalidate()
+    await save_data()
     
     return RedirectResponse(url="/admin/branding", status_code=303)
 
@@ -873,8 +1144,6 @@ async def enable_client_branding(
     current_user: str = Depends(get_current_user)
 ):
     """Enable client branding"""
-    data_structure = load_data()
-    
     if not data_structure.branding:
         raise HTTPException(status_code=400, detail="Branding not configured")
     
@@ -912,7 +1181,9 @@ async def enable_client_branding(
     if data_structure.branding.get("client_contact_number"):
         data_structure.branding["contact_number"] = data_structure.branding["client_contact_number"]
     
-    save_data(data_structure)
+    repository.set_field("branding", data_structure.branding)
+    branding_cache.invalidate()
+    await save_data()
     
     return RedirectResponse(url="/admin/branding", status_code=303)
 
@@ -921,31 +1192,8 @@ async def disable_client_branding(
     current_user: str = Depends(get_current_user)
 ):
     """Disable client branding and use default"""
-    data_structure = load_data()
-    
-    # Get default branding values from environment variables
-    default_logo = os.getenv("DEFAULT_BRANDING_LOGO")
-    default_copyright = os.getenv("DEFAULT_BRANDING_COPYRIGHT")
-    default_contact = os.getenv("DEFAULT_BRANDING_CONTACT")
-    
-    # Use current year if default_copyright is not provided
-    if not default_copyright:
-        from datetime import datetime
-        current_year = datetime.now().year
-        default_copyright = f"© {current_year} Unifica Paraguay. Todos los derechos reservados."
-    
     if not data_structure.branding:
-        data_structure.branding = {
-            "logo": default_logo,
-            "client_logo": "",
-            "copyright": default_copyright,
-            "client_copyright": "",
-            "contact_number": default_contact,
-            "client_contact_number": "",
-            "active": False,
-            "client_name": "",
-            "subscription_end_date": ""
-        }
+        data_structure.branding = empty_branding(BRANDING_DEFAULTS)
     else:
         # Ensure client_logo field exists
         if "client_logo" not in data_structure.branding:
@@ -961,14 +1209,14 @@ async def disable_client_branding(
         
         # Set active to false and switch to default logo, copyright and contact
         data_structure.branding["active"] = False
-        data_structure.branding["logo"] = default_logo
-        data_structure.branding["copyright"] = default_copyright
-        data_structure.branding["contact_number"] = default_contact
+        data_structure.branding.update(BRANDING_DEFAULTS)
         
         # But keep the client_logo, client_name, client_copyright and client_contact_number for later use
         # (don't modify client_logo, client_name, client_copyright or client_contact_number fields)
     
-    save_data(data_structure)
+    repository.set_field("branding", data_structure.branding)
+    branding_cache.invalidate()
+    await save_data()
     
     return RedirectResponse(url="/admin/branding", status_code=303)
 
@@ -979,10 +1227,8 @@ async def upload_branding_logo(
     current_user: str = Depends(get_current_user)
 ):
     """Upload a branding logo image and return its URL"""
-    url = await storage.upload_file(file, folder="branding")
-    
-    # If there was a previous logo, delete it
-    data_structure = load_data()
+    uploaded = await upload_image(file, folder="branding")
+    url = uploaded["url"]
     
     # Ensure branding object exists
     if not data_structure.branding:
@@ -992,15 +1238,8 @@ async def upload_branding_logo(
     if "client_logo" not in data_structure.branding:
         data_structure.branding["client_logo"] = ""
     
-    # Check for existing logo to delete
-    if data_structure.branding.get("client_logo"):
-        old_logo = data_structure.branding["client_logo"]
-        if old_logo and "storage.googleapis.com" in old_logo and "branding" in old_logo:
-            try:
-                await storage.delete_file(old_logo)
-            except Exception:
-                # Ignore errors when deleting old logo
-                pass
+    # Existing logo, deleted below once nothing uses it
+    old_logo = data_structure.branding.get("client_logo")
     
     # Store in client_logo
     data_structure.branding["client_logo"] = url
@@ -1010,9 +1249,14 @@ async def upload_branding_logo(
         data_structure.branding["logo"] = url
     
     # Update data structure
-    save_data(data_structure)
+    repository.set_field("branding", data_structure.branding)
+    branding_cache.invalidate()
+    released = [old_logo] if old_logo and old_logo != url else []
+    released += take_banner_renditions()
+    await save_data()
+    release_images(released)
     
-    return {"url": url}
+    return uploaded
 
 # Add this route to get branding info
 @app.get("/api/branding")
@@ -1039,9 +1283,19 @@ async def favicon():
         return RedirectResponse(url=logo_url)
     else:
         # Use default Unifica logo if no branding logo is set
-        default_logo = os.getenv("DEFAULT_BRANDING_LOGO", "https://unificadesign.com.py/img/unifica/footerIcon.png")
+        default_logo = BRANDING_DEFAULTS["logo"] or "https://unificadesign.com.py/img/unifica/footerIcon.png"
         return RedirectResponse(url=default_logo)
 
+@app.get("/api/admin/loop-stalls")
+async def get_loop_stalls(current_user: str = Depends(get_current_user)):
+    """Event-loop stalls caught by the watchdog (enabled with LOOP_WATCHDOG_MS), newest first"""
+    return loop_watchdog.report()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Metrics of this worker process in the Prometheus text format"""
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health", response_model=HealthCheck)
 async def health_check():
     """
@@ -1070,13 +1324,12 @@ async def health_check():
             with open(DATA_FILE, "r", encoding="utf-8") as f:
                 json.load(f)
 
-        # Check storage connectivity
-        storage_accessible = False
-        try:
-            # Simple check if storage client is initialized
-            storage_accessible = storage is not None and hasattr(storage, 'bucket_name')
-        except Exception as e:
-            storage_accessible = False
+        # Storage state as of the last upload or delete: probes must not build the client
+        storage_accessible = storage.error is None
+        if storage.error is not None:
+            storage_state = f"error: {storage.error}"
+        else:
+            storage_state = "initialized" if storage.initialized else "not used yet"
         
         response_time = time.time() - start_time
         
@@ -1091,6 +1344,7 @@ async def health_check():
             details={
                 "environment": ENVIRONMENT,
                 "data_file": "accessible" if data_file_exists else "not found",
+                "storage": storage_state,
                 "response_time_ms": f"{response_time * 1000:.2f}",
                 "python_version": platform.python_version(),
                 "host_os": platform.system()
@@ -1,12 +1,23 @@
 from typing import Dict, List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, SerializationInfo, field_serializer
 from datetime import time
 
+# Resized copies of an uploaded image: rendition name -> format -> URL
+ImageRenditions = Dict[str, Dict[str, str]]
+
 class WorkingDay(BaseModel):
     open_time: time
     close_time: time
     is_open: bool = True
 
+    @field_serializer('open_time', 'close_time', mode='wrap')
+    def serialize_time(self, value: time, handler, info: SerializationInfo):
+        # Dumps for data.json pass round_trip=True and keep its 'HH:MM' format,
+        # API responses keep the default ISO format ('HH:MM:SS')
+        if info.round_trip:
+            return value.strftime("%H:%M")
+        return handler(value)
+
     def model_dump(self, **kwargs):
         data = super().model_dump(**kwargs)
         if isinstance(data['open_time'], time):
@@ -54,6 +65,7 @@ class Shop(BaseModel):
     zone_id: int
     categorie_pages: List[str]
     img: str
+    img_renditions: Optional[ImageRenditions] = None
     description: Optional[str] = None
 
     def model_dump(self, **kwargs):
@@ -81,4 +93,7 @@ class DataStructure(BaseModel):
     secondary_banner: List[str]
     recommended_image: str
     other_businesses: str
-    branding: Optional[Dict] = None 
\ No newline at end of file
+    branding: Optional[Dict] = None
+    # Renditions of the images used by the banner, image and branding fields, by image URL
+    banner_renditions: Dict[str, ImageRenditions] = {}
+    version: int = 0  # Incremented by the storage backend on every commit 
\ No newline at end of file
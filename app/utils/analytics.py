@@ -0,0 +1,80 @@
+import heapq
+from collections import Counter
+from typing import Dict, Hashable, List
+from ..models.models import Shop
+from .working_hours import DAYS, MINUTES_PER_DAY, weekly_intervals
+
+
+def _bump(counter: Counter, key: Hashable, delta: int) -> None:
+    counter[key] += delta
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class ShopAggregates:
+    """Shop counters behind the analytics charts.
+
+    The repository calls add() and remove() whenever a shop is indexed or
+    unindexed, so the counters change by delta and reading them never
+    touches the shop list.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.with_hours = 0
+        self.by_zone: Counter = Counter()
+        self.by_category: Counter = Counter()
+        self.open_days: Counter = Counter()
+
+    def _apply(self, shop: Shop, delta: int) -> None:
+        self.total += delta
+        _bump(self.by_zone, shop.zone_id, delta)
+        for cat_id in shop.categories:
+            _bump(self.by_category, cat_id, delta)
+        if shop.working_hours:
+            self.with_hours += delta
+            for start, _ in weekly_intervals(shop.working_hours):
+                _bump(self.open_days, DAYS[start // MINUTES_PER_DAY], delta)
+
+    def add(self, shop: Shop) -> None:
+        self._apply(shop, 1)
+
+    def remove(self, shop: Shop) -> None:
+        self._apply(shop, -1)
+
+
+def shops_by_zone(aggregates: ShopAggregates, zones) -> List[Dict]:
+    """Shop count per zone that has shops, in zone order"""
+    counts = []
+    for zone in zones.items:
+        if aggregates.by_zone.get(zone.id):
+            counts.append({"zone_id": zone.id, "zone": zone.name, "count": aggregates.by_zone[zone.id]})
+    # Shops pointing at a zone that no longer exists
+    for zone_id, count in aggregates.by_zone.items():
+        if zone_id not in zones:
+            counts.append({"zone_id": zone_id, "zone": f"Zona {zone_id}", "count": count})
+    return counts
+
+
+def top_categories(aggregates: ShopAggregates, categories, limit: int) -> List[Dict]:
+    """The `limit` categories with the most shops, most shops first"""
+    top = heapq.nlargest(limit, aggregates.by_category.items(), key=lambda item: item[1])
+    result = []
+    for cat_id, count in top:
+        category = categories.get(cat_id)
+        result.append({
+            "category_id": cat_id,
+            "category": category.name if category else f"Categoría {cat_id}",
+            "count": count,
+        })
+    return result
+
+
+def working_hours_coverage(aggregates: ShopAggregates) -> Dict:
+    """How many shops publish working hours, and how many are open on each weekday"""
+    return {
+        "total": aggregates.total,
+        "with_hours": aggregates.with_hours,
+        "without_hours": aggregates.total - aggregates.with_hours,
+        "open_days": {day: aggregates.open_days.get(day, 0) for day in DAYS},
+    }
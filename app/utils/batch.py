@@ -0,0 +1,190 @@
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from ..models.models import Category, Shop, Zone
+from .repository import DataRepository, IdIndex
+
+# Most operations accepted in one batch
+MAX_BATCH_OPERATIONS = 5000
+
+# Scalar DataStructure fields a batch can replace, with their value type
+FIELD_TYPES = {
+    "primary_banner": TypeAdapter(List[str]),
+    "secondary_banner": TypeAdapter(List[str]),
+    "recommended_image": TypeAdapter(str),
+    "other_businesses": TypeAdapter(str),
+}
+ENTITY_MODELS = {"shops": Shop, "categories": Category, "zones": Zone}
+SINGULAR = {"shops": "Shop", "categories": "Category", "zones": "Zone"}
+
+
+class BatchOperation(BaseModel):
+    """One step of POST /api/batch.
+
+    Shops, categories and zones take create (data: the full item), update
+    (id + full item), patch (id + the fields to change) and delete (id).
+    Banners and images ("primary_banner", "secondary_banner",
+    "recommended_image", "other_businesses") only take update, with the new
+    value as data.
+    """
+    op: Literal["create", "update", "patch", "delete"]
+    entity: Literal["shops", "categories", "zones", "primary_banner", "secondary_banner", "recommended_image", "other_businesses"]
+    id: Optional[int] = None
+    data: Any = None
+
+
+class BatchError(Exception):
+    def __init__(self, index: int, status_code: int, detail: str):
+        super().__init__(detail)
+        self.index = index
+        self.status_code = status_code
+        self.detail = detail
+
+
+class Step:
+    """A validated operation: replace entity `id` with `item` (None deletes, no id creates)"""
+
+    def __init__(self, entity: str, op: str, id: Optional[int] = None, item: Any = None):
+        self.entity = entity
+        self.op = op
+        self.id = id
+        self.item = item
+
+
+class _Overlay:
+    """An id index as it will be once the steps planned so far are applied"""
+
+    def __init__(self, index: IdIndex):
+        self.index = index
+        self.changed: Dict[int, Any] = {}
+
+    def get(self, item_id: int):
+        if item_id in self.changed:
+            return self.changed[item_id]
+        return self.index.get(item_id)
+
+    def __contains__(self, item_id: int) -> bool:
+        return self.get(item_id) is not None
+
+    def put(self, item_id: Optional[int], item) -> None:
+        if item_id is not None and item_id != item.id:
+            self.changed[item_id] = None
+        self.changed[item.id] = item
+
+    def delete(self, item_id: int) -> None:
+        self.changed[item_id] = None
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'data'}: {detail['msg']}" for detail in error.errors()
+    )
+
+
+class BatchPlanner:
+    """Validates a list of operations against the current state, without changing it.
+
+    Every operation sees the effect of the ones before it (a category created
+    earlier in the batch can be used by a shop, a zone can be deleted once
+    the batch moved its shops elsewhere). The same checks as the single-item
+    endpoints apply; in addition shop patches are checked for categories and
+    zones, and a category or zone used by shops cannot change its id. The
+    first invalid operation raises BatchError; otherwise `plan` returns the
+    steps to apply, which can no longer fail.
+    """
+
+    def __init__(self, repository: DataRepository):
+        self.repository = repository
+        self.overlays = {
+            "shops": _Overlay(repository.shops),
+            "categories": _Overlay(repository.categories),
+            "zones": _Overlay(repository.zones),
+        }
+
+    def _in_use(self, entity: str, item_id: int) -> bool:
+        """Whether a shop still references category or zone item_id after the planned steps"""
+        shops = self.overlays["shops"]
+        for shop in shops.changed.values():
+            if shop is not None and (item_id in shop.categories if entity == "categories" else shop.zone_id == item_id):
+                return True
+        index = self.repository.shops_by_category if entity == "categories" else self.repository.shops_by_zone
+        return any(shop_id not in shops.changed for shop_id in index.get(item_id))
+
+    def _check_shop(self, shop: Shop) -> None:
+        categories = self.overlays["categories"]
+        missing = [cat_id for cat_id in shop.categories if cat_id not in categories]
+        if missing:
+            raise ValueError(f"Category ID {missing[0]} does not exist")
+        if shop.zone_id not in self.overlays["zones"]:
+            raise ValueError("Zone ID does not exist")
+
+    def _plan_entity(self, index: int, operation: BatchOperation) -> Step:
+        entity, op = operation.entity, operation.op
+        overlay, model, name = self.overlays[entity], ENTITY_MODELS[entity], SINGULAR[entity]
+
+        current = None
+        if op != "create":
+            if operation.id is None:
+                raise BatchError(index, 422, f"{op} needs an id")
+            current = overlay.get(operation.id)
+            if current is None:
+                raise BatchError(index, 404, f"{name} not found")
+
+        if op == "delete":
+            if entity != "shops" and self._in_use(entity, operation.id):
+                raise BatchError(
+                    index, 400, f"Cannot delete {name.lower()} as it is being used by one or more shops"
+                )
+            overlay.delete(operation.id)
+            return Step(entity=entity, op=op, id=operation.id)
+
+        data = operation.data
+        if op == "patch":
+            if not isinstance(data, dict):
+                raise BatchError(index, 422, "patch data must be an object")
+            merged = current.model_dump()
+            for field, value in data.items():
+                if field in merged:
+                    # A new image comes with its own renditions
+                    if entity == "shops" and field == "img" and current.img != value and "img_renditions" not in data:
+                        merged["img_renditions"] = None
+                    merged[field] = value
+            data = merged
+        try:
+            item = model.model_validate(data)
+        except ValidationError as e:
+            raise BatchError(index, 422, _validation_message(e))
+
+        if op == "create":
+            # A create never replaces anything, whatever id the operation carries
+            if item.id in overlay:
+                raise BatchError(index, 400, f"{name} ID already exists")
+        elif item.id != operation.id and item.id in overlay:
+            raise BatchError(index, 400, f"{name} ID already exists")
+        if entity == "shops":
+            try:
+                self._check_shop(item)
+            except ValueError as e:
+                raise BatchError(index, 400, str(e))
+        elif current is not None and item.id != current.id and self._in_use(entity, current.id):
+            # Renaming the id would leave shops pointing at an id that no longer exists
+            raise BatchError(index, 400, f"Cannot change the ID of a {name.lower()} used by shops")
+        item_id = None if op == "create" else operation.id
+        overlay.put(item_id, item)
+        return Step(entity=entity, op=op, id=item_id, item=item)
+
+    def plan(self, operations: List[BatchOperation]) -> List[Step]:
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise BatchError(MAX_BATCH_OPERATIONS, 413, f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+        steps = []
+        for index, operation in enumerate(operations):
+            if operation.entity in FIELD_TYPES:
+                if operation.op != "update":
+                    raise BatchError(index, 422, f"{operation.entity} only supports update")
+                try:
+                    value = FIELD_TYPES[operation.entity].validate_python(operation.data)
+                except ValidationError as e:
+                    raise BatchError(index, 422, _validation_message(e))
+                steps.append(Step(entity=operation.entity, op="update", item=value))
+            else:
+                steps.append(self._plan_entity(index, operation))
+        return steps
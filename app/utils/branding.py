@@ -0,0 +1,72 @@
+from datetime import datetime
+from typing import Dict, Optional
+from .repository import DataRepository
+
+
+def default_branding(logo: Optional[str], copyright: Optional[str], contact_number: Optional[str]) -> Dict:
+    """Unifica branding shown while client branding is off (DEFAULT_BRANDING_* values)"""
+    if not copyright:
+        copyright = f"© {datetime.now().year} Unifica Paraguay. Todos los derechos reservados."
+    return {"logo": logo, "copyright": copyright, "contact_number": contact_number}
+
+
+def empty_branding(defaults: Dict) -> Dict:
+    """Branding record used before any branding has been configured"""
+    return {
+        "logo": defaults["logo"],
+        "client_logo": "",  # Store client logo separately
+        "copyright": defaults["copyright"],
+        "client_copyright": "",  # Store client copyright separately
+        "contact_number": defaults["contact_number"],
+        "client_contact_number": "",  # Store client contact separately
+        "active": False,
+        "client_name": "",
+        "subscription_end_date": ""
+    }
+
+
+def resolve_branding(stored: Optional[Dict], defaults: Dict) -> Dict:
+    """Branding to display: the stored record with logo, copyright and contact set from the active status"""
+    branding = dict(stored) if stored else empty_branding(defaults)
+
+    # Ensure the client fields exist
+    for field in ("client_logo", "client_copyright", "client_contact_number"):
+        branding.setdefault(field, "")
+
+    if not branding.get("active", False):
+        branding.update(defaults)
+    else:
+        # Use the client values when they are set
+        if branding.get("client_logo"):
+            branding["logo"] = branding["client_logo"]
+        if branding.get("client_copyright"):
+            branding["copyright"] = branding["client_copyright"]
+        if branding.get("client_contact_number"):
+            branding["contact_number"] = branding["client_contact_number"]
+    return branding
+
+
+class BrandingCache:
+    """Resolved branding, computed once per change instead of on every page render.
+
+    The branding endpoints edit the stored dict in place and call invalidate().
+    Replacing the dict altogether (a reload, or a change applied from another
+    worker) is detected by identity.
+    """
+
+    def __init__(self, repository: DataRepository, defaults: Dict):
+        self.repository = repository
+        self.defaults = defaults
+        self._source: Optional[Dict] = None
+        self._resolved: Optional[Dict] = None
+
+    def invalidate(self) -> None:
+        self._resolved = None
+
+    def get(self) -> Dict:
+        stored = self.repository.data.branding
+        if self._resolved is None or stored is not self._source:
+            self._source = stored
+            self._resolved = resolve_branding(stored, self.defaults)
+        # Callers get their own copy so they can't alter the cached one
+        return dict(self._resolved)
@@ -0,0 +1,262 @@
+import asyncio
+import codecs
+import csv
+import io
+import json
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from ..models.models import Shop
+from .repository import DataRepository
+
+# Rows validated between two yields to the event loop
+IMPORT_BATCH_SIZE = 500
+# Most errors listed in an import report (all of them are counted)
+MAX_REPORTED_ERRORS = 1000
+# Rows encoded per chunk of an export
+EXPORT_CHUNK_ROWS = 500
+
+# CSV columns are the Shop fields. List cells are joined with "|", nested values are JSON
+CSV_COLUMNS = list(Shop.model_fields)
+LIST_COLUMNS = ("categories", "categorie_pages")
+JSON_COLUMNS = ("working_hours", "img_renditions")
+LIST_SEPARATOR = "|"
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# (line number, parsed row or None, error or None)
+Row = Tuple[int, Optional[Dict], Optional[str]]
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str] = None) -> str:
+    """Import format from the explicit request or the Content-Type (NDJSON by default)"""
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unknown format {requested!r}, expected 'ndjson' or 'csv'")
+        return requested
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return "csv" if media_type in ("text/csv", "application/csv") else "ndjson"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a UTF-8 byte stream into lines (a leading BOM, as Excel writes, is dropped)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, row, None
+
+
+def _csv_row(header: List[str], cells: List[str]) -> Dict:
+    if len(cells) != len(header):
+        raise ValueError(f"Expected {len(header)} columns, found {len(cells)}")
+    row: Dict = {}
+    for column, cell in zip(header, cells):
+        if column in LIST_COLUMNS:
+            row[column] = [item.strip() for item in cell.split(LIST_SEPARATOR) if item.strip()]
+        elif column in JSON_COLUMNS:
+            row[column] = json.loads(cell) if cell.strip() else None
+        else:
+            row[column] = cell
+    return row
+
+
+async def csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    """CSV records with a header row. Quoted cells may span several lines"""
+    header: Optional[List[str]] = None
+    record: List[str] = []
+    start = line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not record:
+            start = line_number
+        record.append(line)
+        # An odd number of quotes means a quoted cell continues on the next line
+        text = "\n".join(record)
+        if text.count('"') % 2:
+            continue
+        record = []
+        if not text.strip():
+            continue
+        try:
+            cells = next(csv.reader([text]))
+        except csv.Error as e:
+            yield start, None, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [cell.strip() for cell in cells]
+            unknown = [column for column in header if column not in CSV_COLUMNS]
+            if unknown:
+                raise ValueError(f"Unknown CSV columns: {', '.join(unknown)}")
+            continue
+        try:
+            yield start, _csv_row(header, cells), None
+        except ValueError as e:
+            yield start, None, str(e)
+    if record:
+        yield start, None, "Unterminated quoted cell"
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'row'}: {detail['msg']}" for detail in error.errors()
+    )
+
+
+class ShopImport:
+    """Validates streamed shop rows in batches and collects the valid shops.
+
+    Each batch is checked against the category and zone ids in one pass, and
+    against the shop ids already stored or seen earlier in the import (a shop
+    that exists is an error unless upsert is set). Invalid rows are reported
+    by line number and skipped; nothing is written until the caller applies
+    `shops` to the repository, after recheck().
+    """
+
+    def __init__(self, repository: DataRepository, upsert: bool = False):
+        self.repository = repository
+        self.upsert = upsert
+        self.shops: List[Shop] = []
+        self.rows = 0
+        self.error_count = 0
+        self.errors: List[Dict] = []
+        self._seen_ids = set()
+        # Line number of each of the shops
+        self._lines: List[int] = []
+
+    def _error(self, line: int, shop_id, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": line, "id": shop_id, "error": message})
+
+    def _conflicts(self, shops: List[Tuple[int, Shop]]) -> Dict[int, str]:
+        """Errors of shops that clash with the stored data, by position in shops"""
+        # One lookup per distinct id for all the shops
+        missing_categories = set(self.repository.missing_categories(
+            {cat_id for _, shop in shops for cat_id in shop.categories}
+        ))
+        missing_zones = {shop.zone_id for _, shop in shops if not self.repository.zone_exists(shop.zone_id)}
+
+        errors = {}
+        for position, (_, shop) in enumerate(shops):
+            missing = [cat_id for cat_id in shop.categories if cat_id in missing_categories]
+            if shop.id in self.repository.shops and not self.upsert:
+                errors[position] = "Shop ID already exists"
+            elif missing:
+                errors[position] = f"Category ID {missing[0]} does not exist"
+            elif shop.zone_id in missing_zones:
+                errors[position] = "Zone ID does not exist"
+        return errors
+
+    def add_batch(self, batch: List[Row]) -> None:
+        parsed: List[Tuple[int, Shop]] = []
+        for line, row, error in batch:
+            self.rows += 1
+            if error is not None:
+                self._error(line, None, error)
+                continue
+            try:
+                parsed.append((line, Shop.model_validate(row)))
+            except ValidationError as e:
+                self._error(line, row.get("id"), _validation_message(e))
+
+        conflicts = self._conflicts(parsed)
+        for position, (line, shop) in enumerate(parsed):
+            if shop.id in self._seen_ids:
+                self._error(line, shop.id, "Duplicate shop ID in the import")
+            elif position in conflicts:
+                self._error(line, shop.id, conflicts[position])
+            else:
+                self._seen_ids.add(shop.id)
+                self._lines.append(line)
+                self.shops.append(shop)
+
+    def recheck(self) -> None:
+        """Check the valid shops again against the data as it is now.
+
+        The rows were checked batch by batch while the body streamed in, and
+        other requests may have added shops or deleted categories and zones
+        since. Call right before applying `shops`, with no await in between:
+        shops that no longer pass are moved to the errors.
+        """
+        checked = list(zip(self._lines, self.shops))
+        conflicts = self._conflicts(checked)
+        if not conflicts:
+            return
+        for position, (line, shop) in enumerate(checked):
+            if position in conflicts:
+                self._error(line, shop.id, conflicts[position])
+        self._lines = [line for position, (line, _) in enumerate(checked) if position not in conflicts]
+        self.shops = [shop for position, (_, shop) in enumerate(checked) if position not in conflicts]
+        self.errors.sort(key=lambda error: error["row"])
+
+    async def read(self, rows: AsyncIterator[Row]) -> None:
+        batch: List[Row] = []
+        async for row in rows:
+            batch.append(row)
+            if len(batch) == IMPORT_BATCH_SIZE:
+                self.add_batch(batch)
+                batch = []
+                # Let other requests run between batches
+                await asyncio.sleep(0)
+        if batch:
+            self.add_batch(batch)
+        self.errors.sort(key=lambda error: error["row"])
+
+
+def _csv_cells(shop: Shop) -> List:
+    data = shop.model_dump(mode="json", round_trip=True)
+    cells = []
+    for column in CSV_COLUMNS:
+        value = data[column]
+        if column in LIST_COLUMNS:
+            cells.append(LIST_SEPARATOR.join(str(item) for item in value))
+        elif column in JSON_COLUMNS:
+            cells.append(json.dumps(value, ensure_ascii=False) if value is not None else "")
+        else:
+            cells.append("" if value is None else value)
+    return cells
+
+
+def export_ndjson(shops: List[Shop]) -> Iterator[bytes]:
+    for start in range(0, len(shops), EXPORT_CHUNK_ROWS):
+        yield "".join(
+            json.dumps(shop.model_dump(mode="json", round_trip=True), ensure_ascii=False, separators=(",", ":")) + "\n"
+            for shop in shops[start:start + EXPORT_CHUNK_ROWS]
+        ).encode("utf-8")
+
+
+def export_csv(shops: List[Shop]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    for start in range(0, len(shops), EXPORT_CHUNK_ROWS):
+        for shop in shops[start:start + EXPORT_CHUNK_ROWS]:
+            writer.writerow(_csv_cells(shop))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+from importlib.metadata import version
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from .analytics import shops_by_zone, top_categories, working_hours_coverage
+from .metrics import Histogram
+from .repository import DataRepository
+from .snapshot import Snapshot
+
+# Charts on the analytics page, in display order
+CHARTS = ("shops-by-zone", "categories-distribution", "shops-by-category", "working-hours-distribution")
+
+# Versioned so the bundle can be cached forever and still change on upgrades
+PLOTLY_JS_PATH = f"/assets/plotly-{version('plotly')}.min.js"
+
+CHART_RENDER_SECONDS = Histogram(
+    "chart_render_duration_seconds", "Time a worker process takes to build a chart figure", ("chart",)
+)
+
+
+def _dark_layout(fig, **layout) -> None:
+    fig.update_layout(
+        template="plotly_dark",
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        font=dict(color="#9CA3AF"),  # text-gray-400 in Tailwind
+        **layout
+    )
+
+
+def _dark_axes(fig) -> None:
+    fig.update_xaxes(gridcolor="#374151")  # gray-700 in Tailwind
+    fig.update_yaxes(gridcolor="#374151")  # gray-700 in Tailwind
+
+
+def build_figure(name: str, data) -> str:
+    """Build one chart and return its figure JSON.
+
+    Runs in a worker process, so it only takes and returns plain data.
+    pandas and Plotly are imported here, in the workers, instead of at startup.
+    """
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    if name == "shops-by-zone":
+        df = pd.DataFrame(data, columns=["zone_id", "zone", "count"])
+        fig = px.bar(df, x="zone", y="count", title="Shops by Zone")
+        _dark_layout(fig)
+        _dark_axes(fig)
+    elif name == "categories-distribution":
+        df = pd.DataFrame(data, columns=["category_id", "category", "count"])
+        fig = px.pie(df, values="count", names="category", title="Top 10 Categories Distribution")
+        _dark_layout(fig)
+    elif name == "shops-by-category":
+        df = pd.DataFrame(data, columns=["category_id", "category", "count"])
+        fig = px.bar(df, x="category", y="count", title="Top 15 Categories by Number of Shops")
+        _dark_layout(fig, xaxis_tickangle=-45)
+        _dark_axes(fig)
+    elif name == "working-hours-distribution":
+        fig = go.Figure(data=[go.Pie(
+            labels=['With Working Hours', 'Without Working Hours'],
+            values=[data["with_hours"], data["without_hours"]],
+            title="Working Hours Distribution"
+        )])
+        _dark_layout(fig)
+    else:
+        raise ValueError(f"Unknown chart: {name}")
+    return fig.to_json()
+
+
+def timed_build_figure(name: str, data) -> Tuple[str, float]:
+    """build_figure, also returning the seconds it took in the worker (queueing excluded)"""
+    start = time.perf_counter()
+    figure = build_figure(name, data)
+    return figure, time.perf_counter() - start
+
+
+def chart_inputs(repository: DataRepository) -> Dict:
+    """Plain data for every chart, read from the repository aggregates"""
+    aggregates = repository.aggregates
+    return {
+        "shops-by-zone": shops_by_zone(aggregates, repository.zones),
+        "categories-distribution": top_categories(aggregates, repository.categories, 10),
+        "shops-by-category": top_categories(aggregates, repository.categories, 15),
+        "working-hours-distribution": working_hours_coverage(aggregates),
+    }
+
+
+def script_json(value: str) -> str:
+    """Make JSON safe to embed inside a <script> element"""
+    return value.replace("</", "<\\/")
+
+
+class FigureCache:
+    """Figure JSON of every chart, rebuilt in a worker pool when the data changes.
+
+    Entries are keyed by the repository revision. Builds are shared, so
+    concurrent page views wait for one rebuild instead of starting their own.
+    """
+
+    def __init__(self, repository: DataRepository, run: Callable[..., Awaitable]):
+        self.repository = repository
+        # Runs a function in the worker pool (see utils/workers.py)
+        self._run = run
+        self._key: Optional[int] = None
+        self._figures: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+
+    async def figures(self) -> Dict[str, str]:
+        if self._key == self.repository.revision:
+            return self._figures
+        async with self._lock:
+            key = self.repository.revision
+            if self._key != key:
+                inputs = chart_inputs(self.repository)
+                results: List[Tuple[str, float]] = await asyncio.gather(*(
+                    self._run(timed_build_figure, name, inputs[name]) for name in CHARTS
+                ))
+                for name, (_, seconds) in zip(CHARTS, results):
+                    CHART_RENDER_SECONDS.observe(seconds, name)
+                self._figures = {name: figure for name, (figure, _) in zip(CHARTS, results)}
+                self._key = key
+        return self._figures
+
+    async def figure(self, name: str) -> str:
+        return (await self.figures())[name]
+
+
+def chart_html(figure_json: str) -> str:
+    """Stand-alone chart page loading the shared plotly.js bundle"""
+    return f"""<html>
+    <head><script src="{PLOTLY_JS_PATH}"></script></head>
+    <body style="margin:0">
+        <div id="chart" style="width:100%;height:100%"></div>
+        <script>
+            const figure = {script_json(figure_json)};
+            Plotly.newPlot("chart", figure.data, figure.layout, {{responsive: true}});
+        </script>
+    </body>
+</html>"""
+
+
+def dashboard_html(figures: Dict[str, str]) -> str:
+    """Analytics page with every chart, plotly.js loaded once"""
+    charts = "\n".join(
+        f'                    <div id="{name}" class="w-full h-96 bg-white rounded-lg shadow-lg"></div>'
+        for name in CHARTS
+    )
+    payload = "{" + ",".join(f"{json.dumps(name)}: {script_json(figures[name])}" for name in CHARTS) + "}"
+    return f"""
+    <html>
+        <head>
+            <title>Mayoristas Paraguay Analytics</title>
+            <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
+            <script src="{PLOTLY_JS_PATH}"></script>
+        </head>
+        <body class="bg-gray-100">
+            <div class="container mx-auto px-4 py-8">
+                <h1 class="text-4xl font-bold mb-8">Mayoristas Paraguay Analytics</h1>
+                <div class="grid grid-cols-1 md:grid-cols-2 gap-8">
+{charts}
+                </div>
+            </div>
+            <script>
+                const figures = {payload};
+                for (const [name, figure] of Object.entries(figures)) {{
+                    Plotly.newPlot(name, figure.data, figure.layout, {{responsive: true}});
+                }}
+            </script>
+        </body>
+    </html>
+    """
+
+
+_plotly_js: Optional[Snapshot] = None
+
+
+def plotly_js() -> Snapshot:
+    """The plotly.js bundle shipped with the plotly package, read once"""
+    global _plotly_js
+    if _plotly_js is None:
+        from plotly.offline import get_plotlyjs
+        _plotly_js = Snapshot(0, get_plotlyjs().encode())
+    return _plotly_js
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from .persistence import file_lock, write_atomic
+from .storage import DELETE_BATCH_SIZE, StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class DeleteQueue:
+    """Storage objects waiting to be deleted, drained in the background.
+
+    The queue is a small JSON file shared by every worker process (guarded
+    by file_lock), so queued deletes survive restarts:
+        {"queue": {url: {"due": timestamp, "attempts": n}}, "last_sweep": timestamp}
+    Requests only add URLs in memory; the background task writes them to the
+    file and then deletes due entries in batches of batch_size (one storage
+    call, a single request with GCS). Failed deletes are retried with
+    exponential backoff and dropped after max_attempts (the next sweep finds
+    them again). Taken entries are leased, so two workers never delete the
+    same batch.
+
+    Content-addressed objects can be needed again after they were queued (the
+    same image is uploaded again), so every URL is checked with is_referenced
+    right before it is deleted, and new uploads are discarded from the queue.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        storage: StorageBackend,
+        is_referenced: Callable[[str], bool],
+        interval: float = 5.0,
+        batch_size: int = DELETE_BATCH_SIZE,
+        grace: float = 5.0,
+        backoff: float = 30.0,
+        max_attempts: int = 8,
+        lease: float = 300.0,
+    ):
+        self.path = path
+        self.storage = storage
+        self.is_referenced = is_referenced
+        self.interval = interval
+        self.batch_size = max(1, min(batch_size, DELETE_BATCH_SIZE))
+        # Queued entries wait this long, so other workers see the change that released them
+        self.grace = grace
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        self.lease = lease
+        # url -> True (queued) / False (needed again), not yet written to the file
+        self._changes: Dict[str, bool] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, urls: Iterable[str]) -> None:
+        for url in urls:
+            self._changes[url] = True
+        if self._changes:
+            self._wake.set()
+
+    def discard(self, urls: Iterable[str]) -> None:
+        """Keep objects that are in use again"""
+        for url in urls:
+            self._changes[url] = False
+
+    def _read(self) -> Dict:
+        try:
+            with open(self.path, "rb") as f:
+                state = json.loads(f.read() or b"{}")
+        except FileNotFoundError:
+            state = {}
+        state.setdefault("queue", {})
+        state.setdefault("last_sweep", 0)
+        return state
+
+    def _write(self, state: Dict) -> None:
+        write_atomic(self.path, json.dumps(state, separators=(",", ":")).encode("utf-8"))
+
+    def _update(self, change: Callable[[Dict], bool]):
+        """Apply change to the shared state under the lock, writing it if change returns True"""
+        with file_lock(f"{self.path}.lock"):
+            state = self._read()
+            if change(state):
+                self._write(state)
+            return state
+
+    def _apply(self, state: Dict, changes: Dict[str, bool]) -> bool:
+        queue = state["queue"]
+        due = time.time() + self.grace
+        for url, queued in changes.items():
+            if queued:
+                queue.setdefault(url, {"due": due, "attempts": 0})
+            else:
+                queue.pop(url, None)
+        return bool(changes)
+
+    def _take_changes(self) -> Dict[str, bool]:
+        changes, self._changes = self._changes, {}
+        return changes
+
+    def _flush(self, changes: Dict[str, bool]) -> None:
+        self._update(lambda state: self._apply(state, changes))
+
+    def _lease_batch(self, changes: Dict[str, bool]) -> List[str]:
+        """Write pending changes and lease the next due entries"""
+        batch: List[str] = []
+
+        def change(state: Dict) -> bool:
+            self._apply(state, changes)
+            now = time.time()
+            for url, entry in state["queue"].items():
+                if entry["due"] <= now:
+                    entry["due"] = now + self.lease
+                    batch.append(url)
+                    if len(batch) == self.batch_size:
+                        break
+            return bool(changes or batch)
+
+        self._update(change)
+        return batch
+
+    def _finish_batch(self, errors: Dict[str, Optional[Exception]]) -> None:
+        def change(state: Dict) -> bool:
+            queue = state["queue"]
+            for url, error in errors.items():
+                entry = queue.get(url)
+                if entry is None:
+                    continue
+                if error is None:
+                    del queue[url]
+                    continue
+                entry["attempts"] += 1
+                if entry["attempts"] >= self.max_attempts:
+                    logger.error("Giving up deleting %s after %d attempts: %r", url, entry["attempts"], error)
+                    del queue[url]
+                else:
+                    delay = self.backoff * 2 ** (entry["attempts"] - 1)
+                    logger.warning("Deleting %s failed (%r), retry in %.0fs", url, error, delay)
+                    entry["due"] = time.time() + delay
+            return bool(errors)
+
+        self._update(change)
+
+    async def drain_once(self) -> int:
+        """Persist queued URLs and delete one batch of due entries, return the batch size"""
+        changes = self._take_changes()
+        try:
+            batch = await asyncio.to_thread(self._lease_batch, changes)
+        except Exception:
+            # Keep them for the next attempt (newer changes win)
+            self._changes = {**changes, **self._changes}
+            raise
+        if not batch:
+            return 0
+        # Entries in use again are dropped without deleting them
+        results: Dict[str, Optional[Exception]] = {url: None for url in batch if self.is_referenced(url)}
+        unused = [url for url in batch if url not in results]
+        if unused:
+            try:
+                results.update(await self.storage.delete_files(unused))
+            except Exception as e:
+                results.update((url, e) for url in unused)
+        await asyncio.to_thread(self._finish_batch, results)
+        deleted = sum(1 for url in unused if results[url] is None)
+        if deleted:
+            logger.info("Deleted %d unused images", deleted)
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # Keep going while full batches are due
+                while await self.drain_once() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Image delete queue failed")
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # URLs queued since the last drain are deleted after the restart
+        changes = self._take_changes()
+        if changes:
+            await asyncio.to_thread(self._flush, changes)
+
+    def pending(self) -> int:
+        return len(self._read()["queue"])
+
+    def claim_sweep(self, interval: float) -> bool:
+        """Record a sweep starting now, unless any worker ran one in the last interval seconds"""
+        claimed = False
+
+        def change(state: Dict) -> bool:
+            nonlocal claimed
+            now = time.time()
+            if now - state["last_sweep"] < interval:
+                return False
+            state["last_sweep"] = now
+            claimed = True
+            return True
+
+        self._update(change)
+        return claimed
+
+
+class ImageCollector:
+    """Mark-and-sweep collection of stored images that nothing references.
+
+    Mark: every URL referenced by the data (see ImageReferences). Sweep: list
+    the image folders in storage and queue every unreferenced object older
+    than min_age for deletion. The age limit protects uploads whose record
+    has not been saved yet. A dry run only reports what would be deleted.
+    Runs every `interval` seconds in whichever worker claims it first.
+    """
+
+    def __init__(
+        self,
+        storage: StorageBackend,
+        queue: DeleteQueue,
+        is_referenced: Callable[[str], bool],
+        folders: Iterable[str],
+        interval: float = 86400.0,
+        min_age: float = 3600.0,
+    ):
+        self.storage = storage
+        self.queue = queue
+        self.is_referenced = is_referenced
+        self.folders = list(folders)
+        self.interval = interval
+        self.min_age = min_age
+        self._task: Optional[asyncio.Task] = None
+
+    async def collect(self, dry_run: bool = True) -> Dict:
+        """Find unreferenced images and, unless dry_run, queue them for deletion"""
+        start = time.perf_counter()
+        listings = await asyncio.gather(*(self.storage.list_files(folder) for folder in self.folders))
+        cutoff = time.time() - self.min_age
+        scanned = referenced = recent = orphaned_bytes = 0
+        orphans = []
+        for objects in listings:
+            for url, size, modified in objects:
+                scanned += 1
+                if self.is_referenced(url):
+                    referenced += 1
+                elif modified > cutoff:
+                    recent += 1
+                else:
+                    orphans.append(url)
+                    orphaned_bytes += size
+        if not dry_run:
+            self.queue.enqueue(orphans)
+        report = {
+            "dry_run": dry_run,
+            "scanned": scanned,
+            "referenced": referenced,
+            "recent": recent,
+            "orphaned": len(orphans),
+            "orphaned_bytes": orphaned_bytes,
+            "orphans": orphans,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        logger.info(
+            "Image sweep%s: %d objects, %d referenced, %d recent, %d orphaned (%d bytes)",
+            " (dry run)" if dry_run else "", scanned, referenced, recent, len(orphans), orphaned_bytes
+        )
+        return report
+
+    async def _run(self) -> None:
+        while True:
+            # Check often enough that restarts do not keep postponing the sweep
+            await asyncio.sleep(min(self.interval, 600))
+            try:
+                if await asyncio.to_thread(self.queue.claim_sweep, self.interval):
+                    await self.collect(dry_run=False)
+            except Exception:
+                logger.exception("Image sweep failed")
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
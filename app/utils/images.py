@@ -0,0 +1,175 @@
+import asyncio
+import io
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException, UploadFile
+from ..models.models import ImageRenditions
+from .storage import StorageBackend
+
+# Widths (px) of the renditions produced for every uploaded image. Narrower
+# images are never upscaled: their renditions keep the original width.
+RENDITIONS = {"thumbnail": 320, "card": 640, "banner": 1600}
+# Widest fallback (the URL returned as "url", for clients without WebP/AVIF)
+FALLBACK_WIDTH = RENDITIONS["banner"]
+# Anything larger is rejected before decoding (a small file can decode to gigabytes)
+MAX_PIXELS = 50_000_000
+
+CONTENT_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpg": "image/jpeg", "png": "image/png"}
+ENCODE_OPTIONS = {
+    "webp": dict(format="WEBP", quality=80, method=4),
+    "avif": dict(format="AVIF", quality=60, speed=6),
+    "jpg": dict(format="JPEG", quality=85, optimize=True, progressive=True),
+    "png": dict(format="PNG", optimize=True),
+}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def _image_formats():
+    """Rendition formats this installation can encode. AVIF needs pillow-avif-plugin"""
+    try:
+        import pillow_avif  # noqa: F401  (registers the AVIF codec)
+        return ("avif", "webp")
+    except ImportError:
+        return ("webp",)
+
+
+def _to_srgb(image):
+    """Apply the embedded color profile, so dropping it does not shift colors"""
+    icc = image.info.get("icc_profile")
+    if not icc:
+        return image
+    try:
+        from PIL import ImageCms
+        return ImageCms.profileToProfile(
+            image, io.BytesIO(icc), ImageCms.createProfile("sRGB"), outputMode=image.mode
+        )
+    except Exception:
+        return image
+
+
+def _resized(image, width: int):
+    from PIL import Image
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def _encode(image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, **ENCODE_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def process_image(content: bytes) -> Optional[Dict]:
+    """Strip metadata and encode the fallback and every rendition of an image.
+
+    Runs in a worker process, so it only takes and returns plain data:
+    {"fallback": (extension, bytes), "renditions": {name: {format: bytes}}}.
+    Returns None for animated images, which are stored as uploaded.
+    Pillow is imported here, in the workers, instead of at startup.
+    """
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(io.BytesIO(content))
+        # Only the header has been read so far
+        if image.width * image.height > MAX_PIXELS:
+            raise InvalidImage(f"{image.width}x{image.height} exceeds {MAX_PIXELS} pixels")
+        if getattr(image, "is_animated", False):
+            return None
+        # Apply the EXIF orientation before the EXIF data is dropped
+        image = ImageOps.exif_transpose(image)
+        alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        image = _to_srgb(image.convert("RGBA" if alpha else "RGB"))
+    except InvalidImage:
+        raise
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise InvalidImage("the file could not be decoded")
+    # Nothing from the original (EXIF, XMP, ICC, text chunks) reaches the encoders
+    image.info = {}
+
+    fallback_ext = "png" if alpha else "jpg"
+    renditions = {}
+    for name, width in RENDITIONS.items():
+        resized = _resized(image, width)
+        renditions[name] = {fmt: _encode(resized, fmt) for fmt in _image_formats()}
+    return {"fallback": (fallback_ext, _encode(_resized(image, FALLBACK_WIDTH), fallback_ext)), "renditions": renditions}
+
+
+class ImagePipeline:
+    """Uploads images as optimized renditions instead of the original file.
+
+    Images are decoded and re-encoded in a worker pool (CPU heavy). The
+    results are uploaded in parallel through the storage backend:
+      the fallback (jpg or png), returned as the image URL
+      one object per rendition and format
+    Every object is named after the sha256 of its bytes (see storage.content_path),
+    so uploading the same image again stores nothing new.
+    """
+
+    def __init__(self, storage: StorageBackend, run: Callable[..., Awaitable]):
+        self.storage = storage
+        # Runs a function in the worker pool (see utils/workers.py)
+        self._run = run
+
+    async def upload(self, file: UploadFile, folder: str) -> Tuple[str, Optional[ImageRenditions]]:
+        """Upload an image, return its URL and renditions (None when stored as uploaded)"""
+        content = await self.storage.read_upload(file)
+        try:
+            processed = await self._run(process_image, content)
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+        if processed is None:
+            extension = file.filename.split('.')[-1].lower()
+            url = await self.storage.put_content(folder, extension, content, file.content_type)
+            return url, None
+
+        fallback_ext, fallback = processed["fallback"]
+        uploads = [(None, fallback_ext, fallback)]
+        for name, formats in processed["renditions"].items():
+            uploads.extend((name, fmt, encoded) for fmt, encoded in formats.items())
+        urls = await asyncio.gather(*(
+            self.storage.put_content(folder, ext, encoded, CONTENT_TYPES[ext]) for _, ext, encoded in uploads
+        ))
+
+        renditions: ImageRenditions = {}
+        for (name, fmt, _), url in zip(uploads[1:], urls[1:]):
+            renditions.setdefault(name, {})[fmt] = url
+        return urls[0], renditions
+
+
+class PendingRenditions:
+    """Renditions of uploaded images not yet saved on a shop or banner, by image URL.
+
+    Kept in memory only: an upload nobody saves leaves nothing in the data
+    store. Entries expire after `ttl` seconds (the image collector may sweep
+    unreferenced objects after that anyway) and at most `max_size` are kept,
+    the oldest dropped first. Used from the event loop only.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # url -> (renditions, expiry time)
+        self._entries: "OrderedDict[str, Tuple[ImageRenditions, float]]" = OrderedDict()
+
+    def put(self, url: str, renditions: ImageRenditions) -> None:
+        self._entries[url] = (renditions, time.monotonic() + self.ttl)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def take(self, url: Optional[str]) -> Optional[ImageRenditions]:
+        """Remove and return the renditions of url, None if unknown or expired"""
+        entry = self._entries.pop(url, None) if url else None
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,257 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds (the Prometheus client defaults)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Response appends "; charset=utf-8"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Label values -> sample values
+Samples = Dict[Tuple[str, ...], List[float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+
+class Registry:
+    """The metrics exposed on /metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric") -> None:
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            documentation = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {metric.name} {documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """Base of the sharded metrics.
+
+    Every thread that records a value gets its own shard (a dict owned by that
+    thread), so recording never takes a lock and never races: the event loop,
+    the storage pool and the persistence thread each write to their own
+    shard. Scrapes add the shards up; a scrape running during a write may see
+    a histogram's count one ahead of its sum, which the next scrape corrects.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Samples] = []
+        registry.register(self)
+
+    def _new(self) -> List[float]:
+        raise NotImplementedError
+
+    def _values(self, labels: Tuple[str, ...]) -> List[float]:
+        """The calling thread's sample values for labels"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # list.append is atomic, no lock needed to publish the shard
+            self._shards.append(shard)
+        values = shard.get(labels)
+        if values is None:
+            if len(labels) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+            values = shard[labels] = self._new()
+        return values
+
+    def collect(self) -> Samples:
+        """Sample values per label values, summed over the shards"""
+        total: Samples = {}
+        for shard in list(self._shards):
+            # dict.copy is atomic: the owning thread may add labels meanwhile
+            for labels, values in shard.copy().items():
+                merged = total.get(labels)
+                if merged is None:
+                    total[labels] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        merged[i] += value
+        return dict(sorted(total.items()))
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new(self) -> List[float]:
+        return [0.0]
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values(labels)[0] += amount
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(values[0])}"
+            for labels, values in self.collect().items()
+        ]
+
+
+class Histogram(Metric):
+    """Observations counted in `buckets` (upper bounds, inclusive), plus their sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new(self) -> List[float]:
+        # Per-bucket counts (not cumulative), then sum and count
+        return [0.0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, *labels: str) -> None:
+        values = self._values(labels)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, values in self.collect().items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames + ("le",), labels + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {_format_value(cumulative)}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{label_text} {_format_value(values[-1])}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Gauge:
+    """A value that goes up and down: set explicitly, or read from `function` on every scrape"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], float]] = None, registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        # Last value wins, a plain assignment is atomic
+        self._values: Dict[Tuple[str, ...], float] = {}
+        registry.register(self)
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {_format_value(self.function())}"]
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self._values.copy().items())
+        ]
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by method, route template and status code",
+    ("method", "route", "status")
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request, until the response is sent",
+    ("method", "route")
+)
+
+# Requests no route matched share one label value, so scanners cannot create new series
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_template(scope: Dict, root_path: str) -> str:
+    """Route path template of a request the router has handled, e.g. /api/shops/{shop_id}"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mounted apps (static files) leave their prefix in root_path
+    mounted = scope.get("root_path", "")
+    if len(mounted) > len(root_path):
+        return mounted[len(root_path):] + "/{path:path}"
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting HTTP requests and timing them per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        root_path = scope.get("root_path", "")
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_template(scope, root_path)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status))
@@ -0,0 +1,514 @@
+import asyncio
+import gc
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from ..models.models import DataStructure
+from .metrics import Counter, Histogram
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+COMMIT_SECONDS = Histogram("data_commit_duration_seconds", "Time to durably write one batch of journal records")
+COMMIT_RECORDS = Counter("data_commit_records_total", "Journal records written")
+COMMIT_BYTES = Counter("data_commit_bytes_total", "Bytes of journal records written")
+COMMIT_FAILURES = Counter("data_commit_failures_total", "Failed journal writes (the records are kept and retried)")
+
+# Journal records are compact JSON objects, one per line:
+#   {"op": "put", "e": "shops", "id": 5, "v": {...}}   replace entity 5 (or append it)
+#   {"op": "del", "e": "shops", "id": 5}               remove entity 5
+#   {"op": "set", "e": "primary_banner", "v": [...]}   replace a scalar field
+# Every record carries the full new value, so replaying a record twice is harmless.
+# Committed records also carry "ver", the data version of the commit they belong to.
+
+
+def encode_records(records: Iterable[Dict]) -> bytes:
+    return "".join(
+        json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in records
+    ).encode("utf-8")
+
+
+def read_records(path: str) -> List[Dict]:
+    """Read a journal segment, ignoring a torn last line left by a crash mid-append"""
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+def apply_records(data: Dict, records: Iterable[Dict]) -> Dict:
+    """Replay journal records onto a data.json-shaped dict"""
+    positions: Dict[str, Optional[Dict]] = {}
+
+    def index(field: str) -> Dict:
+        if positions.get(field) is None:
+            positions[field] = {item["id"]: i for i, item in enumerate(data.setdefault(field, []))}
+        return positions[field]
+
+    for record in records:
+        op, field = record["op"], record["e"]
+        data["version"] = max(data.get("version", 0), record.get("ver", 0))
+        if op == "set":
+            data[field] = record["v"]
+        elif op == "put":
+            items, pos_by_id = data.setdefault(field, []), index(field)
+            value = record["v"]
+            pos = pos_by_id.get(record["id"], pos_by_id.get(value["id"]))
+            if pos is None:
+                pos_by_id[value["id"]] = len(items)
+                items.append(value)
+            else:
+                pos_by_id.pop(items[pos]["id"], None)
+                items[pos] = value
+                pos_by_id[value["id"]] = pos
+        elif op == "del":
+            pos = index(field).get(record["id"])
+            if pos is not None:
+                data[field].pop(pos)
+                positions[field] = None
+    return data
+
+
+@contextmanager
+def paused_gc():
+    """Suspend the cyclic garbage collector while building a large object graph.
+
+    Loading creates millions of objects and none of them is garbage yet, but
+    every allocation threshold still triggers a collection that walks them
+    all. Pausing it makes loading a large catalogue several times faster.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # Not supported on this platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: str, payload: bytes) -> None:
+    """Write payload to path via a temporary file and an atomic rename"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+class DataStore(ABC):
+    """Storage backend for DataStructure.
+
+    Backends load the whole structure once at startup and afterwards receive
+    the journal records produced by DataRepository, so every write is
+    proportional to what changed rather than to the catalogue size.
+
+    Every commit gets the next data version. Versions are global across
+    processes, which lets other workers fetch just the records they missed.
+    """
+
+    @abstractmethod
+    def load(self) -> DataStructure:
+        """Read the current state, including its version"""
+
+    @abstractmethod
+    def commit(self, records: List[Dict]) -> int:
+        """Durably apply journal records and return the new data version; called from a worker thread"""
+
+    @abstractmethod
+    def current_version(self) -> int:
+        """Latest committed data version, cheap enough to poll"""
+
+    @abstractmethod
+    def changes_since(self, version: int) -> Optional[List[Dict]]:
+        """Records committed after version, tagged with "ver", or None if they are no longer available"""
+
+    def compact(self) -> None:
+        """Fold incremental writes into the main store, if the backend has such a step"""
+
+    def size(self) -> int:
+        """Bytes the stored state takes on disk"""
+        return 0
+
+
+@contextmanager
+def file_lock(path: str, exclusive: bool = True):
+    """Advisory lock shared by every process using the same data file"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _last_record_version(path: str) -> int:
+    """Version of the last complete record in a journal segment, reading only its tail"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b""
+        while pos > 0:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            lines = tail.split(b"\n")
+            # lines[-1] is empty (or a torn record), the last complete one precedes it
+            if len(lines) > 2 or (pos == 0 and len(lines) == 2):
+                try:
+                    return json.loads(lines[-2]).get("ver", 0)
+                except ValueError:
+                    return 0
+    return 0
+
+
+class JournalStore(DataStore):
+    """data.json snapshot plus an append-only, fsynced journal of mutation records.
+
+    Each commit appends one line per change to `<data file>.journal`. Once the
+    journal holds `compact_after` records it is rotated to
+    `<data file>.journal.compacting` and a background thread folds it into a
+    fresh snapshot. Loading replays the snapshot, then any rotated segment
+    left by an interrupted compaction, then the live journal.
+
+    Commits, rotation and the final step of a compaction hold an flock on
+    `<data file>.lock`, so several worker processes can share the files.
+    The latest version is cached in `<data file>.version`.
+    """
+
+    def __init__(self, path: str, compact_after: int = 1000):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.compacting_path = f"{path}.journal.compacting"
+        self.lock_path = f"{path}.lock"
+        self.version_path = f"{path}.version"
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._journal_records = 0
+        self._compaction: Optional[threading.Thread] = None
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True):
+        with self._lock, file_lock(self.lock_path, exclusive):
+            yield
+
+    def _segments(self) -> List[str]:
+        return [segment for segment in (self.compacting_path, self.journal_path) if os.path.exists(segment)]
+
+    def _read_version_file(self) -> int:
+        try:
+            with open(self.version_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_version_file(self, version: int, durable: bool = False) -> None:
+        if durable:
+            write_atomic(self.version_path, str(version).encode())
+        else:
+            tmp_path = f"{self.version_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(version))
+            os.replace(tmp_path, self.version_path)
+
+    def _current_version(self) -> int:
+        # The journal tails are authoritative, the version file covers the
+        # case where both segments have been compacted away
+        return max(
+            self._read_version_file(),
+            _last_record_version(self.compacting_path),
+            _last_record_version(self.journal_path),
+        )
+
+    def current_version(self) -> int:
+        with self._locked(exclusive=False):
+            return self._current_version()
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path in [self.path] + self._segments() if os.path.exists(path))
+
+    def load(self) -> DataStructure:
+        with self._locked(exclusive=False), paused_gc():
+            with open(self.path, "rb") as f:
+                data = json.loads(f.read())
+            for segment in self._segments():
+                records = read_records(segment)
+                apply_records(data, records)
+                if segment == self.journal_path:
+                    self._journal_records = len(records)
+            data["version"] = max(data.get("version", 0), self._read_version_file())
+            # With pydantic 2.4 json.loads + model_validate beats model_validate_json
+            # on raw bytes (see benchmarks/bench_startup.py)
+            data = DataStructure.model_validate(data)
+        if os.path.exists(self.compacting_path):
+            # A previous compaction did not finish, finish it now
+            self._start_compaction()
+        return data
+
+    def changes_since(self, version: int) -> Optional[List[Dict]]:
+        with self._locked(exclusive=False):
+            current = self._current_version()
+            records = [
+                record
+                for segment in self._segments()
+                for record in read_records(segment)
+                if record.get("ver", 0) > version
+            ]
+        # Versions are consecutive, so a gap means those records were compacted
+        if {record["ver"] for record in records} != set(range(version + 1, current + 1)):
+            return None
+        return records
+
+    def commit(self, records: List[Dict]) -> int:
+        """Append records to the journal and fsync before returning the new version"""
+        with self._locked():
+            version = self._current_version() + 1
+            payload = encode_records(dict(record, ver=version) for record in records)
+            self._repair_tail()
+            fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, payload)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            COMMIT_BYTES.inc(amount=len(payload))
+            self._write_version_file(version)
+            self._journal_records += len(records)
+            if self._journal_records >= self.compact_after and self._rotate():
+                self._start_compaction()
+        return version
+
+    def _repair_tail(self) -> None:
+        """Drop a torn last record left by a process that crashed mid-append"""
+        try:
+            f = open(self.journal_path, "r+b")
+        except FileNotFoundError:
+            return
+        with f:
+            pos = f.seek(0, os.SEEK_END)
+            if pos == 0:
+                return
+            f.seek(pos - 1)
+            if f.read(1) == b"\n":
+                return
+            while pos > 0:
+                step = min(65536, pos)
+                pos -= step
+                f.seek(pos)
+                newline = f.read(step).rfind(b"\n")
+                if newline != -1:
+                    f.truncate(pos + newline + 1)
+                    return
+            f.truncate(0)
+
+    def _rotate(self) -> bool:
+        """Move the live journal aside for compaction; caller holds the lock"""
+        if os.path.exists(self.compacting_path) or not os.path.exists(self.journal_path):
+            return False  # Wait until the pending segment has been folded in
+        os.replace(self.journal_path, self.compacting_path)
+        self._journal_records = 0
+        return True
+
+    def _start_compaction(self) -> None:
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(target=self._compact_in_background, name="journal-compaction", daemon=True)
+        self._compaction.start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self._compact()
+        except Exception:
+            # The rotated segment stays on disk and is replayed/retried on the next load
+            logger.exception("Journal compaction failed")
+
+    def _compact(self) -> None:
+        """Fold the rotated journal segment into a new snapshot"""
+        with self._locked(exclusive=False):
+            try:
+                segment = os.stat(self.compacting_path)
+            except FileNotFoundError:
+                return  # Another process finished it
+            with open(self.path, "rb") as f:
+                data = json.load(f)
+            apply_records(data, read_records(self.compacting_path))
+
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._locked():
+            try:
+                current = os.stat(self.compacting_path)
+            except FileNotFoundError:
+                current = None
+            if current is None or current.st_ino != segment.st_ino:
+                os.unlink(tmp_path)  # Someone else folded this segment already
+                return
+            os.replace(tmp_path, self.path)
+            _fsync_dir(self.path)
+            self._write_version_file(max(self._read_version_file(), data.get("version", 0)), durable=True)
+            os.unlink(self.compacting_path)
+
+    def compact(self) -> None:
+        """Synchronously fold the whole journal into the snapshot"""
+        if self._compaction is not None:
+            self._compaction.join()
+        self._compact()
+        with self._locked():
+            rotated = self._rotate()
+        if rotated:
+            self._compact()
+
+
+class PersistenceWorker:
+    """Commits journal records from a background task, off the event loop.
+
+    Records submitted while a write is pending are coalesced into one journal
+    append. Durability modes:
+      - "sync":  the caller waits until its records are fsynced
+      - "group": like sync, but the worker waits `window` seconds first so a
+                 burst of writes shares a single fsync
+      - "async": the caller returns immediately; records are written after
+                 `window` seconds and on flush()/stop(). A write acknowledged
+                 this way is lost if the process dies before that
+
+    A failed write never drops records: the changes are already live in
+    memory, so the batch goes back to the head of the queue (in order,
+    with the requests waiting on it) and is retried with exponential
+    backoff from `retry_backoff` up to `max_retry_backoff` seconds. Waiting
+    requests get their answer once their records are on disk.
+
+    `on_commit(records, version)` is called on the event loop after each write.
+    """
+
+    MODES = ("sync", "group", "async")
+
+    def __init__(self, store: DataStore, mode: str = "group", window: float = 0.02,
+                 retry_backoff: float = 0.5, max_retry_backoff: float = 30.0, stop_timeout: float = 30.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown persistence mode {mode!r}, expected one of {', '.join(self.MODES)}")
+        self.store = store
+        self.mode = mode
+        self.window = 0.0 if mode == "sync" else window
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.stop_timeout = stop_timeout
+        self._pending: List[Tuple[List[Dict], Optional[asyncio.Future]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.on_commit: Optional[Callable[[List[Dict], int], None]] = None
+
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def start(self) -> None:
+        self._ensure_running()
+
+    async def submit(self, records: List[Dict], wait: Optional[bool] = None) -> None:
+        """Queue records for the journal; waits for the write unless in async mode"""
+        if wait is None:
+            wait = self.mode != "async"
+        if not records and not wait:
+            return
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._pending.append((records, future))
+        self._wakeup.set()
+        if future is not None:
+            await future
+
+    async def flush(self) -> None:
+        """Wait until everything submitted so far has been written"""
+        await self.submit([], wait=True)
+
+    def pending(self) -> int:
+        """Records queued or being retried"""
+        return sum(len(records) for records, _ in self._pending)
+
+    async def stop(self) -> None:
+        if self._task is None or self._task.done():
+            return
+        try:
+            await asyncio.wait_for(self.flush(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.error("Stopping with %d journal records not persisted", self.pending())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            await self._wakeup.wait()
+            if self.window:
+                # Debounce: let the rest of the burst arrive before writing
+                await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            records = [record for batch_records, _ in batch for record in batch_records]
+            try:
+                if records:
+                    with COMMIT_SECONDS.time():
+                        version = await asyncio.to_thread(self.store.commit, records)
+                    COMMIT_RECORDS.inc(amount=len(records))
+                else:
+                    version = None
+            except Exception:
+                failures += 1
+                COMMIT_FAILURES.inc()
+                delay = min(self.retry_backoff * 2 ** (failures - 1), self.max_retry_backoff)
+                logger.exception(
+                    "Persisting %d journal records failed (attempt %d), retrying in %.1f s", len(records), failures, delay
+                )
+                # Ahead of anything submitted meanwhile, so the journal keeps the order of the changes
+                self._pending[:0] = batch
+                await asyncio.sleep(delay)
+                self._wakeup.set()
+                continue
+            failures = 0
+            if version is not None and self.on_commit is not None:
+                self.on_commit(records, version)
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_result(None)
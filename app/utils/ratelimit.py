@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+
+class RateLimiter:
+    """Token buckets per key: `burst` attempts at once, refilled at `rate` per second.
+
+    Buckets refill continuously, so the limit applies over any sliding window
+    rather than per fixed minute. At most `max_keys` buckets are kept; the
+    least recently used one is dropped first (it is the one closest to full
+    anyway). Used from the event loop only.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, time of the last update)
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(self.burst)
+        tokens, updated = bucket
+        return min(float(self.burst), tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Seconds until key may make an attempt, 0 if it may now"""
+        now = time.monotonic() if now is None else now
+        tokens = self._tokens(key, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key: Hashable, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def reset(self, key: Hashable) -> None:
+        self._buckets.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class LoginLimiter:
+    """Limits login attempts per client IP and per username.
+
+    An attempt counts against both buckets and is only allowed when both have
+    a token left, so neither one client trying many usernames nor many
+    clients trying one username get through. Checked before the password is
+    hashed. A successful login clears both buckets.
+    """
+
+    def __init__(self, per_ip: RateLimiter, per_username: RateLimiter):
+        self.per_ip = per_ip
+        self.per_username = per_username
+
+    @staticmethod
+    def _username_key(username: str) -> str:
+        return username.strip().casefold()
+
+    def attempt(self, ip: str, username: str) -> float:
+        """Record an attempt; returns 0 if allowed, else the seconds to wait (nothing is recorded)"""
+        now = time.monotonic()
+        user_key = self._username_key(username)
+        wait = max(self.per_ip.retry_after(ip, now), self.per_username.retry_after(user_key, now))
+        if wait > 0:
+            return wait
+        self.per_ip.consume(ip, now)
+        self.per_username.consume(user_key, now)
+        return 0.0
+
+    def succeeded(self, ip: str, username: str) -> None:
+        self.per_ip.reset(ip)
+        self.per_username.reset(self._username_key(username))
@@ -0,0 +1,67 @@
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+from ..models.models import ImageRenditions, Shop
+
+# DataStructure fields that hold image URLs, besides the shops
+BANNER_FIELDS = ("primary_banner", "secondary_banner", "recommended_image", "other_businesses", "branding")
+# ...and the renditions of the images those fields use
+IMAGE_FIELDS = BANNER_FIELDS + ("banner_renditions",)
+
+
+def rendition_urls(renditions: Optional[ImageRenditions]) -> List[str]:
+    return [url for formats in (renditions or {}).values() for url in formats.values()]
+
+
+def shop_image_urls(shop: Shop) -> List[str]:
+    return [url for url in [shop.img, *rendition_urls(shop.img_renditions)] if url]
+
+
+def field_image_urls(field: str, value: Any) -> List[str]:
+    """Image URLs referenced by one of the IMAGE_FIELDS"""
+    if not value:
+        return []
+    if field in ("primary_banner", "secondary_banner"):
+        urls = list(value)
+    elif field == "branding":
+        urls = [value.get("logo"), value.get("client_logo")]
+    elif field == "banner_renditions":
+        urls = [url for image, renditions in value.items() for url in [image, *rendition_urls(renditions)]]
+    else:
+        urls = [value]
+    return [url for url in urls if url]
+
+
+class ImageReferences:
+    """How many records reference each image URL.
+
+    The repository adds and removes the URLs of every shop it indexes and
+    unindexes, and hands over every new value of the IMAGE_FIELDS. Storage
+    objects are only deleted once their URL is no longer referenced, since
+    identical uploads share one content-addressed object.
+    """
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        # URLs each field contributed, so values mutated in place are still removed correctly
+        self._fields: Dict[str, List[str]] = {}
+
+    def __contains__(self, url: str) -> bool:
+        return self.counts.get(url, 0) > 0
+
+    def add(self, urls: Iterable[str]) -> None:
+        self.counts.update(urls)
+
+    def remove(self, urls: Iterable[str]) -> None:
+        urls = list(urls)
+        self.counts.subtract(urls)
+        for url in set(urls):
+            if self.counts[url] <= 0:
+                del self.counts[url]
+
+    def set_field(self, field: str, value: Any) -> None:
+        if field not in IMAGE_FIELDS:
+            return
+        self.remove(self._fields.pop(field, []))
+        urls = field_image_urls(field, value)
+        self._fields[field] = urls
+        self.add(urls)
@@ -0,0 +1,357 @@
+import copy
+from bisect import bisect_right
+from datetime import datetime
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from pydantic import BaseModel
+from ..models.models import DataStructure, Shop, Category, Zone
+from .analytics import ShopAggregates
+from .references import IMAGE_FIELDS, ImageReferences, shop_image_urls
+from .schedule import WeeklySchedule
+from .search import ShopSearch
+from .working_hours import TIMEZONE
+
+
+class IdIndex:
+    """Hash index (id -> list position) kept alongside one of the DataStructure lists.
+
+    The list itself stays the source of truth for ordering (templates and
+    serialization iterate it), the index only makes lookups O(1).
+    """
+
+    def __init__(self, items: List):
+        self.items = items
+        self.positions: Dict[int, int] = {item.id: i for i, item in enumerate(items)}
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self.positions
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, item_id: int):
+        pos = self.positions.get(item_id)
+        return self.items[pos] if pos is not None else None
+
+    def add(self, item) -> None:
+        self.positions[item.id] = len(self.items)
+        self.items.append(item)
+
+    def replace(self, item_id: int, item):
+        """Replace the item stored under item_id, keeping its position. Returns the old item."""
+        pos = self.positions.pop(item_id)
+        old = self.items[pos]
+        self.items[pos] = item
+        self.positions[item.id] = pos
+        return old
+
+    def remove(self, item_id: int):
+        """Remove and return the item stored under item_id.
+
+        Removing from the middle of a list is O(n) anyway, so positions after
+        the removed item are shifted in the same pass.
+        """
+        pos = self.positions.pop(item_id)
+        item = self.items.pop(pos)
+        for i in range(pos, len(self.items)):
+            self.positions[self.items[i].id] = i
+        return item
+
+
+class InvertedIndex:
+    """Maps a key (category id, zone id, city) to the set of shop ids that have it"""
+
+    def __init__(self):
+        self.postings: Dict[Hashable, Set[int]] = {}
+        self._sorted: Dict[Hashable, List[int]] = {}
+
+    def add(self, key: Hashable, shop_id: int) -> None:
+        self.postings.setdefault(key, set()).add(shop_id)
+        self._sorted.pop(key, None)
+
+    def discard(self, key: Hashable, shop_id: int) -> None:
+        ids = self.postings.get(key)
+        if ids is None:
+            return
+        ids.discard(shop_id)
+        if not ids:
+            del self.postings[key]
+        self._sorted.pop(key, None)
+
+    def get(self, key: Hashable) -> Set[int]:
+        return self.postings.get(key, set())
+
+    def count(self, key: Hashable) -> int:
+        return len(self.postings.get(key, ()))
+
+    def sorted_ids(self, key: Hashable) -> List[int]:
+        """Shop ids for key in ascending order, cached until the key changes"""
+        ids = self._sorted.get(key)
+        if ids is None:
+            ids = self._sorted[key] = sorted(self.postings.get(key, ()))
+        return ids
+
+
+def city_key(city: str) -> str:
+    """Normalize a city name for index lookups"""
+    return city.strip().casefold()
+
+
+class DataRepository:
+    """In-memory repository over DataStructure with id-keyed indexes for shops, categories and zones.
+
+    Every mutation is also recorded as a journal record in `changes` until the
+    persistence layer drains them (see utils/persistence.py for the format).
+    `revision` increases on every in-memory change, including ones not yet
+    committed, so caches of derived data can be keyed on it.
+    """
+
+    def __init__(self, data: DataStructure):
+        self.data = data
+        self.changes: List[Dict] = []
+        self.revision = 0
+        self._build_indexes()
+
+    def _build_indexes(self) -> None:
+        self.shops = IdIndex(self.data.shops)
+        self.categories = IdIndex(self.data.categories)
+        self.zones = IdIndex(self.data.zones)
+
+        # Inverted indexes used by the public shop query and the in-use checks
+        self.shops_by_category = InvertedIndex()
+        self.shops_by_zone = InvertedIndex()
+        self.shops_by_city = InvertedIndex()
+        self._sorted_shop_ids: Optional[List[int]] = None
+        # Working hours table used by the open-shop queries, built in bulk
+        self.schedule = WeeklySchedule.from_shops(self.data.shops)
+        self.aggregates = ShopAggregates()
+        # Reference count of every image URL, so shared storage objects are only deleted when unused
+        self.image_refs = ImageReferences()
+        # Full-text index for /api/shops/search, built on the first search
+        self.search = ShopSearch(lambda: self.data.shops, self._category_name)
+        for shop in self.data.shops:
+            self._index_shop(shop, schedule=False)
+        for field in IMAGE_FIELDS:
+            self.image_refs.set_field(field, getattr(self.data, field))
+
+    def reset(self, data: DataStructure) -> None:
+        """Replace the whole state in place (full reload), keeping self.data's identity"""
+        for field in DataStructure.model_fields:
+            setattr(self.data, field, getattr(data, field))
+        self.revision += 1
+        self._build_indexes()
+
+    def apply_records(self, records: Iterable[Dict]) -> None:
+        """Apply journal records committed by another process, without recording them again"""
+        entities = {
+            "shops": (Shop, self.shops, self.add_shop, self.replace_shop, self.remove_shop),
+            "categories": (Category, self.categories, self.add_category, self.replace_category, self.remove_category),
+            "zones": (Zone, self.zones, self.add_zone, self.replace_zone, self.remove_zone),
+        }
+        mark = len(self.changes)
+        for record in records:
+            op, field = record["op"], record["e"]
+            if op == "set":
+                setattr(self.data, field, record["v"])
+                self.image_refs.set_field(field, record["v"])
+                continue
+            model, index, add, replace, remove = entities[field]
+            if op == "put":
+                item = model(**record["v"])
+                if record["id"] in index:
+                    if item.id != record["id"] and item.id in index:
+                        remove(item.id)
+                    replace(record["id"], item)
+                elif item.id in index:
+                    replace(item.id, item)
+                else:
+                    add(item)
+            elif op == "del" and record["id"] in index:
+                remove(record["id"])
+        del self.changes[mark:]
+        self.revision += 1
+
+    def _record_put(self, field: str, item_id: int, item: BaseModel) -> None:
+        self.revision += 1
+        self.changes.append({"op": "put", "e": field, "id": item_id, "v": item.model_dump(mode="json", round_trip=True)})
+
+    def _record_del(self, field: str, item_id: int) -> None:
+        self.revision += 1
+        self.changes.append({"op": "del", "e": field, "id": item_id})
+
+    def drain_changes(self) -> List[Dict]:
+        """Return and forget the changes recorded since the last call"""
+        changes, self.changes = self.changes, []
+        return changes
+
+    def set_field(self, field: str, value: Any) -> None:
+        """Replace one of the scalar DataStructure fields (banners, images, branding)"""
+        setattr(self.data, field, value)
+        self.image_refs.set_field(field, value)
+        self.revision += 1
+        self.changes.append({"op": "set", "e": field, "v": copy.deepcopy(value)})
+
+    def _index_shop(self, shop: Shop, schedule: bool = True) -> None:
+        for cat_id in shop.categories:
+            self.shops_by_category.add(cat_id, shop.id)
+        self.shops_by_zone.add(shop.zone_id, shop.id)
+        self.shops_by_city.add(city_key(shop.city), shop.id)
+        self.aggregates.add(shop)
+        self.image_refs.add(shop_image_urls(shop))
+        self.search.add(shop)
+        if schedule:
+            self.schedule.set(shop.id, shop.working_hours)
+        self._sorted_shop_ids = None
+
+    def _unindex_shop(self, shop: Shop) -> None:
+        for cat_id in shop.categories:
+            self.shops_by_category.discard(cat_id, shop.id)
+        self.shops_by_zone.discard(shop.zone_id, shop.id)
+        self.shops_by_city.discard(city_key(shop.city), shop.id)
+        self.aggregates.remove(shop)
+        self.image_refs.remove(shop_image_urls(shop))
+        self.search.remove(shop.id)
+        self.schedule.discard(shop.id)
+        self._sorted_shop_ids = None
+
+    # Referential validation
+    def missing_categories(self, category_ids: Iterable[int]) -> List[int]:
+        """Return the category ids that do not exist, in the order given"""
+        return [cat_id for cat_id in category_ids if cat_id not in self.categories]
+
+    def zone_exists(self, zone_id: int) -> bool:
+        return zone_id in self.zones
+
+    # Shops
+    def get_shop(self, shop_id: int) -> Optional[Shop]:
+        return self.shops.get(shop_id)
+
+    def add_shop(self, shop: Shop) -> None:
+        self.shops.add(shop)
+        self._index_shop(shop)
+        self._record_put("shops", shop.id, shop)
+
+    def replace_shop(self, shop_id: int, shop: Shop) -> Shop:
+        old = self.shops.replace(shop_id, shop)
+        self._unindex_shop(old)
+        self._index_shop(shop)
+        self._record_put("shops", shop_id, shop)
+        return old
+
+    def remove_shop(self, shop_id: int) -> Shop:
+        shop = self.shops.remove(shop_id)
+        self._unindex_shop(shop)
+        self._record_del("shops", shop_id)
+        return shop
+
+    def query_shops(
+        self,
+        category_id: Optional[int] = None,
+        zone_id: Optional[int] = None,
+        city: Optional[str] = None,
+        after: Optional[int] = None,
+        limit: int = 50,
+    ) -> Tuple[List[Shop], Optional[int], int]:
+        """Filter shops through the inverted indexes, ordered by id.
+
+        `after` is the cursor (the last shop id of the previous page). Returns
+        the page, the cursor for the next page (None on the last page) and the
+        total number of matching shops.
+        """
+        filters = []
+        if category_id is not None:
+            filters.append((self.shops_by_category, category_id))
+        if zone_id is not None:
+            filters.append((self.shops_by_zone, zone_id))
+        if city is not None:
+            filters.append((self.shops_by_city, city_key(city)))
+
+        if not filters:
+            if self._sorted_shop_ids is None:
+                self._sorted_shop_ids = sorted(self.shops.positions)
+            ids = self._sorted_shop_ids
+        elif len(filters) == 1:
+            index, key = filters[0]
+            ids = index.sorted_ids(key)
+        else:
+            # Intersect starting from the smallest posting set
+            postings = sorted((index.get(key) for index, key in filters), key=len)
+            matched = postings[0].intersection(*postings[1:])
+            ids = sorted(matched)
+
+        start = bisect_right(ids, after) if after is not None else 0
+        page_ids = ids[start:start + limit]
+        next_cursor = page_ids[-1] if start + limit < len(ids) else None
+        return [self.shops.get(shop_id) for shop_id in page_ids], next_cursor, len(ids)
+
+    def search_shops(self, query: str, limit: int = 20, prefix: bool = True) -> Tuple[List[Shop], List[float], int]:
+        """Full-text search (see utils/search.py): the best matches, their scores and the number of matches"""
+        ids, scores, total = self.search.search(query, limit=limit, prefix=prefix)
+        return [self.shops.get(shop_id) for shop_id in ids], scores, total
+
+    def open_shops(
+        self,
+        at: Optional[datetime] = None,
+        window_end: Optional[datetime] = None,
+        entire: bool = False,
+    ) -> List[Shop]:
+        """Shops open at `at` (default: now), or during [at, window_end) when window_end is given, ordered by id"""
+        if window_end is not None:
+            ids = self.schedule.open_during(at or datetime.now(TIMEZONE), window_end, entire=entire)
+        else:
+            ids = self.schedule.open_at(at)
+        return [self.shops.get(shop_id) for shop_id in ids.tolist()]
+
+    # Categories
+    def get_category(self, category_id: int) -> Optional[Category]:
+        return self.categories.get(category_id)
+
+    def _category_name(self, category_id: int) -> Optional[str]:
+        category = self.categories.get(category_id)
+        return category.name if category else None
+
+    def _reindex_category(self, category_id: int) -> None:
+        """Shops are searchable by their category names, index them again when a name changes"""
+        self.search.reindex(self.shops.get(shop_id) for shop_id in self.shops_by_category.sorted_ids(category_id))
+
+    def add_category(self, category: Category) -> None:
+        self.categories.add(category)
+        self._reindex_category(category.id)
+        self._record_put("categories", category.id, category)
+
+    def replace_category(self, category_id: int, category: Category) -> Category:
+        old = self.categories.replace(category_id, category)
+        if old.name != category.name or old.id != category.id:
+            self._reindex_category(category_id)
+            self._reindex_category(category.id)
+        self._record_put("categories", category_id, category)
+        return old
+
+    def remove_category(self, category_id: int) -> Category:
+        category = self.categories.remove(category_id)
+        self._reindex_category(category_id)
+        self._record_del("categories", category_id)
+        return category
+
+    def category_in_use(self, category_id: int) -> bool:
+        return self.shops_by_category.count(category_id) > 0
+
+    # Zones
+    def get_zone(self, zone_id: int) -> Optional[Zone]:
+        return self.zones.get(zone_id)
+
+    def add_zone(self, zone: Zone) -> None:
+        self.zones.add(zone)
+        self._record_put("zones", zone.id, zone)
+
+    def replace_zone(self, zone_id: int, zone: Zone) -> Zone:
+        old = self.zones.replace(zone_id, zone)
+        self._record_put("zones", zone_id, zone)
+        return old
+
+    def remove_zone(self, zone_id: int) -> Zone:
+        zone = self.zones.remove(zone_id)
+        self._record_del("zones", zone_id)
+        return zone
+
+    def zone_in_use(self, zone_id: int) -> bool:
+        return self.shops_by_zone.count(zone_id) > 0
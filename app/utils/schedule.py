@@ -0,0 +1,127 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from ..models.models import Shop, WorkingHours
+from .working_hours import MINUTES_PER_DAY, MINUTES_PER_WEEK, local_time, minute_of_week, weekly_intervals
+
+
+def _schedule_row(working_hours: Optional[WorkingHours]) -> Tuple[List[int], List[int]]:
+    """Per-weekday interval starts and ends of one shop, (0, 0) on closed days"""
+    starts = [0] * 7
+    ends = [0] * 7
+    for start, end in weekly_intervals(working_hours):
+        day = start // MINUTES_PER_DAY
+        starts[day] = start
+        ends[day] = end
+    return starts, ends
+
+
+class WeeklySchedule:
+    """Opening hours of every shop compiled into NumPy arrays for whole-catalogue queries.
+
+    Row r holds one shop: starts[r, d] / ends[r, d] is its [start, end)
+    interval on weekday d in minutes of the week (0 = Monday 00:00), or
+    (0, 0) when it is closed that day. "Open at T" and "open during [a, b]"
+    are a few vectorized comparisons over the whole table instead of a
+    Python loop over the shops.
+
+    Rows are updated in place when a shop changes; removing a shop moves
+    the last row into its slot.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        capacity = max(capacity, 1)
+        # int16 is enough: the latest end is Sunday night past midnight (< 11520)
+        self.starts = np.zeros((capacity, 7), dtype=np.int16)
+        self.ends = np.zeros((capacity, 7), dtype=np.int16)
+        self.shop_ids = np.zeros(capacity, dtype=np.int64)
+        self.rows: Dict[int, int] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _grow(self) -> None:
+        capacity = len(self.shop_ids) * 2
+        for name in ("starts", "ends", "shop_ids"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    @classmethod
+    def from_shops(cls, shops: Iterable[Shop]) -> "WeeklySchedule":
+        """Build the table for many shops at once (one array copy instead of a write per shop)"""
+        shops = list(shops)
+        schedule = cls(capacity=len(shops))
+        if shops:
+            rows = [_schedule_row(shop.working_hours) for shop in shops]
+            schedule.starts[:len(shops)] = [starts for starts, _ in rows]
+            schedule.ends[:len(shops)] = [ends for _, ends in rows]
+            schedule.shop_ids[:len(shops)] = [shop.id for shop in shops]
+            schedule.rows = {shop.id: row for row, shop in enumerate(shops)}
+            schedule.size = len(shops)
+        return schedule
+
+    def set(self, shop_id: int, working_hours: Optional[WorkingHours]) -> None:
+        """Add or update the row of a shop"""
+        row = self.rows.get(shop_id)
+        if row is None:
+            if self.size == len(self.shop_ids):
+                self._grow()
+            row = self.rows[shop_id] = self.size
+            self.shop_ids[row] = shop_id
+            self.size += 1
+        self.starts[row], self.ends[row] = _schedule_row(working_hours)
+
+    def discard(self, shop_id: int) -> None:
+        row = self.rows.pop(shop_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved_id = int(self.shop_ids[last])
+            self.starts[row] = self.starts[last]
+            self.ends[row] = self.ends[last]
+            self.shop_ids[row] = moved_id
+            self.rows[moved_id] = row
+        self.size = last
+
+    def _matching_ids(self, mask: np.ndarray) -> np.ndarray:
+        return np.sort(self.shop_ids[:self.size][mask])
+
+    def open_at(self, moment: Optional[datetime] = None) -> np.ndarray:
+        """Ids (ascending) of the shops open at moment (default: now)"""
+        minute = minute_of_week(moment)
+        starts = self.starts[:self.size]
+        ends = self.ends[:self.size]
+        hits = ((starts <= minute) & (minute < ends)).any(axis=1)
+        # Sunday intervals can run past the end of the week into Monday morning
+        hits |= minute + MINUTES_PER_WEEK < ends[:, 6]
+        return self._matching_ids(hits)
+
+    def open_during(self, start: datetime, end: datetime, entire: bool = False) -> np.ndarray:
+        """Ids (ascending) of the shops open at some point in [start, end).
+
+        With entire=True the shop has to stay open for the whole window
+        within a single day's interval.
+        """
+        begin = minute_of_week(start)
+        length = int((local_time(end) - local_time(start)).total_seconds() // 60)
+        starts = self.starts[:self.size].astype(np.int32)
+        ends = self.ends[:self.size].astype(np.int32)
+        if length <= 0:
+            return self._matching_ids(np.zeros(self.size, dtype=bool))
+        if length >= MINUTES_PER_WEEK and not entire:
+            return self._matching_ids((ends > starts).any(axis=1))
+
+        hits = np.zeros(self.size, dtype=bool)
+        # Compare against the intervals of the previous, current and next week
+        for shift in (-MINUTES_PER_WEEK, 0, MINUTES_PER_WEEK):
+            low, high = begin - shift, begin + length - shift
+            if entire:
+                matched = (starts <= low) & (ends >= high)
+            else:
+                matched = (starts < high) & (ends > low)
+            hits |= (matched & (ends > starts)).any(axis=1)
+        return self._matching_ids(hits)
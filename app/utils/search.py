@@ -0,0 +1,237 @@
+import math
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from ..models.models import Shop
+
+# BM25 parameters (the usual defaults)
+K1 = 1.2
+B = 0.75
+# A term counts this many times per occurrence in the field: a match in the name
+# or a category name says more about a shop than one in its description
+FIELD_WEIGHTS = (("name", 3.0), ("categories", 2.0), ("owner", 1.0), ("city", 1.0), ("description", 1.0))
+# Most index terms a typeahead prefix expands to (the shortest completions, alphabetically)
+MAX_PREFIX_TERMS = 50
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Spanish words too common to help, written without accents
+STOPWORDS = frozenset(
+    "a al con de del e el en la las lo los o para por que se su sus u un una unas unos y".split()
+)
+
+
+def fold(text: str) -> str:
+    """Lowercase and drop accents and other marks: "Electrónica Ñandutí" -> "electronica nanduti" """
+    return unicodedata.normalize("NFKD", text.casefold()).encode("ascii", "ignore").decode("ascii")
+
+
+def stem(token: str) -> str:
+    """Light Spanish stemmer: strips the plural and the final gender vowel.
+
+    joyas/joya/joyero -> joy, electrónicos/electrónica -> electronic,
+    colores -> color, luces -> luz. Numbers and short words stay as they are.
+    """
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith("ces") and len(token) > 4:
+        token = token[:-3] + "z"
+    elif token.endswith("es") and len(token) > 4 and token[-3] not in "aeiou":
+        token = token[:-2]
+    elif token.endswith("s"):
+        token = token[:-1]
+    if len(token) > 3 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+def terms(text: Optional[str]) -> Tuple[str, ...]:
+    """Index terms of a text, in order"""
+    if not text:
+        return ()
+    return tuple(stem(token) for token in _TOKEN.findall(fold(text)) if token not in STOPWORDS)
+
+
+# Cities and category names repeat across shops, analyze each once
+_cached_terms = lru_cache(maxsize=1024)(terms)
+CACHED_FIELDS = ("categories", "city")
+
+
+def query_terms(query: str, prefix: bool) -> List[Tuple[str, bool]]:
+    """(term, is prefix) for each word of a query. With prefix, the last word may be unfinished"""
+    tokens = _TOKEN.findall(fold(query))
+    # "joyas " (trailing space) means the last word is complete
+    last_is_prefix = prefix and bool(tokens) and not query[-1:].isspace()
+    result = []
+    for i, token in enumerate(tokens):
+        if last_is_prefix and i == len(tokens) - 1:
+            result.append((stem(token), True))
+        elif token not in STOPWORDS:
+            result.append((stem(token), False))
+    return result
+
+
+class ShopSearch:
+    """In-memory full-text index over shop names, owners, cities, descriptions and category names.
+
+    Each shop is a document in a slot of the length array; `postings` maps a
+    term to {slot: weighted term frequency}. Queries are ANDed: every word
+    has to match, the last one also as a prefix of longer terms (typeahead).
+    Matches are ranked with BM25 computed over NumPy arrays, so a term in
+    every shop costs a few vector operations rather than a Python loop.
+
+    The repository calls add() and remove() as shops change, and reindexes
+    the shops of a category when it is renamed. The index is only built on
+    the first search; until then those calls do nothing.
+    """
+
+    def __init__(self, shops: Callable[[], Iterable[Shop]], category_name: Callable[[int], Optional[str]]):
+        self._all_shops = shops
+        self._category_name = category_name
+        self.built = False
+        self.postings: Dict[str, Dict[int, float]] = {}
+        # Sorted vocabulary, for prefix lookups
+        self._vocabulary: List[str] = []
+        # Term -> (slots, frequencies) as arrays, dropped when the term's postings change
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._slots: Dict[int, int] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._free: List[int] = []
+        self._size = 0
+        self._shop_ids = np.zeros(1024, dtype=np.int64)
+        self._lengths = np.zeros(1024, dtype=np.float64)
+        self._total_length = 0.0
+
+    def _document(self, shop: Shop) -> Dict[str, float]:
+        frequencies: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS:
+            if field == "categories":
+                texts = [self._category_name(cat_id) for cat_id in shop.categories]
+            else:
+                texts = [getattr(shop, field)]
+            analyze = _cached_terms if field in CACHED_FIELDS else terms
+            for text in texts:
+                for term in analyze(text):
+                    frequencies[term] = frequencies.get(term, 0.0) + weight
+        return frequencies
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._size == len(self._lengths):
+            self._shop_ids = np.resize(self._shop_ids, self._size * 2)
+            self._lengths = np.resize(self._lengths, self._size * 2)
+        self._size += 1
+        return self._size - 1
+
+    def _add(self, shop: Shop, sort_vocabulary: bool) -> None:
+        slot = self._slots[shop.id] = self._allocate()
+        document = self._doc_terms[slot] = self._document(shop)
+        for term, frequency in document.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                if sort_vocabulary:
+                    insort(self._vocabulary, term)
+            postings[slot] = frequency
+            self._arrays.pop(term, None)
+        length = sum(document.values())
+        self._shop_ids[slot] = shop.id
+        self._lengths[slot] = length
+        self._total_length += length
+
+    def build(self) -> None:
+        for shop in self._all_shops():
+            self._add(shop, sort_vocabulary=False)
+        self._vocabulary = sorted(self.postings)
+        self.built = True
+
+    def add(self, shop: Shop) -> None:
+        if self.built:
+            self._add(shop, sort_vocabulary=True)
+
+    def remove(self, shop_id: int) -> None:
+        if not self.built:
+            return
+        slot = self._slots.pop(shop_id)
+        for term in self._doc_terms.pop(slot):
+            postings = self.postings[term]
+            del postings[slot]
+            if not postings:
+                del self.postings[term]
+                del self._vocabulary[bisect_left(self._vocabulary, term)]
+            self._arrays.pop(term, None)
+        self._total_length -= self._lengths[slot]
+        self._lengths[slot] = 0.0
+        self._shop_ids[slot] = -1
+        self._free.append(slot)
+
+    def reindex(self, shops: Iterable[Shop]) -> None:
+        """Index shops again, e.g. after one of their categories was renamed"""
+        if self.built:
+            for shop in shops:
+                self.remove(shop.id)
+                self.add(shop)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self.postings[term]
+            arrays = self._arrays[term] = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float64, count=len(postings)),
+            )
+        return arrays
+
+    def _expand(self, term: str, is_prefix: bool) -> List[str]:
+        """Index terms a query term matches: itself, plus its completions for a prefix"""
+        if not is_prefix:
+            return [term] if term in self.postings else []
+        start = bisect_left(self._vocabulary, term)
+        matches = []
+        for candidate in self._vocabulary[start:start + MAX_PREFIX_TERMS]:
+            if not candidate.startswith(term):
+                break
+            matches.append(candidate)
+        return matches
+
+    def search(self, query: str, limit: int = 20, prefix: bool = True) -> Tuple[List[int], List[float], int]:
+        """Shop ids of the best `limit` matches with their scores, and the number of matching shops"""
+        if not self.built:
+            self.build()
+        groups = [self._expand(term, is_prefix) for term, is_prefix in query_terms(query, prefix)]
+        if not groups or not all(groups) or not self._slots:
+            return [], [], 0
+
+        count = len(self._slots)
+        lengths = self._lengths[:self._size]
+        # BM25 length normalization of every document, shared by all the terms
+        norms = K1 * (1 - B + B * lengths / (self._total_length / count))
+        total = np.zeros(self._size)
+        matched = np.ones(self._size, dtype=bool)
+        for group in groups:
+            scores = np.zeros(self._size)
+            for term in group:
+                slots, frequencies = self._term_arrays(term)
+                idf = math.log(1 + (count - len(slots) + 0.5) / (len(slots) + 0.5))
+                scores[slots] += idf * frequencies * (K1 + 1) / (frequencies + norms[slots])
+            matched &= scores > 0
+            total += scores
+
+        hits = np.flatnonzero(matched)
+        # Rounded, so float noise from incremental updates does not reorder equal scores
+        scores = total[hits].round(6)
+        if len(hits) > limit:
+            # Keep everything tied with the limit-th best, the id order below picks among them
+            cutoff = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            keep = scores >= cutoff
+            hits, scores = hits[keep], scores[keep]
+        # Best score first, ties by shop id
+        hit_ids = self._shop_ids[hits]
+        order = np.lexsort((hit_ids, -scores))[:limit]
+        return hit_ids[order].tolist(), scores[order].round(4).tolist(), int(np.count_nonzero(matched))
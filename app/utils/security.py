@@ -2,29 +2,40 @@ from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import logging
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import bcrypt
-from typing import Callable
+from typing import Callable, Optional, Tuple
+from .metrics import Histogram
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Constants
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 12  # 12 hour
+# Verified tokens kept so protected requests skip decoding and verifying the JWT
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = 300  # seconds, and never past the token's own expiry
+
+PASSWORD_CHECK_SECONDS = Histogram("password_check_duration_seconds", "Time bcrypt takes to check a login password")
 
 # Get credentials from environment variables
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 SECRET_KEY = os.getenv("SECRET_KEY")
 
-# Debug print environment variables
-print("DEBUG Environment Variables:")
-print(f"ADMIN_USERNAME set: {bool(ADMIN_USERNAME)}")
-print(f"ADMIN_PASSWORD set: {bool(ADMIN_PASSWORD)}")
-print(f"SECRET_KEY set: {bool(SECRET_KEY)}")
-print(f"SECRET_KEY length: {len(SECRET_KEY) if SECRET_KEY else 0}")
+for name, value in (("ADMIN_USERNAME", ADMIN_USERNAME), ("ADMIN_PASSWORD", ADMIN_PASSWORD), ("SECRET_KEY", SECRET_KEY)):
+    if not value:
+        logger.warning("%s is not set", name)
 
 # Security scheme
 bearer_scheme = HTTPBearer(auto_error=False)  # Don't auto-raise errors
@@ -46,6 +57,47 @@ def authenticate_user(username: str, password: str) -> bool:
         return False
     return verify_password(password, ADMIN_PASSWORD)
 
+class LoginBusy(Exception):
+    """Too many password checks are already queued"""
+
+class PasswordVerifier:
+    """Checks login passwords on a small dedicated thread pool.
+
+    bcrypt takes 100-300 ms of CPU per check (and releases the GIL while
+    hashing), so it must not run on the event loop. At most `workers` checks
+    run at once and `max_pending` more may wait; further attempts raise
+    LoginBusy instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 16):
+        self.workers = max(workers, 1)
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+
+    async def authenticate(self, username: str, password: str) -> bool:
+        if username != ADMIN_USERNAME:
+            return False
+        if self._in_flight >= self.workers + self.max_pending:
+            raise LoginBusy()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._check, password)
+        finally:
+            self._in_flight -= 1
+
+    @staticmethod
+    def _check(password: str) -> bool:
+        with PASSWORD_CHECK_SECONDS.time():
+            return verify_password(password, ADMIN_PASSWORD)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     """Create a new JWT token."""
     to_encode = data.copy()
@@ -57,6 +109,70 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class TokenCache:
+    """LRU cache of verified tokens: sha256(token) -> (username, expiry).
+
+    Entries expire after `ttl` seconds or at the token's `exp`, whichever
+    comes first, so a cached token is never accepted after it expired.
+    Only successful verifications are cached. Used from the event loop only.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        # Hashed, so the cache does not keep usable tokens in memory
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        username, expires = entry
+        if expires <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return username
+
+    def put(self, token: str, username: str, exp: Optional[float] = None) -> None:
+        now = time.time()
+        expires = now + self.ttl if exp is None else min(exp, now + self.ttl)
+        if expires <= now:
+            return
+        key = self._key(token)
+        self._entries[key] = (username, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+token_cache = TokenCache()
+
+def verify_token(token: str) -> Optional[str]:
+    """Return the admin username if token is a valid, unexpired access token, else None"""
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        logger.debug("Token rejected: %s", e)
+        return None
+    username = payload.get("sub")
+    if username is None or username != ADMIN_USERNAME:
+        logger.debug("Token for an unknown user")
+        return None
+    exp = payload.get("exp")
+    token_cache.put(token, username, exp if isinstance(exp, (int, float)) else None)
+    return username
+
 async def get_current_user(request: Request) -> str:
     """Get the current user from the JWT token in cookie."""
     credentials_exception = HTTPException(
@@ -68,34 +184,17 @@ async def get_current_user(request: Request) -> str:
     # Get token from cookie
     auth_cookie = request.cookies.get("Authorization")
     if not auth_cookie:
-        print("DEBUG: No Authorization cookie found")
+        logger.debug("No Authorization cookie")
         raise credentials_exception
     
     if not auth_cookie.startswith("Bearer "):
-        print("DEBUG: Invalid cookie format")
+        logger.debug("Invalid Authorization cookie format")
         raise credentials_exception
     
-    token = auth_cookie.replace("Bearer ", "")
-    
-    try:
-        print(f"DEBUG: Attempting to decode token: {token[:20]}...")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"DEBUG: Successfully decoded token payload: {payload}")
-        username: str = payload.get("sub")
-        if username is None:
-            print("DEBUG: No username in payload")
-            raise credentials_exception
-        if username != ADMIN_USERNAME:
-            print(f"DEBUG: Username mismatch: {username} != {ADMIN_USERNAME}")
-            raise credentials_exception
-        print(f"DEBUG: Authentication successful for {username}")
-        return username
-    except JWTError as e:
-        print(f"DEBUG: JWT Error: {str(e)}")
-        raise credentials_exception
-    except Exception as e:
-        print(f"DEBUG: Unexpected error in get_current_user: {str(e)}")
+    username = verify_token(auth_cookie[len("Bearer "):])
+    if username is None:
         raise credentials_exception
+    return username
 
 def get_auth_dependency() -> Callable:
     """Returns the authentication dependency."""
@@ -0,0 +1,180 @@
+import asyncio
+import copy
+import gzip
+import hashlib
+from typing import Dict, List, Optional, Tuple
+from pydantic import TypeAdapter
+from ..models.models import DataStructure, Shop
+from .repository import DataRepository
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+GZIP_LEVEL = 6
+# Quality 11 takes seconds on a large catalogue, 6 is close in size and much faster
+BROTLI_QUALITY = 6
+
+# Accept-Encoding token -> suffix added to the ETag of that representation
+ENCODINGS = {"br": "br", "gzip": "gz"}
+
+# Bookkeeping fields of DataStructure that are not part of the public payload
+PRIVATE_FIELDS = {"version", "banner_renditions"}
+
+# Shops are serialized this many at a time: each chunk is one call holding
+# the GIL, so the event loop gets to run between chunks
+SHOP_CHUNK = 1000
+_SHOP_LIST = TypeAdapter(List[Shop])
+# shops is the first DataStructure field
+_EMPTY_SHOPS = b'{"shops":[]'
+
+
+def parse_accept_encoding(header: Optional[str]) -> List[str]:
+    """Content codings the client accepts (q > 0), most preferred first"""
+    accepted: List[Tuple[float, str]] = []
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.append((q, coding))
+    return [coding for _, coding in sorted(accepted, key=lambda item: -item[0])]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check using weak comparison, as RFC 9110 requires for it"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.strip('"')
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == opaque:
+            return True
+    return False
+
+
+class Snapshot:
+    """One serialized version of the data: minified JSON plus compressed variants"""
+
+    def __init__(self, key: int, body: bytes):
+        self.key = key
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.encoded: Dict[str, bytes] = {}
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        # Strong validators must differ between content codings of the same data
+        if encoding is None:
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{ENCODINGS[encoding]}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """True if the client already has any representation of this snapshot"""
+        return any(
+            etag_matches(if_none_match, self.etag(encoding))
+            for encoding in (None, *ENCODINGS)
+        )
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output (and so the ETag) identical across workers
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _serialize(data: DataStructure, shops: List[Shop]) -> bytes:
+    """data as served by /api/data, with shops in place of its (empty) shop list.
+
+    Same shape as data.json ('HH:MM' times), minus the bookkeeping fields.
+    """
+    rest = data.model_dump_json(round_trip=True, exclude=PRIVATE_FIELDS).encode()
+    if not rest.startswith(_EMPTY_SHOPS):
+        raise ValueError("Expected shops to be the first field of DataStructure")
+    chunks = [
+        _SHOP_LIST.dump_json(shops[start:start + SHOP_CHUNK], round_trip=True)[1:-1]
+        for start in range(0, len(shops), SHOP_CHUNK)
+    ]
+    return b'{"shops":[' + b",".join(chunks) + b"]" + rest[len(_EMPTY_SHOPS):]
+
+
+class SnapshotCache:
+    """Serialized /api/data payload, rebuilt only after the data changes.
+
+    The cache key is the repository revision, which increases on every
+    in-memory change (including changes applied from other workers). A
+    rebuild copies the shop list and the small fields on the event loop,
+    then serializes and hashes them in a thread, in chunks, so even a large
+    catalogue only blocks the loop for a few milliseconds at a time.
+    Concurrent requests share one rebuild, and a request is answered with
+    a snapshot at least as new as the data it arrived at. Compression also
+    runs in a thread, once per snapshot and encoding.
+    """
+
+    def __init__(self, repository: DataRepository):
+        self.repository = repository
+        self._snapshot: Optional[Snapshot] = None
+        self._build_lock = asyncio.Lock()
+        self._lock = asyncio.Lock()
+
+    def _current(self, revision: int) -> Optional[Snapshot]:
+        if self._snapshot is not None and self._snapshot.key >= revision:
+            return self._snapshot
+        return None
+
+    async def snapshot(self) -> Snapshot:
+        revision = self.repository.revision
+        snapshot = self._current(revision)
+        if snapshot is not None:
+            return snapshot
+        async with self._build_lock:
+            # Built by the request we waited for?
+            snapshot = self._current(revision)
+            if snapshot is not None:
+                return snapshot
+            # Consistent copy of the state as of now: shop models are replaced, never
+            # mutated, once they are in the repository, so a shallow copy of their list
+            # is enough; the other fields are small
+            revision = self.repository.revision
+            data = self.repository.data
+            shops = list(data.shops)
+            rest = DataStructure.model_construct(shops=[], **{
+                field: copy.deepcopy(getattr(data, field))
+                for field in DataStructure.model_fields if field != "shops" and field not in PRIVATE_FIELDS
+            })
+            self._snapshot = await asyncio.to_thread(lambda: Snapshot(revision, _serialize(rest, shops)))
+            return self._snapshot
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """Pick the content coding to send: brotli, then gzip, else None (identity)"""
+        for coding in parse_accept_encoding(accept_encoding):
+            if coding == "br" and brotli is not None:
+                return "br"
+            if coding in ("gzip", "*"):
+                return "gzip"
+        return None
+
+    async def encoded(self, snapshot: Snapshot, encoding: Optional[str]) -> bytes:
+        if encoding is None:
+            return snapshot.body
+        body = snapshot.encoded.get(encoding)
+        if body is None:
+            async with self._lock:
+                body = snapshot.encoded.get(encoding)
+                if body is None:
+                    body = await asyncio.to_thread(_compress, snapshot.body, encoding)
+                    snapshot.encoded[encoding] = body
+        return body
@@ -0,0 +1,306 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+from ..models.models import DataStructure
+from .persistence import COMMIT_BYTES, DataStore, JournalStore, paused_gc
+
+# Columns stored as-is for each entity table; any other model field goes to
+# the `extra` JSON column so new model fields don't need a schema change.
+ENTITY_COLUMNS = {
+    "shops": ("id", "name", "owner", "contact_number", "city", "zone_id", "img", "description"),
+    "categories": ("id", "name", "icon"),
+    "zones": ("id", "name"),
+}
+# Scalar DataStructure fields kept in the banners table, one row per URL
+BANNER_LISTS = ("primary_banner", "secondary_banner")
+BANNER_SINGLE = ("recommended_image", "other_businesses")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shops (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    contact_number TEXT NOT NULL,
+    city TEXT NOT NULL,
+    zone_id INTEGER NOT NULL,
+    img TEXT NOT NULL,
+    description TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS shops_zone ON shops (zone_id);
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    icon TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS zones (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS shop_categories (
+    shop_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    PRIMARY KEY (shop_id, position)
+);
+CREATE INDEX IF NOT EXISTS shop_categories_category ON shop_categories (category_id);
+CREATE TABLE IF NOT EXISTS banners (
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (kind, position)
+);
+CREATE TABLE IF NOT EXISTS branding (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS banner_renditions (
+    url TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (version, seq)
+);
+"""
+
+
+class SQLiteStore(DataStore):
+    """SQLite backend with one table per entity, in WAL mode.
+
+    Journal records become row-level upserts and deletes in a single
+    transaction, and WAL lets other processes read while one writes. If the
+    database is empty and `migrate_from` points at a data.json file, that
+    file (plus its journal) is imported once.
+
+    The data version lives in the `meta` table. The records of the last
+    `keep_versions` commits are kept in `changes` so other workers can catch
+    up without reloading everything.
+    """
+
+    def __init__(self, path: str, migrate_from: Optional[str] = None, keep_versions: int = 1000):
+        self.path = path
+        self.migrate_from = migrate_from
+        self.keep_versions = keep_versions
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _version(self) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def _set_version(self, version: int) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+
+    def current_version(self) -> int:
+        with self._lock:
+            return self._version()
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path in (self.path, f"{self.path}-wal") if os.path.exists(path))
+
+    def changes_since(self, version: int) -> Optional[List[Dict]]:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                current = self._version()
+                rows = self._conn.execute(
+                    "SELECT version, record FROM changes WHERE version > ? ORDER BY version, seq", (version,)
+                ).fetchall()
+            finally:
+                self._conn.execute("COMMIT")
+        if {row[0] for row in rows} != set(range(version + 1, current + 1)):
+            return None  # Older than what `changes` keeps
+        return [dict(json.loads(record), ver=row_version) for row_version, record in rows]
+
+    def is_empty(self) -> bool:
+        return self._conn.execute("SELECT NOT EXISTS (SELECT 1 FROM categories UNION ALL SELECT 1 FROM shops)").fetchone()[0]
+
+    # Loading
+    def _load_entities(self, table: str) -> List[Dict]:
+        columns = ENTITY_COLUMNS[table]
+        rows = self._conn.execute(f"SELECT {', '.join(columns)}, extra FROM {table} ORDER BY position")
+        items = []
+        for row in rows:
+            item = dict(zip(columns, row))
+            item.update(json.loads(row[-1]))
+            items.append(item)
+        return items
+
+    def load(self) -> DataStructure:
+        if self.is_empty() and self.migrate_from and os.path.exists(self.migrate_from):
+            self.import_data(JournalStore(self.migrate_from).load())
+
+        with self._lock, paused_gc():
+            self._conn.execute("BEGIN")
+            try:
+                return self._load()
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _load(self) -> DataStructure:
+        shop_categories: Dict[int, List[int]] = {}
+        for shop_id, category_id in self._conn.execute(
+            "SELECT shop_id, category_id FROM shop_categories ORDER BY shop_id, position"
+        ):
+            shop_categories.setdefault(shop_id, []).append(category_id)
+        shops = self._load_entities("shops")
+        for shop in shops:
+            shop["categories"] = shop_categories.get(shop["id"], [])
+
+        banners: Dict[str, List[str]] = {kind: [] for kind in BANNER_LISTS + BANNER_SINGLE}
+        for kind, url in self._conn.execute("SELECT kind, url FROM banners ORDER BY kind, position"):
+            banners[kind].append(url)
+        branding_row = self._conn.execute("SELECT data FROM branding WHERE id = 1").fetchone()
+        banner_renditions = {
+            url: json.loads(data) for url, data in self._conn.execute("SELECT url, data FROM banner_renditions")
+        }
+
+        return DataStructure(
+            shops=shops,
+            categories=self._load_entities("categories"),
+            zones=self._load_entities("zones"),
+            primary_banner=banners["primary_banner"],
+            secondary_banner=banners["secondary_banner"],
+            recommended_image=(banners["recommended_image"] or [""])[0],
+            other_businesses=(banners["other_businesses"] or [""])[0],
+            branding=json.loads(branding_row[0]) if branding_row else None,
+            banner_renditions=banner_renditions,
+            version=self._version(),
+        )
+
+    # Writing
+    def import_data(self, data: DataStructure) -> None:
+        """Replace the database contents with data (one-shot migration)"""
+        dumped = data.model_dump(mode="json", round_trip=True)
+        records = [{"op": "set", "e": field, "v": dumped[field]} for field in BANNER_LISTS + BANNER_SINGLE + ("branding", "banner_renditions")]
+        for field in ENTITY_COLUMNS:
+            records.extend({"op": "put", "e": field, "id": item["id"], "v": item} for item in dumped[field])
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("shops", "categories", "zones", "shop_categories", "banners", "branding", "banner_renditions", "changes"):
+                    self._conn.execute(f"DELETE FROM {table}")
+                for record in records:
+                    self._apply(record)
+                # New version without change records: running workers reload everything
+                self._set_version(self._version() + 1)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def commit(self, records: List[Dict]) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._version() + 1
+                for record in records:
+                    self._apply(record)
+                rows = [(version, seq, json.dumps(record, ensure_ascii=False)) for seq, record in enumerate(records)]
+                self._conn.executemany("INSERT INTO changes (version, seq, record) VALUES (?, ?, ?)", rows)
+                self._conn.execute("DELETE FROM changes WHERE version <= ?", (version - self.keep_versions,))
+                self._set_version(version)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        COMMIT_BYTES.inc(amount=sum(len(row[2].encode("utf-8")) for row in rows))
+        return version
+
+    def compact(self) -> None:
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _apply(self, record: Dict) -> None:
+        op, field = record["op"], record["e"]
+        if op == "set":
+            self._set_scalar(field, record["v"])
+        elif op == "put":
+            self._put_entity(field, record["id"], record["v"])
+        elif op == "del":
+            self._delete_entity(field, record["id"])
+
+    def _set_scalar(self, field: str, value: Any) -> None:
+        if field == "branding":
+            if value is None:
+                self._conn.execute("DELETE FROM branding")
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO branding (id, data) VALUES (1, ?)",
+                    (json.dumps(value, ensure_ascii=False),)
+                )
+            return
+        if field == "banner_renditions":
+            self._conn.execute("DELETE FROM banner_renditions")
+            self._conn.executemany(
+                "INSERT INTO banner_renditions (url, data) VALUES (?, ?)",
+                [(url, json.dumps(renditions, ensure_ascii=False)) for url, renditions in value.items()]
+            )
+            return
+        urls = value if field in BANNER_LISTS else [value]
+        self._conn.execute("DELETE FROM banners WHERE kind = ?", (field,))
+        self._conn.executemany(
+            "INSERT INTO banners (kind, position, url) VALUES (?, ?, ?)",
+            [(field, position, url) for position, url in enumerate(urls)]
+        )
+
+    def _put_entity(self, table: str, item_id: int, value: Dict) -> None:
+        columns = ENTITY_COLUMNS[table]
+        row = self._conn.execute(
+            f"SELECT position FROM {table} WHERE id IN (?, ?) ORDER BY id = ? DESC LIMIT 1",
+            (item_id, value["id"], item_id)
+        ).fetchone()
+        if row is not None:
+            position = row[0]
+            if item_id != value["id"]:
+                self._delete_entity(table, item_id)
+        else:
+            position = self._conn.execute(f"SELECT COALESCE(MAX(position), -1) + 1 FROM {table}").fetchone()[0]
+
+        extra = {key: val for key, val in value.items() if key not in columns and key != "categories"}
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, position, extra) "
+            f"VALUES ({', '.join('?' for _ in columns)}, ?, ?)",
+            [value.get(column) for column in columns] + [position, json.dumps(extra, ensure_ascii=False)]
+        )
+        if table == "shops":
+            self._conn.execute("DELETE FROM shop_categories WHERE shop_id = ?", (value["id"],))
+            self._conn.executemany(
+                "INSERT INTO shop_categories (shop_id, position, category_id) VALUES (?, ?, ?)",
+                [(value["id"], position, category_id) for position, category_id in enumerate(value["categories"])]
+            )
+
+    def _delete_entity(self, table: str, item_id: int) -> None:
+        self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (item_id,))
+        if table == "shops":
+            self._conn.execute("DELETE FROM shop_categories WHERE shop_id = ?", (item_id,))
+
+
+if __name__ == "__main__":
+    # One-shot migration: python -m app.utils.sqlite_store data.json data.db
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m app.utils.sqlite_store <data.json> <database>")
+    store = SQLiteStore(sys.argv[2])
+    store.import_data(JournalStore(sys.argv[1]).load())
+    print(f"Imported {sys.argv[1]} into {sys.argv[2]}")
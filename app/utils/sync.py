@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .persistence import DataStore
+from .repository import DataRepository
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeBus(ABC):
+    """Carries "data version N was committed" notifications between workers.
+
+    Notifications are only wake-up hints: subscribers always ask the data
+    store for the real latest version, so a lost or reordered message just
+    delays a reload until the next one.
+    """
+
+    @abstractmethod
+    def publish(self, version: int) -> None:
+        """Announce a commit made by this worker"""
+
+    @abstractmethod
+    def poll(self) -> bool:
+        """Return True if something may have been committed since the last poll"""
+
+
+class FileChangeBus(ChangeBus):
+    """Change bus backed by a small file on a filesystem all workers share.
+
+    Publishing atomically replaces the file with the committed version;
+    polling reads those few bytes back and compares them with the last
+    ones seen, so it can run every few hundred milliseconds. Comparing
+    mtime and size instead would miss two publishes of equally long
+    versions within one timestamp tick on filesystems with coarse mtimes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._last_seen: Optional[str] = None
+
+    def _read(self) -> Optional[str]:
+        try:
+            with open(self.path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def publish(self, version: int) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(version))
+        os.replace(tmp_path, self.path)
+
+    def poll(self) -> bool:
+        current = self._read()
+        changed = current != self._last_seen
+        self._last_seen = current
+        return changed
+
+
+def _record_keys(records: Iterable[Dict]) -> List[Tuple[str, Any]]:
+    """Entity keys touched by journal records: (field, id), or (field, None) for scalar fields"""
+    keys = []
+    for record in records:
+        if record["op"] == "set":
+            keys.append((record["e"], None))
+        else:
+            keys.append((record["e"], record["id"]))
+            if record["op"] == "put" and record["v"]["id"] != record["id"]:
+                keys.append((record["e"], record["v"]["id"]))
+    return keys
+
+
+class DataSynchronizer:
+    """Keeps this worker's repository in step with commits made by other workers.
+
+    When the bus signals a change, only the records committed since our
+    version are fetched and applied. A full reload happens if the store no
+    longer has them. Conflicts resolve to the higher version, which is also
+    the order the records have on disk. Records for entities this worker has
+    written with a newer version, or is still writing, are skipped.
+    """
+
+    def __init__(self, store: DataStore, repository: DataRepository, bus: ChangeBus, interval: float = 1.0):
+        self.store = store
+        self.repository = repository
+        self.bus = bus
+        self.interval = interval
+        # Last version whose commits are all reflected in memory
+        self.version = repository.data.version
+        self._pending: Counter = Counter()
+        self._written: Dict[Tuple[str, Any], int] = {}
+        self._own_versions: Set[int] = set()
+        self._retry = False
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, records: List[Dict]) -> None:
+        """Note local changes that were submitted but are not committed yet"""
+        self._pending.update(_record_keys(records))
+
+    def committed(self, records: List[Dict], version: int) -> None:
+        """PersistenceWorker callback for commits made by this worker"""
+        for key in _record_keys(records):
+            self._pending[key] -= 1
+            if self._pending[key] <= 0:
+                del self._pending[key]
+            self._written[key] = version
+        self._own_versions.add(version)
+        if version == self.version + 1:
+            # Nobody else committed in between
+            self._advance(version)
+        try:
+            self.bus.publish(version)
+        except OSError:
+            logger.exception("Publishing data version %d failed", version)
+
+    def _advance(self, version: int) -> None:
+        self.version = version
+        self.repository.data.version = version
+        self._written = {key: ver for key, ver in self._written.items() if ver > version}
+        self._own_versions = {ver for ver in self._own_versions if ver > version}
+
+    def _is_shadowed(self, record: Dict) -> bool:
+        for key in _record_keys([record]):
+            if self._pending.get(key) or self._written.get(key, 0) > record["ver"]:
+                return True
+        return False
+
+    async def sync_once(self) -> None:
+        if not self.bus.poll() and not self._retry:
+            return
+        self._retry = False
+        target = await asyncio.to_thread(self.store.current_version)
+        if target <= self.version:
+            return
+
+        records = await asyncio.to_thread(self.store.changes_since, self.version)
+        if records is None:
+            if self._pending:
+                # A full reload would drop writes that are still in flight, try again next time
+                self._retry = True
+                return
+            data = await asyncio.to_thread(self.store.load)
+            logger.info("Reloading all data at version %d (was %d)", data.version, self.version)
+            self.repository.reset(data)
+            self._advance(data.version)
+            return
+
+        foreign = [
+            record for record in records
+            if record["ver"] not in self._own_versions and not self._is_shadowed(record)
+        ]
+        self.repository.apply_records(foreign)
+        self._advance(max([self.version] + [record["ver"] for record in records]))
+        logger.info("Applied %d records from other workers, now at version %d", len(foreign), self.version)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync_once()
+            except Exception:
+                logger.exception("Data synchronization failed")
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+from .metrics import Counter, Histogram, route_template
+
+logger = logging.getLogger(__name__)
+
+# Innermost frames kept from the stack of a blocked loop
+STACK_LIMIT = 40
+
+LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "How late the loop watchdog heartbeat woke up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+LOOP_STALLS = Counter(
+    "event_loop_stalls_total", "Times the event loop was blocked longer than LOOP_WATCHDOG_MS, by route", ("route",)
+)
+
+
+class LoopWatchdog:
+    """Detects callbacks that block the event loop and records what they were doing.
+
+    A heartbeat task on the loop wakes up every `interval` seconds and
+    records how late it was. A watcher thread checks the heartbeat; once it
+    is `threshold` seconds overdue the loop is stuck in some callback, so the
+    watcher takes the loop thread's stack right then (the blocking call is
+    still on it) together with the request the running task serves, if any.
+    When the loop comes back the heartbeat logs the stall with its full
+    duration and keeps it among the last `max_reports`.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.01, max_reports: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.reports: Deque[Dict] = deque(maxlen=max_reports)
+        self.stalls = 0
+        self.max_lag = 0.0
+        # Task -> (ASGI scope, root_path) of the request it handles, see LoopWatchdogMiddleware
+        self.requests: Dict[asyncio.Task, tuple] = {}
+        self._beat = time.monotonic()
+        self._stall: Optional[Dict] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _capture(self, blocked: float) -> Dict:
+        """Describe what the loop thread is doing; runs on the watcher thread"""
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame, limit=STACK_LIMIT) if frame is not None else []
+        task = asyncio.current_task(self._loop)
+        request = self.requests.get(task) if task is not None else None
+        route = method = None
+        if request is not None:
+            scope, root_path = request
+            route = route_template(scope, root_path)
+            method = scope.get("method")
+        return {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "blocked_ms": round(blocked * 1000, 1),
+            "method": method,
+            "route": route,
+            "task": task.get_name() if task is not None else None,
+            "stack": [line.rstrip("\n") for line in stack],
+        }
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(self.threshold / 2):
+            # How long the heartbeat is overdue
+            blocked = time.monotonic() - self._beat - self.interval
+            if blocked >= self.threshold and self._stall is None:
+                self._stall = self._capture(blocked)
+
+    def _finish(self, stall: Dict, lag: float) -> None:
+        stall["blocked_ms"] = round(max(lag, 0.0) * 1000, 1)
+        self.stalls += 1
+        self.reports.append(stall)
+        route = stall["route"] or "<no request>"
+        LOOP_STALLS.inc(route)
+        logger.warning(
+            "Event loop blocked for %.0f ms in %s (task %s), stack when detected:\n%s",
+            stall["blocked_ms"], f"{stall['method']} {route}" if stall["method"] else route,
+            stall["task"], "\n".join(stall["stack"])
+        )
+
+    async def _run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = now = time.monotonic()
+            lag = now - start - self.interval
+            LOOP_LAG_SECONDS.observe(max(lag, 0.0))
+            self.max_lag = max(self.max_lag, lag)
+            stall, self._stall = self._stall, None
+            if stall is not None:
+                self._finish(stall, lag)
+
+    async def start(self) -> None:
+        if self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = self._loop.create_task(self._run(), name="loop-watchdog")
+        self._stopping.clear()
+        self._watcher = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watcher.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def report(self) -> Dict:
+        """Totals and the recent stalls, newest first"""
+        recent: List[Dict] = list(reversed(self.reports))
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "recent": recent,
+        }
+
+
+class LoopWatchdogMiddleware:
+    """Lets the watchdog tell which request the task blocking the loop was serving"""
+
+    def __init__(self, app, watchdog: LoopWatchdog):
+        self.app = app
+        self.watchdog = watchdog
+
+    async def __call__(self, scope, receive, send):
+        task = asyncio.current_task()
+        if scope["type"] != "http" or task is None:
+            await self.app(scope, receive, send)
+            return
+        self.watchdog.requests[task] = (scope, scope.get("root_path", ""))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.watchdog.requests.pop(task, None)
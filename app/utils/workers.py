@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessPool:
+    """A ProcessPoolExecutor started on first use and replaced when it breaks.
+
+    A worker that dies abruptly (OOM-killed, segfault in a native library)
+    breaks the whole executor: every pending and later call raises
+    BrokenProcessPool. run() then drops that executor, starts a new one and
+    retries the call once, so one crash does not fail every later chart or
+    image until the process restarts.
+    """
+
+    def __init__(self, workers: int, name: str):
+        self.workers = workers
+        self.name = name
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that runs the persistence threads is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _replace(self, broken: ProcessPoolExecutor) -> None:
+        # Concurrent calls all see the same broken executor, only the first replaces it
+        if self._executor is broken:
+            logger.warning("The %s worker pool broke (a worker died), starting a new one", self.name)
+            self._executor = None
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """fn(*args) in a worker process"""
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor()
+            try:
+                return await loop.run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                self._replace(executor)
+                if attempt:
+                    raise
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
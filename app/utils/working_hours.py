@@ -1,7 +1,16 @@
 from datetime import datetime, time
-from typing import Optional
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
 from ..models.models import Shop, WorkingHours, WorkingDay
 
+# Shops keep local Paraguay hours
+TIMEZONE = ZoneInfo("America/Asuncion")
+
+# WorkingHours fields in datetime.weekday() order
+DAYS = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
 def parse_time(time_str: str) -> time:
     """Convert a string in format 'HH:MM' to time object"""
     try:
@@ -46,22 +55,48 @@ def parse_legacy_working_hours(legacy_hours: dict) -> WorkingHours:
             
     return working_hours
 
-def is_shop_open(shop: Shop) -> bool:
-    """Check if a shop is currently open based on its working hours"""
-    if not shop.working_hours:
-        return False
-        
-    now = datetime.now()
-    current_day = now.strftime('%A').lower()
-    current_time = now.time()
-    
-    # Get the working hours for the current day
-    day_schedule: Optional[WorkingDay] = getattr(shop.working_hours, current_day)
-    
-    if not day_schedule or not day_schedule.is_open:
-        return False
-        
-    return day_schedule.open_time <= current_time <= day_schedule.close_time
+def local_time(moment: Optional[datetime] = None) -> datetime:
+    """Convert moment (default: now) to Paraguay local time; naive datetimes are taken as local already"""
+    if moment is None:
+        return datetime.now(TIMEZONE)
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=TIMEZONE)
+    return moment.astimezone(TIMEZONE)
+
+def minute_of_week(moment: Optional[datetime] = None) -> int:
+    """Minutes since Monday 00:00 local time"""
+    moment = local_time(moment)
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+def weekly_intervals(working_hours: Optional[WorkingHours]) -> List[Tuple[int, int]]:
+    """Opening intervals as [start, end) minutes of the week, one per open day.
+
+    A close time at or before the open time means the shop closes after
+    midnight, so the interval runs into the next day (past the end of the
+    week for Sunday nights).
+    """
+    intervals = []
+    if not working_hours:
+        return intervals
+    for day_index, day in enumerate(DAYS):
+        day_schedule: Optional[WorkingDay] = getattr(working_hours, day)
+        if not day_schedule or not day_schedule.is_open:
+            continue
+        start = day_index * MINUTES_PER_DAY + day_schedule.open_time.hour * 60 + day_schedule.open_time.minute
+        end = day_index * MINUTES_PER_DAY + day_schedule.close_time.hour * 60 + day_schedule.close_time.minute
+        if end <= start:
+            end += MINUTES_PER_DAY
+        intervals.append((start, end))
+    return intervals
+
+def is_shop_open(shop: Shop, moment: Optional[datetime] = None) -> bool:
+    """Check if a shop is open at moment (default: now) based on its working hours"""
+    minute = minute_of_week(moment)
+    return any(
+        start <= minute + shift < end
+        for start, end in weekly_intervals(shop.working_hours)
+        for shift in (0, MINUTES_PER_WEEK)
+    )
 
 def format_time(t: time) -> str:
     """Format a time object to 'HH:MM' string"""
@@ -73,9 +108,8 @@ def format_working_hours(working_hours: Optional[WorkingHours]) -> Optional[dict
         return None
         
     formatted = {}
-    days = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
     
-    for day in days:
+    for day in DAYS:
         schedule = getattr(working_hours, day)
         if schedule and schedule.is_open:
             formatted[day] = f"{format_time(schedule.open_time)} - {format_time(schedule.close_time)}"
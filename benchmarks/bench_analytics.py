@@ -0,0 +1,57 @@
+"""Analytics data: counting over every shop per request vs. the incremental aggregates.
+
+Run from the project root:
+    python -m benchmarks.bench_analytics
+"""
+import time
+
+from app.models.models import DataStructure
+from app.utils.analytics import shops_by_zone, top_categories, working_hours_coverage
+from app.utils.repository import DataRepository
+from benchmarks.catalogue import generate_catalogue
+
+NUM_SHOPS = 100_000
+QUERIES = 100
+
+
+def full_scan(data: DataStructure):
+    """What the chart endpoints used to compute on every request"""
+    zone_counts, category_counts = {}, {}
+    for shop in data.shops:
+        zone_counts[shop.zone_id] = zone_counts.get(shop.zone_id, 0) + 1
+        for cat_id in shop.categories:
+            category_counts[cat_id] = category_counts.get(cat_id, 0) + 1
+    with_hours = len([shop for shop in data.shops if shop.working_hours])
+    return zone_counts, sorted(category_counts.items(), key=lambda x: x[1], reverse=True)[:15], with_hours
+
+
+def run():
+    repository = DataRepository(DataStructure(**generate_catalogue(NUM_SHOPS)))
+
+    start = time.perf_counter()
+    for _ in range(5):
+        full_scan(repository.data)
+    scan_ms = (time.perf_counter() - start) / 5 * 1000
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        shops_by_zone(repository.aggregates, repository.zones)
+        top_categories(repository.aggregates, repository.categories, 15)
+        working_hours_coverage(repository.aggregates)
+    aggregates_ms = (time.perf_counter() - start) / QUERIES * 1000
+
+    shop = repository.data.shops[0]
+    start = time.perf_counter()
+    for _ in range(1000):
+        repository.aggregates.remove(shop)
+        repository.aggregates.add(shop)
+    update_us = (time.perf_counter() - start) / 1000 * 1e6
+
+    print(f"{NUM_SHOPS} shops")
+    print(f"  full scan per request:        {scan_ms:10.3f} ms")
+    print(f"  aggregates per request:       {aggregates_ms:10.3f} ms")
+    print(f"  delta update per shop change: {update_us:10.2f} us")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,283 @@
+"""End-to-end API throughput and latency at 1k, 10k and 100k shops.
+
+Each catalogue size runs in a fresh interpreter, in a temporary directory
+holding a generated data.json, with the in-memory storage backend standing in
+for Google Cloud Storage. Requests go straight to the ASGI app (no sockets),
+CONCURRENCY at a time, with the admin cookie set. For every endpoint the
+results give the request count, throughput and p50/p99/max latency.
+
+Results are written as JSON, tagged with the git commit; --compare shows
+the p50/p99 change per endpoint between two runs (e.g. before and after a
+commit).
+
+Run from the project root:
+    python -m benchmarks.bench_api [--shops 1000 10000 100000] [--output bench_api.json]
+    python -m benchmarks.bench_api --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.catalogue import NUM_CATEGORIES, NUM_ZONES, generate_catalogue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZES = (1_000, 10_000, 100_000)
+CONCURRENCY = 8
+# Per endpoint: at most REQUESTS requests, stopping early after TIME_BUDGET seconds
+REQUESTS = 500
+TIME_BUDGET = 10.0
+WARMUP = 3
+
+BENCH_ENV = {
+    "STORAGE_BACKEND": "memory",
+    "GCP_BUCKET_NAME": "bench",
+    "SECRET_KEY": "benchmark-secret-key-0123456789ab",
+    "ADMIN_USERNAME": "admin",
+    "ADMIN_PASSWORD": "benchmark",
+    # No background work competing with the requests
+    "DATA_SYNC_INTERVAL_MS": "0",
+    "IMAGE_GC_INTERVAL_MS": "0",
+}
+
+
+class ASGIClient:
+    """Minimal in-process HTTP client: calls the ASGI app directly and drains the response body"""
+
+    def __init__(self, app, headers: Dict[str, str]):
+        self.app = app
+        self.headers = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+
+    async def request(self, method: str, path: str, json_body=None) -> Tuple[int, int]:
+        """Returns (status, response body size)"""
+        body = json.dumps(json_body).encode() if json_body is not None else b""
+        path, _, query = path.partition("?")
+        headers = list(self.headers)
+        if json_body is not None:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": headers, "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Event().wait()  # Never disconnects
+
+        status, size = 0, 0
+
+        async def send(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, size
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def measure(client: ASGIClient, requests: Callable[[int], Tuple[str, str, Optional[Dict]]], count: int) -> Dict:
+    """Send requests(0..count-1), CONCURRENCY at a time, until count or the time budget is reached"""
+    for i in range(WARMUP):
+        await client.request(*requests(i))
+    latencies: List[float] = []
+    errors = 0
+    sizes = 0
+    next_index = WARMUP
+    start = time.perf_counter()
+    deadline = start + TIME_BUDGET
+
+    async def worker():
+        nonlocal next_index, errors, sizes
+        while next_index < count + WARMUP and time.perf_counter() < deadline:
+            index = next_index
+            next_index += 1
+            sent = time.perf_counter()
+            status, size = await client.request(*requests(index))
+            latencies.append(time.perf_counter() - sent)
+            sizes += size
+            if status >= 400:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "response_kb": round(sizes / len(latencies) / 1024, 1),
+    }
+
+
+def new_shop(shop_id: int, rng: random.Random) -> Dict:
+    return {
+        "id": shop_id,
+        "name": f"Tienda nueva {shop_id}",
+        "owner": "Benchmark",
+        "contact_number": "595981000000",
+        "categories": rng.sample(range(1, NUM_CATEGORIES + 1), 3),
+        "working_hours": None,
+        "city": "Luque",
+        "zone_id": rng.randint(1, NUM_ZONES),
+        "categorie_pages": ["see_all"],
+        "img": "https://storage.googleapis.com/bench/shops/new.jpg",
+        "description": None,
+    }
+
+
+def scenarios(num_shops: int) -> List[Tuple[str, Callable[[int], Tuple[str, str, Optional[Dict]]]]]:
+    """(name, index -> (method, path, body)); writes only touch shops they create"""
+    rng = random.Random(7)
+    shop_ids = [rng.randint(1, num_shops) for _ in range(REQUESTS + WARMUP)]
+    first_new = num_shops + 1
+    return [
+        ("GET /api/data", lambda i: ("GET", "/api/data", None)),
+        ("GET /api/shops", lambda i: ("GET", "/api/shops", None)),
+        ("GET /api/shops/{id}", lambda i: ("GET", f"/api/shops/{shop_ids[i]}", None)),
+        ("GET /api/shops/open", lambda i: ("GET", "/api/shops/open?at=2025-03-12T10:30:00", None)),
+        ("GET /api/shops/search", lambda i: ("GET", f"/api/shops/search?q=tienda%20{shop_ids[i] % 100}", None)),
+        ("GET /api/analytics/shops-by-zone", lambda i: ("GET", "/api/analytics/shops-by-zone", None)),
+        ("GET /api/analytics/categories", lambda i: ("GET", "/api/analytics/categories", None)),
+        ("GET /api/analytics/working-hours", lambda i: ("GET", "/api/analytics/working-hours", None)),
+        ("GET /shops-by-zone", lambda i: ("GET", "/shops-by-zone", None)),
+        ("GET /analytics", lambda i: ("GET", "/analytics", None)),
+        ("POST /api/shops", lambda i: ("POST", "/api/shops", new_shop(first_new + i, rng))),
+        ("PATCH /api/shops/{id}", lambda i: ("PATCH", f"/api/shops/{first_new + i}", {"name": f"Renombrada {i}"})),
+        ("DELETE /api/shops/{id}", lambda i: ("DELETE", f"/api/shops/{first_new + i}", None)),
+    ]
+
+
+async def run_size(num_shops: int) -> Dict:
+    """Runs inside the worker interpreter, with data.json in the working directory"""
+    start = time.perf_counter()
+    from app.main import app, persistence
+    from app.utils.security import create_access_token
+    import_s = time.perf_counter() - start
+
+    token = create_access_token({"sub": os.environ["ADMIN_USERNAME"]})
+    client = ASGIClient(app, {
+        "cookie": f'Authorization="Bearer {token}"',
+        "accept-encoding": "br, gzip",
+        "host": "bench",
+    })
+    results = {}
+    async with app.router.lifespan_context(app):
+        for name, requests in scenarios(num_shops):
+            # Writes must not run out of shops created by the previous step
+            count = REQUESTS
+            if name.startswith(("PATCH", "DELETE")):
+                count = results["POST /api/shops"]["requests"]
+            results[name] = await measure(client, requests, count)
+            print(f"  {name:36s} {results[name]['rps']:9.1f} req/s  p50 {results[name]['p50_ms']:9.2f} ms"
+                  f"  p99 {results[name]['p99_ms']:9.2f} ms", file=sys.stderr)
+        await persistence.flush()
+    return {"startup_ms": round(import_s * 1000, 1), "endpoints": results}
+
+
+def spawn_size(num_shops: int) -> Dict:
+    """Run one catalogue size in a fresh interpreter and return its results"""
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "data.json"), "w", encoding="utf-8") as f:
+            json.dump(generate_catalogue(num_shops), f, ensure_ascii=False)
+        # The app resolves app/static, app/templates and data.json from the working directory
+        os.symlink(os.path.join(ROOT, "app"), os.path.join(workdir, "app"))
+        env = dict(os.environ, PYTHONPATH=ROOT, **{key: os.getenv(key, value) for key, value in BENCH_ENV.items()})
+        env.setdefault("PERSISTENCE_MODE", "sync")
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_api", "--worker", str(num_shops)],
+            cwd=workdir, env=env, stdout=subprocess.PIPE, text=True
+        )
+        if result.returncode != 0:
+            sys.exit(f"Benchmark at {num_shops} shops failed")
+        # The last line is the JSON result, anything before it is app output
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path: str, after_path: str) -> None:
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+    print(f"{before.get('commit')} -> {after.get('commit')}: p50 / p99 change (negative is faster)")
+    for size, result in after["sizes"].items():
+        old_size = before["sizes"].get(size)
+        if old_size is None:
+            continue
+        print(f"{size} shops")
+        for name, stats in result["endpoints"].items():
+            old = old_size["endpoints"].get(name)
+            if old is None:
+                continue
+            changes = [
+                f"{(stats[key] - old[key]) / old[key] * 100:+7.1f}%" if old[key] else "    n/a"
+                for key in ("p50_ms", "p99_ms")
+            ]
+            print(f"  {name:36s} {old['p50_ms']:9.2f} -> {stats['p50_ms']:9.2f} ms {changes[0]}   "
+                  f"{old['p99_ms']:9.2f} -> {stats['p99_ms']:9.2f} ms {changes[1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shops", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--output", default="bench_api.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.worker:
+        print(json.dumps(asyncio.run(run_size(args.worker))))
+        return
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "persistence_mode": os.getenv("PERSISTENCE_MODE", "sync"),
+        "concurrency": CONCURRENCY,
+        "sizes": {},
+    }
+    for num_shops in args.shops:
+        print(f"{num_shops} shops", file=sys.stderr)
+        report["sizes"][str(num_shops)] = spawn_size(num_shops)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
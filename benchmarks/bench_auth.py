@@ -0,0 +1,74 @@
+"""Auth overhead per protected request: JWT decode with debug prints vs. the verified-token cache.
+
+The prints go to a line-buffered stream on os.devnull, like stdout in a
+container running with PYTHONUNBUFFERED or attached to a terminal: one
+write per print.
+
+Run from the project root:
+    python -m benchmarks.bench_auth
+"""
+import asyncio
+import contextlib
+import os
+import time
+from datetime import timedelta
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-0123456789ab")
+os.environ.setdefault("ADMIN_USERNAME", "admin")
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+from jose import jwt
+from starlette.requests import Request
+
+from app.utils import security
+from app.utils.security import ALGORITHM, create_access_token, get_current_user
+
+REQUESTS = 20_000
+
+
+async def legacy_get_current_user(request: Request) -> str:
+    """What get_current_user used to do on every request"""
+    auth_cookie = request.cookies.get("Authorization")
+    token = auth_cookie.replace("Bearer ", "")
+    print(f"DEBUG: Attempting to decode token: {token[:20]}...")
+    payload = jwt.decode(token, security.SECRET_KEY, algorithms=[ALGORITHM])
+    print(f"DEBUG: Successfully decoded token payload: {payload}")
+    username = payload.get("sub")
+    if username != security.ADMIN_USERNAME:
+        print(f"DEBUG: Username mismatch: {username} != {security.ADMIN_USERNAME}")
+        raise ValueError(username)
+    print(f"DEBUG: Authentication successful for {username}")
+    return username
+
+
+def make_request(token: str) -> Request:
+    cookie = f"Authorization=\"Bearer {token}\"".encode()
+    return Request({"type": "http", "method": "GET", "path": "/api/shops", "headers": [(b"cookie", cookie)]})
+
+
+async def measure(dependency, request: Request, clear_cache: bool = False) -> float:
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        if clear_cache:
+            security.token_cache.clear()
+        await dependency(request)
+    return (time.perf_counter() - start) / REQUESTS * 1_000_000
+
+
+async def run():
+    token = create_access_token({"sub": security.ADMIN_USERNAME}, timedelta(hours=12))
+    request = make_request(token)
+
+    with open(os.devnull, "w", buffering=1) as sink, contextlib.redirect_stdout(sink):
+        legacy_us = await measure(legacy_get_current_user, request)
+    miss_us = await measure(get_current_user, request, clear_cache=True)
+    hit_us = await measure(get_current_user, request)
+
+    print(f"{REQUESTS} authenticated requests")
+    print(f"  decode + debug prints (before):  {legacy_us:8.2f} us/request")
+    print(f"  decode + logging (cache miss):   {miss_us:8.2f} us/request")
+    print(f"  verified-token cache hit:        {hit_us:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
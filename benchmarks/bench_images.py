@@ -0,0 +1,55 @@
+"""Image bytes served: original upload vs. the optimized renditions.
+
+Uses a synthetic photo-like image (smooth gradients plus sensor noise)
+saved as a high quality JPEG with EXIF data, like a phone camera upload.
+
+Run from the project root:
+    python -m benchmarks.bench_images
+"""
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.utils.images import RENDITIONS, process_image
+
+WIDTH, HEIGHT = 3000, 2000
+RUNS = 3
+
+
+def camera_photo() -> bytes:
+    rng = np.random.default_rng(42)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    base = np.stack([
+        128 + 100 * np.sin(x / 400),
+        128 + 100 * np.cos(y / 300),
+        128 + 80 * np.sin((x + y) / 500),
+    ], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    exif = Image.Exif()
+    exif[0x010F] = "Camera"
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=95, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def run():
+    original = camera_photo()
+
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        processed = process_image(original)
+    process_ms = (time.perf_counter() - start) / RUNS * 1000
+
+    fallback_ext, fallback = processed["fallback"]
+    print(f"{WIDTH}x{HEIGHT} photo, original {len(original) / 1024:8.1f} KB")
+    print(f"  processing (one worker):     {process_ms:8.1f} ms")
+    print(f"  fallback {fallback_ext} ({RENDITIONS['banner']} px):    {len(fallback) / 1024:8.1f} KB")
+    for name, formats in processed["renditions"].items():
+        sizes = ", ".join(f"{fmt} {len(encoded) / 1024:7.1f} KB" for fmt, encoded in formats.items())
+        print(f"  {name:<9} ({RENDITIONS[name]:>4} px):      {sizes}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,63 @@
+"""Event-loop stalls during a burst of logins: bcrypt on the loop vs. on the password pool.
+
+A ticker measures how late a 10 ms sleep wakes up while LOGINS password checks
+run, once by calling verify_password directly in the handler (as login used to)
+and once through PasswordVerifier.
+
+Run from the project root:
+    python -m benchmarks.bench_login
+"""
+import asyncio
+import os
+import time
+
+import bcrypt
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-0123456789ab")
+os.environ.setdefault("ADMIN_USERNAME", "admin")
+os.environ.setdefault("ADMIN_PASSWORD", bcrypt.hashpw(b"benchmark", bcrypt.gensalt(12)).decode())
+
+from app.utils import security
+from app.utils.security import PasswordVerifier, verify_password
+
+LOGINS = 8
+TICK = 0.01
+
+
+async def ticker(stop: asyncio.Event, lags: list) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append((time.perf_counter() - start - TICK) * 1000)
+
+
+async def inline_login(password: str) -> bool:
+    await asyncio.sleep(0)
+    return verify_password(password, security.ADMIN_PASSWORD)
+
+
+async def measure(login) -> tuple:
+    stop, lags = asyncio.Event(), []
+    tick = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(TICK * 2)
+    start = time.perf_counter()
+    await asyncio.gather(*(login("wrong-password") for _ in range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    return elapsed, max(lags)
+
+
+async def run():
+    verifier = PasswordVerifier(workers=2)
+    inline_s, inline_lag = await measure(inline_login)
+    pool_s, pool_lag = await measure(lambda password: verifier.authenticate(security.ADMIN_USERNAME, password))
+    verifier.close()
+
+    print(f"{LOGINS} concurrent logins (bcrypt cost 12)")
+    print(f"  bcrypt on the event loop (before):  {inline_s:6.2f} s total, worst loop stall {inline_lag:8.1f} ms")
+    print(f"  bcrypt on the password pool:        {pool_s:6.2f} s total, worst loop stall {pool_lag:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
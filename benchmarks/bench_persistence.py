@@ -0,0 +1,63 @@
+"""Per-mutation write cost: full data.json rewrite vs. journal append.
+
+Run from the project root:
+    python -m benchmarks.bench_persistence
+"""
+import json
+import os
+import tempfile
+import time
+
+from app.models.models import DataStructure
+from app.utils.persistence import JournalStore
+from app.utils.repository import DataRepository
+from benchmarks.catalogue import generate_catalogue
+
+NUM_SHOPS = 100_000
+MUTATIONS = 50
+
+
+def full_rewrite(path: str, data: DataStructure) -> None:
+    """What save_data used to do on every mutation"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data.model_dump(mode="json", round_trip=True), f, indent=2, ensure_ascii=False)
+
+
+def run():
+    catalogue = generate_catalogue(NUM_SHOPS)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(catalogue, f)
+
+        store = JournalStore(path, compact_after=10 ** 9)
+        repository = DataRepository(store.load())
+        shop_ids = [shop.id for shop in repository.data.shops[:MUTATIONS]]
+
+        start = time.perf_counter()
+        for shop_id in shop_ids[:5]:
+            shop = repository.get_shop(shop_id)
+            repository.replace_shop(shop_id, shop.model_copy(update={"name": shop.name + " *"}))
+            repository.drain_changes()
+            full_rewrite(path, repository.data)
+        rewrite_ms = (time.perf_counter() - start) / 5 * 1000
+
+        start = time.perf_counter()
+        for shop_id in shop_ids:
+            shop = repository.get_shop(shop_id)
+            repository.replace_shop(shop_id, shop.model_copy(update={"name": shop.name + " *"}))
+            store.commit(repository.drain_changes())
+        journal_ms = (time.perf_counter() - start) / len(shop_ids) * 1000
+
+        start = time.perf_counter()
+        store.compact()
+        compact_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{NUM_SHOPS} shops")
+    print(f"  full rewrite per mutation:   {rewrite_ms:10.2f} ms")
+    print(f"  journal append + fsync:      {journal_ms:10.2f} ms")
+    print(f"  compaction (background job): {compact_ms:10.2f} ms")
+
+
+if __name__ == "__main__":
+    run()
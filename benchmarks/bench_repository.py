@@ -0,0 +1,63 @@
+"""Compare the old linear list scans with the indexed DataRepository lookups.
+
+Run from the project root:
+    python -m benchmarks.bench_repository
+"""
+import random
+import timeit
+
+from app.models.models import DataStructure
+from app.utils.repository import DataRepository
+from benchmarks.catalogue import generate_catalogue
+
+SIZES = [100, 10_000, 100_000]
+LOOKUPS = 1_000
+
+
+def scan_get_shop(data: DataStructure, shop_id: int):
+    for shop in data.shops:
+        if shop.id == shop_id:
+            return shop
+    return None
+
+
+def scan_validate(data: DataStructure, category_ids, zone_id: int) -> bool:
+    for cat_id in category_ids:
+        if not any(c.id == cat_id for c in data.categories):
+            return False
+    return any(z.id == zone_id for z in data.zones)
+
+
+def indexed_validate(repository: DataRepository, category_ids, zone_id: int) -> bool:
+    return not repository.missing_categories(category_ids) and repository.zone_exists(zone_id)
+
+
+def run():
+    rng = random.Random(7)
+    print(f"{'shops':>8} {'operation':<22} {'scan (us)':>12} {'indexed (us)':>14} {'speedup':>9}")
+    for size in SIZES:
+        data = DataStructure(**generate_catalogue(size))
+        repository = DataRepository(data)
+        ids = [rng.randint(1, size) for _ in range(LOOKUPS)]
+        shops = [repository.get_shop(i) for i in ids]
+
+        cases = {
+            "get_shop": (
+                lambda: [scan_get_shop(data, i) for i in ids],
+                lambda: [repository.get_shop(i) for i in ids],
+            ),
+            "validate references": (
+                lambda: [scan_validate(data, s.categories, s.zone_id) for s in shops],
+                lambda: [indexed_validate(repository, s.categories, s.zone_id) for s in shops],
+            ),
+        }
+        for name, (scan, indexed) in cases.items():
+            # The scan path is slow at 100k, so fewer repeats keep the run short
+            number = 1 if size >= 100_000 else 5
+            scan_us = min(timeit.repeat(scan, number=number, repeat=3)) / number / LOOKUPS * 1e6
+            indexed_us = min(timeit.repeat(indexed, number=number, repeat=3)) / number / LOOKUPS * 1e6
+            print(f"{size:>8} {name:<22} {scan_us:>12.2f} {indexed_us:>14.3f} {scan_us / indexed_us:>8.0f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,57 @@
+"""Open-shop queries: is_shop_open per shop vs. the vectorized weekly schedule.
+
+Run from the project root:
+    python -m benchmarks.bench_schedule
+"""
+import time
+from datetime import datetime, timedelta
+
+from app.models.models import DataStructure
+from app.utils.repository import DataRepository
+from app.utils.working_hours import TIMEZONE, is_shop_open
+from benchmarks.catalogue import generate_catalogue
+
+NUM_SHOPS = 100_000
+QUERIES = 50
+
+
+def run():
+    data = DataStructure(**generate_catalogue(NUM_SHOPS))
+
+    start = time.perf_counter()
+    repository = DataRepository(data)
+    build_ms = (time.perf_counter() - start) * 1000
+    schedule = repository.schedule
+
+    moment = datetime(2026, 10, 21, 10, 30, tzinfo=TIMEZONE)
+    start = time.perf_counter()
+    expected = sorted(shop.id for shop in data.shops if is_shop_open(shop, moment))
+    loop_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        ids = schedule.open_at(moment)
+    open_at_ms = (time.perf_counter() - start) / QUERIES * 1000
+    assert ids.tolist() == expected
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        schedule.open_during(moment, moment + timedelta(hours=2))
+    window_ms = (time.perf_counter() - start) / QUERIES * 1000
+
+    shop = data.shops[NUM_SHOPS // 2]
+    start = time.perf_counter()
+    for _ in range(1000):
+        schedule.set(shop.id, shop.working_hours)
+    update_us = (time.perf_counter() - start) / 1000 * 1e6
+
+    print(f"{NUM_SHOPS} shops, {len(expected)} open at {moment:%a %H:%M}")
+    print(f"  is_shop_open over every shop: {loop_ms:10.2f} ms")
+    print(f"  schedule.open_at:             {open_at_ms:10.2f} ms")
+    print(f"  schedule.open_during (2 h):   {window_ms:10.2f} ms")
+    print(f"  schedule update per shop:     {update_us:10.2f} us")
+    print(f"  repository build incl. table: {build_ms:10.2f} ms")
+
+
+if __name__ == "__main__":
+    run()
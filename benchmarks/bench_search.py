@@ -0,0 +1,75 @@
+"""Shop search at 100k shops: scanning every shop vs. the inverted index with BM25.
+
+The scan is what a search endpoint without an index would do: fold each
+query word and look for it in the folded text of every shop. The index is
+built once (on the first search), then updated per shop change.
+
+Run from the project root:
+    python -m benchmarks.bench_search [--shops 100000]
+"""
+import argparse
+import statistics
+import time
+
+from app.models.models import DataStructure, Shop
+from app.utils.repository import DataRepository
+from app.utils.search import fold
+from benchmarks.catalogue import generate_catalogue
+
+# Typeahead keystrokes and complete queries
+QUERIES = ["t", "ti", "tie", "tienda", "tienda 4", "tienda 4711", "cap", "capiata", "san lorenzo",
+           "categoria 12", "propietario 99", "luque tienda", "asuncion categoria 7"]
+ROUNDS = 20
+
+
+def scan(repository: DataRepository, query: str, limit: int = 20):
+    words = fold(query).split()
+    matches = []
+    for shop in repository.data.shops:
+        categories = " ".join(repository.categories.get(cat_id).name for cat_id in shop.categories)
+        text = fold(" ".join((shop.name, shop.owner, shop.city, shop.description or "", categories)))
+        if all(word in text for word in words):
+            matches.append(shop)
+    return matches[:limit], len(matches)
+
+
+def timed(fn, rounds: int):
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), max(times)
+
+
+def run(num_shops: int):
+    repository = DataRepository(DataStructure(**generate_catalogue(num_shops)))
+
+    start = time.perf_counter()
+    repository.search.build()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{num_shops} shops, index built in {build_ms:.0f} ms ({len(repository.search.postings)} terms)")
+    print(f"  {'query':24s} {'matches':>8s} {'scan p50':>10s} {'index p50':>10s} {'index max':>10s}")
+    for query in QUERIES:
+        scan_ms, _ = timed(lambda: scan(repository, query), 1)
+        index_ms, index_max = timed(lambda: repository.search_shops(query), ROUNDS)
+        total = repository.search_shops(query)[2]
+        print(f"  {query!r:24s} {total:8d} {scan_ms:8.1f}ms {index_ms:8.2f}ms {index_max:8.2f}ms")
+
+    # A shop change, then the first search touching the changed terms rebuilds their arrays
+    shop = repository.get_shop(num_shops // 2)
+
+    def update():
+        repository.replace_shop(shop.id, Shop(**dict(shop.model_dump(), name=f"Tienda renombrada {time.time_ns()}")))
+
+    update_ms, _ = timed(update, ROUNDS)
+    after_ms, _ = timed(lambda: (update(), repository.search_shops("tienda")), ROUNDS)
+    print(f"  shop update (index maintenance included): {update_ms:.2f} ms")
+    print(f"  update + search 'tienda' (array rebuilt): {after_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shops", type=int, default=100_000)
+    run(parser.parse_args().shops)
@@ -0,0 +1,76 @@
+"""/api/data cost: serializing on every request vs. the cached compressed snapshot.
+
+Also reports the longest the event loop went without running while a
+snapshot was rebuilt (the rebuild runs in a thread, in chunks).
+
+Run from the project root:
+    python -m benchmarks.bench_snapshot
+"""
+import asyncio
+import time
+
+from fastapi.responses import JSONResponse
+
+from app.models.models import DataStructure
+from app.utils.repository import DataRepository
+from app.utils.snapshot import SnapshotCache
+from benchmarks.catalogue import generate_catalogue
+
+NUM_SHOPS = 10_000
+REQUESTS = 20
+
+
+async def longest_stall(work) -> float:
+    """Run work() and return the longest gap between 1 ms heartbeats meanwhile, in ms"""
+    longest = 0.0
+    done = False
+
+    async def heartbeat():
+        nonlocal longest
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            longest = max(longest, time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(heartbeat())
+    await work()
+    done = True
+    await task
+    return longest * 1000
+
+
+async def run():
+    repository = DataRepository(DataStructure(**generate_catalogue(NUM_SHOPS)))
+    cache = SnapshotCache(repository)
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        body = JSONResponse(repository.data.model_dump(mode="json")).body
+    per_request_ms = (time.perf_counter() - start) / REQUESTS * 1000
+
+    start = time.perf_counter()
+    snapshot = await cache.snapshot()
+    sizes = {"identity": len(snapshot.body)}
+    for encoding in ("gzip", "br"):
+        sizes[encoding] = len(await cache.encoded(snapshot, encoding))
+    rebuild_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await cache.encoded(await cache.snapshot(), "br")
+    cached_ms = (time.perf_counter() - start) / REQUESTS * 1000
+
+    repository.set_field("primary_banner", ["https://example.com/banner.jpg"])
+    stall_ms = await longest_stall(cache.snapshot)
+
+    print(f"{NUM_SHOPS} shops")
+    print(f"  model_dump + JSONResponse per request: {per_request_ms:10.3f} ms ({len(body)} bytes)")
+    print(f"  snapshot rebuild after a mutation:     {rebuild_ms:10.3f} ms")
+    print(f"  cached snapshot per request:           {cached_ms:10.3f} ms")
+    print(f"  longest event-loop stall in a rebuild: {stall_ms:10.3f} ms")
+    for encoding, size in sizes.items():
+        print(f"  {encoding:>8} body: {size:10d} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+"""Cold start cost: importing app.main and loading a large data.json.
+
+Run from the project root:
+    python -m benchmarks.bench_startup [--shops 100000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from app.models.models import DataStructure
+from app.utils.persistence import JournalStore
+from benchmarks.catalogue import generate_catalogue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so nothing is imported yet
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("pandas", "plotly", "google.cloud.storage", "magic") if name in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+
+def import_app(workdir: str):
+    """Time `import app.main` in a subprocess, with data.json in workdir"""
+    # The app resolves app/static, app/templates and data.json from the working directory
+    os.symlink(os.path.join(ROOT, "app"), os.path.join(workdir, "app"))
+    env = dict(
+        os.environ,
+        PYTHONPATH=workdir,
+        GCP_BUCKET_NAME=os.getenv("GCP_BUCKET_NAME", "bench"),
+        SECRET_KEY=os.getenv("SECRET_KEY", "bench-secret"),
+        ADMIN_USERNAME=os.getenv("ADMIN_USERNAME", "admin"),
+        ADMIN_PASSWORD=os.getenv("ADMIN_PASSWORD", "admin"),
+    )
+    result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=workdir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    # The app prints its own startup messages first
+    elapsed, _, heavy = result.stdout.strip().splitlines()[-1].partition(" ")
+    return float(elapsed), heavy
+
+
+def run(num_shops: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data.json")
+        with open(path, "w", encoding="utf-8") as f:
+            # Pretty-printed like the real data.json
+            json.dump(generate_catalogue(num_shops), f, indent=2, ensure_ascii=False)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            DataStructure(**json.load(f))
+        dict_load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            DataStructure.model_validate_json(f.read())
+        raw_load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        JournalStore(path).load()
+        store_load_ms = (time.perf_counter() - start) * 1000
+
+        import_s, heavy = import_app(tmp)
+
+    print(f"{num_shops} shops ({size_mb:.1f} MB data.json)")
+    print(f"  json.load + DataStructure(**data): {dict_load_ms:10.1f} ms")
+    print(f"  model_validate_json on raw bytes:  {raw_load_ms:10.1f} ms")
+    print(f"  JournalStore.load (GC paused):     {store_load_ms:10.1f} ms")
+    print(f"  import app.main (incl. loading):   {import_s * 1000:10.1f} ms")
+    print(f"  heavy modules loaded at import:    {heavy or 'none'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shops", type=int, default=100_000, help="number of synthetic shops")
+    run(parser.parse_args().shops)
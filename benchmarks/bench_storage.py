@@ -0,0 +1,69 @@
+"""Image uploads against a simulated remote store: blocking calls on the event loop vs. the storage pool.
+
+Uses the in-memory LocalStorage stand-in with STORAGE_LATENCY per operation,
+so it runs without Google Cloud Storage. Event loop lag is measured by a
+ticker that should wake up every TICK seconds.
+
+Run from the project root:
+    python -m benchmarks.bench_storage
+"""
+import asyncio
+import io
+import time
+
+from starlette.datastructures import Headers, UploadFile
+
+from app.utils.storage import LocalStorage
+
+UPLOADS = 64
+CONCURRENCY = 8
+STORAGE_LATENCY = 0.05
+TICK = 0.005
+# A 1x1 GIF
+IMAGE = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+
+
+def image_upload() -> UploadFile:
+    return UploadFile(io.BytesIO(IMAGE), filename="pixel.gif", headers=Headers({"content-type": "image/gif"}))
+
+
+class BlockingStorage(LocalStorage):
+    """What upload_file used to do: the blocking call runs on the event loop"""
+
+    async def _call(self, operation, fn, *args):
+        return fn(*args)
+
+
+async def ticker(lags: list, done: asyncio.Event) -> None:
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def measure(storage: LocalStorage):
+    lags, done = [], asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, done))
+    start = time.perf_counter()
+    urls = await asyncio.gather(*(storage.upload_file(image_upload(), folder="shops") for _ in range(UPLOADS)))
+    await asyncio.gather(*(storage.delete_file(url) for url in urls))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick_task
+    storage.close()
+    return elapsed, max(lags) * 1000
+
+
+def run():
+    options = dict(latency=STORAGE_LATENCY, concurrency=CONCURRENCY)
+    blocking_s, blocking_lag = asyncio.run(measure(BlockingStorage(**options)))
+    pooled_s, pooled_lag = asyncio.run(measure(LocalStorage(**options)))
+
+    ops = UPLOADS * 2
+    print(f"{UPLOADS} uploads + {UPLOADS} deletes, {STORAGE_LATENCY * 1000:.0f} ms per operation")
+    print(f"  blocking on the loop:       {ops / blocking_s:8.1f} ops/s, max loop lag {blocking_lag:8.1f} ms")
+    print(f"  storage pool ({CONCURRENCY} threads): {ops / pooled_s:8.1f} ops/s, max loop lag {pooled_lag:8.1f} ms")
+
+
+if __name__ == "__main__":
+    run()
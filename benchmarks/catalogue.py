@@ -0,0 +1,61 @@
+"""Deterministic synthetic catalogue used by the benchmarks"""
+import random
+from typing import Dict, List, Optional
+
+CITIES = ["Ciudad del Este", "Capiatá", "Luque", "San Lorenzo", "Villa Elisa", "Asunción"]
+NUM_CATEGORIES = 74
+NUM_ZONES = 6
+WEEKDAYS = ["lunes", "martes", "miércoles", "jueves", "viernes"]
+
+
+def generate_working_hours(rng: random.Random) -> Optional[Dict]:
+    """Working hours shaped like the real data: mostly weekday shops, some Saturdays, a few night shops"""
+    kind = rng.random()
+    if kind < 0.15:
+        return None
+    if kind < 0.2:
+        # Night shop closing after midnight, every day
+        day = {"open_time": "18:00", "close_time": f"0{rng.randint(0, 3)}:00", "is_open": True}
+        return {name: dict(day) for name in WEEKDAYS + ["sábado", "domingo"]}
+    day = {
+        "open_time": f"{rng.choice([7, 8, 9]):02d}:{rng.choice(['00', '30'])}",
+        "close_time": f"{rng.choice([17, 18, 19]):02d}:00",
+        "is_open": True,
+    }
+    hours = {name: dict(day) for name in WEEKDAYS}
+    hours["sábado"] = {"open_time": "08:00", "close_time": "12:00", "is_open": True} if rng.random() < 0.6 else None
+    hours["domingo"] = None
+    return hours
+
+
+def generate_catalogue(num_shops: int, seed: int = 42) -> Dict:
+    """Return a data.json-shaped dict with num_shops shops"""
+    rng = random.Random(seed)
+    categories = [{"id": i, "name": f"Categoría {i}", "icon": None} for i in range(1, NUM_CATEGORIES + 1)]
+    zones = [{"id": i, "name": CITIES[(i - 1) % len(CITIES)]} for i in range(1, NUM_ZONES + 1)]
+    shops: List[Dict] = []
+    for shop_id in range(1, num_shops + 1):
+        zone_id = rng.randint(1, NUM_ZONES)
+        shops.append({
+            "id": shop_id,
+            "name": f"Tienda {shop_id}",
+            "owner": f"Propietario {shop_id}",
+            "contact_number": f"5959{rng.randint(10000000, 99999999)}",
+            "categories": rng.sample(range(1, NUM_CATEGORIES + 1), rng.randint(1, 6)),
+            "working_hours": generate_working_hours(rng),
+            "city": CITIES[(zone_id - 1) % len(CITIES)],
+            "zone_id": zone_id,
+            "categorie_pages": ["see_all"],
+            "img": f"https://storage.googleapis.com/bench/shops/{shop_id}.jpg",
+            "description": None,
+        })
+    return {
+        "shops": shops,
+        "categories": categories,
+        "zones": zones,
+        "primary_banner": [],
+        "secondary_banner": [],
+        "recommended_image": "",
+        "other_businesses": "",
+        "branding": None,
+    }
@@ -0,0 +1,37 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """app.main run from a temporary directory, on a copy of data.json"""
+    work = tmp_path_factory.mktemp("app")
+    shutil.copy(os.path.join(ROOT, "data.json"), work)
+    # Templates and static files are looked up relative to the working directory
+    os.symlink(os.path.join(ROOT, "app"), work / "app")
+    os.environ.update(
+        SECRET_KEY="test-secret-key",
+        ADMIN_USERNAME="admin",
+        ADMIN_PASSWORD="admin",
+        STORAGE_BACKEND="memory",
+        DATA_SYNC_INTERVAL_MS="0",
+        IMAGE_GC_INTERVAL_MS="0",
+    )
+    os.chdir(work)
+    sys.path.insert(0, ROOT)
+    import app.main
+    return app.main
+
+
+@pytest.fixture(scope="session")
+def client(app_module):
+    from fastapi.testclient import TestClient
+    from app.utils.security import create_access_token
+    with TestClient(app_module.app) as client:
+        client.cookies.set("Authorization", "Bearer " + create_access_token({"sub": "admin"}))
+        yield client
@@ -0,0 +1,72 @@
+def shop_data(client, shop_id):
+    """An existing shop's data under a new id"""
+    shop = client.get("/api/shops/1").json()
+    shop.pop("img_renditions", None)
+    return {**shop, "id": shop_id}
+
+
+def test_create_over_an_existing_id_is_rejected(client, app_module):
+    before = app_module.repository.get_shop(2).model_dump()
+    for operation in (
+        {"op": "create", "entity": "shops", "id": 2, "data": shop_data(client, 2)},
+        {"op": "create", "entity": "shops", "data": shop_data(client, 2)},
+    ):
+        response = client.post("/api/batch", json=[operation])
+        assert response.status_code == 400
+        assert response.json()["detail"] == {"index": 0, "error": "Shop ID already exists"}
+    assert app_module.repository.get_shop(2).model_dump() == before
+
+
+def test_create_over_an_id_created_earlier_in_the_batch_is_rejected(client, app_module):
+    response = client.post("/api/batch", json=[
+        {"op": "create", "entity": "zones", "data": {"id": 9100, "name": "First"}},
+        {"op": "create", "entity": "zones", "id": 9100, "data": {"id": 9100, "name": "Second"}},
+    ])
+    assert response.status_code == 400
+    assert response.json()["detail"]["index"] == 1
+    assert app_module.repository.get_zone(9100) is None
+
+
+def test_rename_onto_an_existing_id_is_rejected(client, app_module):
+    response = client.post("/api/batch", json=[
+        {"op": "patch", "entity": "shops", "id": 3, "data": {"id": 4}},
+    ])
+    assert response.status_code == 400
+    assert response.json()["detail"] == {"index": 0, "error": "Shop ID already exists"}
+    assert app_module.repository.get_shop(3) is not None
+    assert app_module.repository.get_shop(4).name != app_module.repository.get_shop(3).name
+
+
+def test_failing_operation_leaves_nothing_applied(client, app_module):
+    version = app_module.data_store.current_version()
+    name = app_module.repository.get_shop(5).name
+    response = client.post("/api/batch", json=[
+        {"op": "create", "entity": "categories", "data": {"id": 9200, "name": "Batch"}},
+        {"op": "patch", "entity": "shops", "id": 5, "data": {"name": "Renamed"}},
+        {"op": "delete", "entity": "zones", "id": 9999},
+        {"op": "create", "entity": "shops", "data": shop_data(client, 9201)},
+    ])
+    assert response.status_code == 404
+    assert response.json()["detail"]["index"] == 2
+    assert app_module.repository.get_category(9200) is None
+    assert app_module.repository.get_shop(5).name == name
+    assert app_module.repository.get_shop(9201) is None
+    assert app_module.data_store.current_version() == version
+
+
+def test_successful_batch_persists_with_one_write(client, app_module):
+    version = app_module.data_store.current_version()
+    shop = {**shop_data(client, 9301), "categories": [9300]}
+    response = client.post("/api/batch", json=[
+        {"op": "create", "entity": "categories", "data": {"id": 9300, "name": "Batch"}},
+        {"op": "create", "entity": "shops", "data": shop},
+        {"op": "patch", "entity": "shops", "id": 6, "data": {"name": "Patched in a batch"}},
+    ])
+    assert response.status_code == 200
+    assert response.json()["applied"] == 3
+    assert app_module.data_store.current_version() == version + 1
+
+    stored = app_module.data_store.load()
+    assert any(category.id == 9300 for category in stored.categories)
+    assert [shop.categories for shop in stored.shops if shop.id == 9301] == [[9300]]
+    assert [shop.name for shop in stored.shops if shop.id == 6] == ["Patched in a batch"]
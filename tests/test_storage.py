@@ -0,0 +1,42 @@
+import pytest
+
+from app.utils.storage import LazyStorage, LocalStorage, cloud_base_url, path_under
+
+BUCKET_URL = cloud_base_url("our-bucket")
+
+
+def failing_factory():
+    raise AssertionError("owns() must not build the backend")
+
+
+def test_lazy_storage_owns_without_building_the_backend():
+    storage = LazyStorage(failing_factory, base_url=BUCKET_URL)
+    assert storage.owns(f"{BUCKET_URL}/shops/abc.jpg")
+    assert not storage.initialized
+
+
+@pytest.mark.parametrize("url", [
+    "https://storage.googleapis.com/other-bucket/shops/abc.jpg",
+    "https://storage.googleapis.com/our-bucket-2/shops/abc.jpg",
+    "https://example.com/storage.googleapis.com/our-bucket/shops/abc.jpg",
+    f"{BUCKET_URL}/",
+    "",
+])
+def test_urls_outside_our_bucket_are_not_owned(url):
+    assert not LazyStorage(failing_factory, base_url=BUCKET_URL).owns(url)
+    with pytest.raises(ValueError):
+        path_under(BUCKET_URL, url)
+
+
+def test_unconfigured_storage_owns_nothing():
+    assert not LazyStorage(failing_factory, base_url=None).owns(f"{BUCKET_URL}/shops/abc.jpg")
+
+
+def test_local_storage_maps_its_urls_to_paths():
+    storage = LocalStorage(base_url="/uploads/")
+    try:
+        assert storage.public_url("shops/abc.jpg") == "/uploads/shops/abc.jpg"
+        assert storage.path_from_url("/uploads/shops/abc.jpg") == "shops/abc.jpg"
+        assert not storage.owns("/static/shops/abc.jpg")
+    finally:
+        storage.close()